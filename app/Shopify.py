@@ -1,12 +1,284 @@
 import os
+import json
 import time
+import asyncio
 import requests
 
 from app.logger import logger
+from app.rate_limit import LeakyBucket
+from app.session import create_async_client, create_session
+
+
+class ShopifyRateLimiter(LeakyBucket):
+    """Leaky bucket compartido para la API de Shopify.
+
+    El estado se sincroniza con lo que informa Shopify en cada respuesta
+    (header X-Shopify-Shop-Api-Call-Limit para REST y extensions.cost.throttleStatus
+    para GraphQL), y solo se bloquea cuando el bucket esta realmente cerca de llenarse.
+    """
+
+    name = "Shopify"
+
+    def __init__(self, bucket_size: int = 40, margin: int = 2, graphql_maximum: float = 1000.0,
+                 graphql_restore_rate: float = 50.0, graphql_default_cost: float = 10.0):
+        # REST: el bucket se vacia a razon de bucket_size / 20 llamadas por segundo
+        super().__init__(bucket_size, bucket_size / 20, margin)
+
+        # GraphQL: puntos disponibles que se restauran a restore_rate por segundo
+        self.graphql_maximum = graphql_maximum
+        self.graphql_restore_rate = graphql_restore_rate
+        self.graphql_available = graphql_maximum
+        self.graphql_updated_at = time.monotonic()
+        self.graphql_blocked_until = 0.0
+        self.graphql_default_cost = graphql_default_cost
+
+    def _restore(self, now: float):
+        elapsed = now - self.graphql_updated_at
+        self.graphql_available = min(self.graphql_maximum, self.graphql_available + elapsed * self.graphql_restore_rate)
+        self.graphql_updated_at = now
+
+    def reserve_graphql(self, cost: float = None) -> float:
+        """Reserva puntos de GraphQL y devuelve cuantos segundos hay que esperar."""
+        cost = cost if cost is not None else self.graphql_default_cost
+        with self.lock:
+            now = time.monotonic()
+            self._restore(now)
+            delay = max(0.0, self.graphql_blocked_until - now)
+            missing = cost - self.graphql_available
+            if missing > 0:
+                delay = max(delay, missing / self.graphql_restore_rate)
+            self.graphql_available -= cost
+            return delay
+
+    def acquire_graphql(self, cost: float = None):
+        delay = self.reserve_graphql(cost)
+        if delay > 0:
+            logger.info(f"Shopify GraphQL rate limit: waiting {delay:.2f}s")
+            time.sleep(delay)
+
+    async def acquire_graphql_async(self, cost: float = None):
+        delay = self.reserve_graphql(cost)
+        if delay > 0:
+            logger.info(f"Shopify GraphQL rate limit: waiting {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def update_from_headers(self, headers):
+        """Sincroniza el bucket REST con el header de Shopify (ej: "32/40")."""
+        call_limit = headers.get("X-Shopify-Shop-Api-Call-Limit")
+        if not call_limit:
+            return
+        try:
+            used, size = (float(value) for value in call_limit.split("/"))
+        except ValueError:
+            return
+        self.sync(used, bucket_size=size, leak_rate=size / 20)
+
+    def update_from_graphql(self, payload: dict):
+        """Sincroniza los puntos de GraphQL con extensions.cost.throttleStatus."""
+        throttle_status = ((payload or {}).get("extensions") or {}).get("cost", {}).get("throttleStatus")
+        if not throttle_status:
+            return
+        with self.lock:
+            self.graphql_maximum = float(throttle_status.get("maximumAvailable", self.graphql_maximum))
+            self.graphql_restore_rate = float(throttle_status.get("restoreRate", self.graphql_restore_rate))
+            self.graphql_available = float(throttle_status.get("currentlyAvailable", self.graphql_available))
+            self.graphql_updated_at = time.monotonic()
+
+    def block_graphql(self, seconds: float):
+        """Frena las llamadas GraphQL durante `seconds`."""
+        with self.lock:
+            self.graphql_blocked_until = max(self.graphql_blocked_until, time.monotonic() + seconds)
+
+    def call_graphql(self, send, cost: float, max_retries: int):
+        """Como call, para GraphQL: respeta los puntos disponibles y reintenta si es THROTTLED."""
+        for attempt in range(max_retries + 1):
+            self.acquire_graphql(cost)
+            response = send()
+            wait = graphql_retry_wait(self, response, cost)
+            if wait is None or attempt == max_retries:
+                return response
+            logger.warning(f"Shopify GraphQL throttled, retrying in {wait:.2f}s")
+            self.block_graphql(wait)
+        return response
+
+    async def call_graphql_async(self, send, cost: float, max_retries: int):
+        for attempt in range(max_retries + 1):
+            await self.acquire_graphql_async(cost)
+            response = await send()
+            wait = graphql_retry_wait(self, response, cost)
+            if wait is None or attempt == max_retries:
+                return response
+            logger.warning(f"Shopify GraphQL throttled, retrying in {wait:.2f}s")
+            self.block_graphql(wait)
+        return response
+
+
+# Un unico limitador para todo el proceso: el limite de Shopify es por tienda
+shopify_rate_limiter = ShopifyRateLimiter()
+
+
+# Estados en los que una bulk operation ya no corre (y se puede lanzar otra)
+BULK_OPERATION_DONE = ("COMPLETED", "FAILED", "CANCELED", "EXPIRED")
+
+
+def retry_after_seconds(response, default: float = 2.0) -> float:
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except (TypeError, ValueError):
+        return default
+
+
+def rest_retry_wait(response, attempt: int):
+    """Ante un 429 se espera lo que indica Retry-After; el resto no se reintenta."""
+    return retry_after_seconds(response) if response.status_code == 429 else None
+
+
+def to_gid(resource: str, resource_id) -> str:
+    """Convierte un ID numerico de la API REST al ID global de GraphQL."""
+    resource_id = str(resource_id)
+    if resource_id.startswith("gid://"):
+        return resource_id
+    return f"gid://shopify/{resource}/{resource_id}"
+
+
+def is_graphql_throttled(payload: dict) -> bool:
+    errors = (payload or {}).get("errors") or []
+    if not isinstance(errors, list):
+        return False
+    return any((error.get("extensions") or {}).get("code") == "THROTTLED" for error in errors)
+
+
+def graphql_retry_wait(rate_limiter: ShopifyRateLimiter, response, cost: float = None):
+    """Sincroniza los puntos de GraphQL con la respuesta y devuelve cuanto esperar para
+    reintentarla, o None si no hay que reintentar (no vino 429 ni THROTTLED)."""
+    if response.status_code == 429:
+        return retry_after_seconds(response)
+    try:
+        payload = response.json()
+    except ValueError:
+        return None
+    rate_limiter.update_from_graphql(payload)
+    if not is_graphql_throttled(payload):
+        return None
+    # Espero lo necesario para recuperar el costo pedido
+    requested = payload.get("extensions", {}).get("cost", {}).get("requestedQueryCost", cost or 0)
+    return max(1.0, float(requested) / rate_limiter.graphql_restore_rate)
+
+
+INVENTORY_SET_QUANTITIES_MUTATION = """mutation inventorySetQuantities($input: InventorySetQuantitiesInput!) {
+    inventorySetQuantities(input: $input) {
+        inventoryAdjustmentGroup {
+            id
+        }
+        userErrors {
+            field
+            message
+            code
+        }
+    }
+}"""
+
+INVENTORY_ACTIVATE_MUTATION = """mutation inventoryActivate($inventoryItemId: ID!, $locationId: ID!, $available: Int) {
+    inventoryActivate(inventoryItemId: $inventoryItemId, locationId: $locationId, available: $available) {
+        inventoryLevel {
+            id
+        }
+        userErrors {
+            field
+            message
+        }
+    }
+}"""
+
+# Error de inventorySetQuantities cuando el item no esta conectado al deposito; a diferencia
+# de inventory_levels/set.json, la mutation no lo conecta sola
+NOT_STOCKED_AT_LOCATION = "Not stocked at location"
+
+
+def inventory_quantities_request(quantities: list, reason: str) -> dict:
+    return {
+        "query": INVENTORY_SET_QUANTITIES_MUTATION,
+        "variables": {
+            "input": {
+                "name": "available",
+                "reason": reason,
+                "ignoreCompareQuantity": True,
+                "quantities": [
+                    {
+                        "inventoryItemId": to_gid("InventoryItem", item["inventory_item_id"]),
+                        "locationId": to_gid("Location", item["location_id"]),
+                        "quantity": item["quantity"]
+                    }
+                    for item in quantities
+                ]
+            }
+        }
+    }
+
+
+def inventory_quantities_errors(response, count: int) -> list:
+    """Un error por item (None si se seteo bien) a partir de la respuesta de inventorySetQuantities."""
+    if response.status_code != 200:
+        logger.error(f"Error setting inventory quantities in Shopify: {response.status_code} - {response.text}")
+        return [f"HTTP {response.status_code}"] * count
+
+    payload = response.json()
+    if payload.get("errors"):
+        logger.error(f"Error setting inventory quantities in Shopify: {payload['errors']}")
+        return [str(payload["errors"])] * count
+
+    errors = [None] * count
+    result = (payload.get("data") or {}).get("inventorySetQuantities") or {}
+    for user_error in result.get("userErrors", []):
+        # field viene como ["input", "quantities", "<indice>", "<campo>"]
+        field = user_error.get("field") or []
+        if len(field) > 2 and field[1] == "quantities" and str(field[2]).isdigit():
+            not_stocked = user_error.get("code") == "ITEM_NOT_STOCKED_AT_LOCATION" or "not stocked" in str(user_error.get("message")).lower()
+            errors[int(field[2])] = NOT_STOCKED_AT_LOCATION if not_stocked else user_error.get("message")
+        else:
+            # Un error que no es de un item en particular hace fallar toda la mutation
+            errors = [user_error.get("message")] * count
+            break
+    logger.info(f"Set {errors.count(None)} of {count} inventory quantities in Shopify")
+    return errors
+
+
+def inventory_activate_request(item: dict) -> dict:
+    return {
+        "query": INVENTORY_ACTIVATE_MUTATION,
+        "variables": {
+            "inventoryItemId": to_gid("InventoryItem", item["inventory_item_id"]),
+            "locationId": to_gid("Location", item["location_id"]),
+            "available": item["quantity"]
+        }
+    }
+
+
+def inventory_activate_error(response, item: dict):
+    """El error de inventoryActivate, o None si el item quedo conectado al deposito con su stock."""
+    payload = response.json() if response.status_code == 200 else {}
+    result = (payload.get("data") or {}).get("inventoryActivate") or {}
+    if result.get("inventoryLevel") and not result.get("userErrors"):
+        logger.info(f"Activated inventory item {item['inventory_item_id']} at location {item['location_id']}")
+        return None
+    error = str(result.get("userErrors") or payload.get("errors") or f"HTTP {response.status_code}")
+    logger.error(f"Error activating inventory item {item['inventory_item_id']} at location {item['location_id']}: {error}")
+    return error
+
+
+def handle_chunk_params(handles, chunk_size: int) -> list:
+    """Params de /products.json para traer los productos de a `chunk_size` handles."""
+    handles = sorted({str(handle) for handle in handles})
+    return [
+        {"fields": "id,handle,variants", "handle": ",".join(handles[start:start + chunk_size]), "limit": 250}
+        for start in range(0, len(handles), chunk_size)
+    ]
 
 
 class Shopify():
-    def __init__(self):
+    MAX_RETRIES = 5
+
+    def __init__(self, rate_limiter: ShopifyRateLimiter = None, session: requests.Session = None):
         self.SHOPIFY_STORE_URL = os.getenv("SHOPIFY_STORE_URL")
         self.SHOPIFY_ACCESS_TOKEN = os.getenv("SHOPIFY_ACCESS_TOKEN")
         self.SHOPIFY_API_VERSION = os.getenv("SHOPIFY_API_VERSION")
@@ -16,9 +288,24 @@ class Shopify():
             "Content-Type": "application/json",
             "X-Shopify-Access-Token": self.SHOPIFY_ACCESS_TOKEN
         }
+        self.rate_limiter = rate_limiter or shopify_rate_limiter
+        pool_size = int(os.getenv("SHOPIFY_POOL_SIZE", 0)) or None
+        self.session = session or create_session(pool_size)
+
+    def _request(self, method: str, url: str, **kwargs):
+        """Hace una llamada REST respetando el rate limit y reintentando los 429."""
+        return self.rate_limiter.call(lambda: self.session.request(method, url, **kwargs),
+                                      rest_retry_wait, self.MAX_RETRIES, f"{method} {url}")
+
+    def _graphql(self, data: dict, cost: float = None):
+        """Hace una llamada GraphQL respetando los puntos disponibles y reintentando si es THROTTLED."""
+        return self.rate_limiter.call_graphql(
+            lambda: self.session.post(f"{self.SHOPIFY_API_URL}/graphql.json", headers=self.SHOPIFY_HEADERS, json=data),
+            cost, self.MAX_RETRIES
+        )
 
     def get_products(self, params: dict = {}):
-        response = requests.get(f"{self.SHOPIFY_API_URL}/products.json", params=params, headers=self.SHOPIFY_HEADERS)
+        response = self._request("GET", f"{self.SHOPIFY_API_URL}/products.json", params=params, headers=self.SHOPIFY_HEADERS)
         if response.status_code != 200:
             logger.error(f"Error fetching products from Shopify: {response.status_code} - {response.text}")
             return {}
@@ -26,7 +313,7 @@ class Shopify():
         return response.json()
 
     def get_product(self, product_id: int, params: dict = {}):
-        response = requests.get(f"{self.SHOPIFY_API_URL}/products/{product_id}.json", params=params, headers=self.SHOPIFY_HEADERS)
+        response = self._request("GET", f"{self.SHOPIFY_API_URL}/products/{product_id}.json", params=params, headers=self.SHOPIFY_HEADERS)
         if response.status_code != 200:
             logger.error(f"Error fetching product from Shopify: {response.status_code} - {response.text}")
             return {}
@@ -34,7 +321,7 @@ class Shopify():
         return response.json()
 
     def create_product(self, data: dict):
-        response = requests.post(f"{self.SHOPIFY_API_URL}/products.json", headers=self.SHOPIFY_HEADERS, json=data)
+        response = self._request("POST", f"{self.SHOPIFY_API_URL}/products.json", headers=self.SHOPIFY_HEADERS, json=data)
         if response.status_code != 201:
             logger.error(f"Error creating product in Shopify: {response.status_code} - {response.text}")
             return {}
@@ -42,15 +329,23 @@ class Shopify():
         return response.json()
 
     def update_product(self, product_id: int, data: dict):
-        response = requests.put(f"{self.SHOPIFY_API_URL}/products/{product_id}.json", headers=self.SHOPIFY_HEADERS, json=data)
+        response = self._request("PUT", f"{self.SHOPIFY_API_URL}/products/{product_id}.json", headers=self.SHOPIFY_HEADERS, json=data)
         if response.status_code != 200:
             logger.error(f"Error updating product in Shopify: {response.status_code} - {response.text}")
             return {}
         logger.info(f"Updated product {product_id} in Shopify")
         return response.json()
 
+    def update_variant(self, variant_id: int, data: dict):
+        response = self._request("PUT", f"{self.SHOPIFY_API_URL}/variants/{variant_id}.json", headers=self.SHOPIFY_HEADERS, json=data)
+        if response.status_code != 200:
+            logger.error(f"Error updating variant in Shopify: {response.status_code} - {response.text}")
+            return {}
+        logger.info(f"Updated variant {variant_id} in Shopify")
+        return response.json()
+
     def set_inventory_level(self, data: dict):
-        response = requests.post(f"{self.SHOPIFY_API_URL}/inventory_levels/set.json", headers=self.SHOPIFY_HEADERS, json=data)
+        response = self._request("POST", f"{self.SHOPIFY_API_URL}/inventory_levels/set.json", headers=self.SHOPIFY_HEADERS, json=data)
         if response.status_code != 200:
             logger.error(f"Error setting inventory level in Shopify: {response.status_code} - {response.text}")
             return {}
@@ -64,15 +359,64 @@ class Shopify():
                 "inventory_item_id": inventory_item_id,
                 "available": 0
             }
-        response = requests.post(f"{self.SHOPIFY_API_URL}/inventory_levels/set.json", headers=self.SHOPIFY_HEADERS, json=data)
+        response = self._request("POST", f"{self.SHOPIFY_API_URL}/inventory_levels/set.json", headers=self.SHOPIFY_HEADERS, json=data)
         if response.status_code != 200:
             logger.error(f"Error setting default inventory level in Shopify: {response.status_code} - {response.text} - {response.content}")
             return {}
         logger.info("Set default inventory level in Shopify")
         return response.json()
 
+    def set_inventory_quantities(self, quantities: list, reason: str = "correction") -> list:
+        """Setea el stock disponible de muchos (inventory_item, location) en una sola mutation.
+
+        Args:
+            quantities: Lista de {"inventory_item_id", "location_id", "quantity"}
+            reason: Motivo que queda registrado en el historial de inventario
+
+        Returns:
+            list: Un error por item (None si se seteo bien), en el mismo orden que `quantities`
+        """
+        response = self._graphql(inventory_quantities_request(quantities, reason), cost=10)
+        errors = inventory_quantities_errors(response, len(quantities))
+        # Los items nuevos en un deposito que no es el suyo se conectan con su stock inicial
+        for index, error in enumerate(errors):
+            if error == NOT_STOCKED_AT_LOCATION:
+                errors[index] = self.activate_inventory(quantities[index])
+        return errors
+
+    def activate_inventory(self, item: dict):
+        """Conecta un inventory item a un deposito con su stock. Devuelve el error o None."""
+        response = self._graphql(inventory_activate_request(item), cost=10)
+        return inventory_activate_error(response, item)
+
+    def get_inventory_levels(self, inventory_item_ids, location_id, chunk_size: int = 50) -> dict:
+        """Lee el stock disponible de varios inventory items en un deposito.
+
+        Returns:
+            dict: inventory_item_id (str) -> disponible (None si no tiene stock en el deposito),
+            solo de los que se pudieron leer
+        """
+        inventory_item_ids = [str(item_id) for item_id in inventory_item_ids]
+        levels = {}
+        for start in range(0, len(inventory_item_ids), chunk_size):
+            chunk = inventory_item_ids[start:start + chunk_size]
+            params = {
+                "inventory_item_ids": ",".join(chunk),
+                "location_ids": location_id,
+                "limit": 250
+            }
+            response = self._request("GET", f"{self.SHOPIFY_API_URL}/inventory_levels.json", params=params, headers=self.SHOPIFY_HEADERS)
+            if response.status_code != 200:
+                logger.error(f"Error fetching inventory levels from Shopify: {response.status_code} - {response.text}")
+                continue
+            levels.update(dict.fromkeys(chunk))
+            for level in response.json().get("inventory_levels", []):
+                levels[str(level["inventory_item_id"])] = level.get("available")
+        logger.info(f"Fetched {len(levels)} inventory levels from Shopify for location {location_id}")
+        return levels
+
     def get_product_images(self, product_id: int):
-        response = requests.get(f"{self.SHOPIFY_API_URL}/products/{product_id}/images.json", headers=self.SHOPIFY_HEADERS)
+        response = self._request("GET", f"{self.SHOPIFY_API_URL}/products/{product_id}/images.json", headers=self.SHOPIFY_HEADERS)
         if response.status_code != 200:
             logger.error(f"Error fetching product images from Shopify: {response.status_code} - {response.text}")
             return {}
@@ -88,15 +432,32 @@ class Shopify():
         if variant_ids:
             data["image"]["variant_ids"] = variant_ids
 
-        response = requests.post(f"{self.SHOPIFY_API_URL}/products/{product_id}/images.json", headers=self.SHOPIFY_HEADERS, json=data)
+        response = self._request("POST", f"{self.SHOPIFY_API_URL}/products/{product_id}/images.json", headers=self.SHOPIFY_HEADERS, json=data)
         return {
             "status": response.status_code,
             "response": response.json(),
             "image_alt": image.get("alt")
         }
 
+    def update_product_image(self, product_id: int, image_id: int, data: dict):
+        response = self._request("PUT", f"{self.SHOPIFY_API_URL}/products/{product_id}/images/{image_id}.json", headers=self.SHOPIFY_HEADERS, json=data)
+        if response.status_code != 200:
+            logger.error(f"Error updating image {image_id} in Shopify: {response.status_code} - {response.text}")
+            return {}
+        logger.info(f"Updated image {image_id} of product {product_id} in Shopify")
+        return response.json()
+
+    def delete_product_image(self, product_id: int, image_id: int) -> bool:
+        response = self._request("DELETE", f"{self.SHOPIFY_API_URL}/products/{product_id}/images/{image_id}.json", headers=self.SHOPIFY_HEADERS)
+        # Si ya no existe no hay nada que borrar
+        if response.status_code not in (200, 404):
+            logger.error(f"Error deleting image {image_id} from Shopify: {response.status_code} - {response.text}")
+            return False
+        logger.info(f"Deleted image {image_id} of product {product_id} from Shopify")
+        return True
+
     def get_product_variants(self, product_id: int, params: dict = {}):
-        response = requests.get(f"{self.SHOPIFY_API_URL}/products/{product_id}/variants.json", params=params, headers=self.SHOPIFY_HEADERS)
+        response = self._request("GET", f"{self.SHOPIFY_API_URL}/products/{product_id}/variants.json", params=params, headers=self.SHOPIFY_HEADERS)
         if response.status_code != 200:
             logger.error(f"Error fetching product variants from Shopify: {response.status_code} - {response.text}")
             return {}
@@ -104,7 +465,7 @@ class Shopify():
         return response.json()
 
     def get_smart_collections(self, params: dict = {}):
-        response = requests.get(f"{self.SHOPIFY_API_URL}/smart_collections.json", params=params, headers=self.SHOPIFY_HEADERS)
+        response = self._request("GET", f"{self.SHOPIFY_API_URL}/smart_collections.json", params=params, headers=self.SHOPIFY_HEADERS)
         if response.status_code != 200:
             logger.error(f"Error fetching smart collections from Shopify: {response.status_code} - {response.text}")
             return {}
@@ -112,7 +473,7 @@ class Shopify():
         return response.json()
 
     def create_smart_collection(self, data: dict):
-        response = requests.post(f"{self.SHOPIFY_API_URL}/smart_collections.json", headers=self.SHOPIFY_HEADERS, json=data)
+        response = self._request("POST", f"{self.SHOPIFY_API_URL}/smart_collections.json", headers=self.SHOPIFY_HEADERS, json=data)
         if response.status_code != 201:
             logger.error(f"Error creating smart collection in Shopify: {response.status_code} - {response.text}")
             return {}
@@ -126,7 +487,8 @@ class Shopify():
                 }
             }
 
-            requests.put(
+            self._request(
+                "PUT",
                 f"{self.SHOPIFY_API_URL}/smart_collections/{collection_id}.json",
                 headers=self.SHOPIFY_HEADERS,
                 json=update_data
@@ -148,9 +510,13 @@ class Shopify():
         while True:
             request_params = params.copy()
             if next_page_info:
+                # Con page_info Shopify solo acepta limit y fields
                 request_params = {"limit": 250, "page_info": next_page_info}
+                if params.get("fields"):
+                    request_params["fields"] = params["fields"]
 
-            response = requests.get(
+            response = self._request(
+                "GET",
                 f"{self.SHOPIFY_API_URL}/products.json",
                 params=request_params,
                 headers=self.SHOPIFY_HEADERS
@@ -206,38 +572,196 @@ class Shopify():
                     "status": "draft"
                 }
             }
-        response = requests.put(f"{self.SHOPIFY_API_URL}/products/{product_id}.json", headers=self.SHOPIFY_HEADERS, json=data)
+        response = self._request("PUT", f"{self.SHOPIFY_API_URL}/products/{product_id}.json", headers=self.SHOPIFY_HEADERS, json=data)
         if response.status_code != 200:
             logger.error(f"Error deleting product from Shopify: {response.status_code} - {response.text}")
             return {}
         logger.info(f"Deleted product {product_id} from Shopify")
         return response.json()
 
-    def fetch_shopify_variants_by_handle(self, handle):
-        params = {
-            "fields": "variants",
-            "handle": handle
-        }
-        time.sleep(0.3)
-        response = self.get_products(params)
-        variants = []
-        for product in response.get("products", []):
-            variants.extend(product.get("variants", []))
-        return variants
-
-    def process_variant_stock_update(self, tienda_config, tn_variant, sh_variant):
+    def fetch_shopify_variants_by_handles(self, handles, chunk_size: int = 50) -> dict:
+        """Trae las variantes de varios productos a la vez, filtrando por lista de handles.
+
+        Args:
+            handles: Handles de los productos (IDs de producto de Tiendanube)
+            chunk_size: Handles por llamada (limita el largo de la URL)
+
+        Returns:
+            dict: handle -> producto ({"id", "handle", "variants"}) para los que existen en Shopify
+        """
+        products = {}
+        for params in handle_chunk_params(handles, chunk_size):
+            response = self.get_products(params)
+            for product in response.get("products", []):
+                products[str(product["handle"])] = product
+        logger.info(f"Resolved {len(products)} products by handle in Shopify")
+        return products
+
+    def process_variant_stock_update(self, tienda_config, tn_variant, sh_variant, inventory):
+        """Encola en `inventory` (un InventoryWriter) el stock de la variante.
+
+        No se compara con el inventory_quantity de Shopify (que suma todos los depositos):
+        si la cantidad no cambio desde la ultima escritura, el espejo de `inventory` la saltea.
+        """
         expected_sku = str(tn_variant["id"])
         stock = tn_variant["stock"] if tn_variant["stock"] is not None else 999
 
-        if sh_variant["sku"] == expected_sku and sh_variant["inventory_quantity"] != stock:
-            logger.info(f"Updating stock for variant {sh_variant['id']}")
-            data = {
-                "location_id": tienda_config['deposit'],
-                "inventory_item_id": sh_variant['inventory_item_id'],
-                "available": stock
+        if str(sh_variant["sku"]) == expected_sku:
+            inventory.set(sh_variant['inventory_item_id'], tienda_config['deposit'], stock)
+
+    def staged_upload(self, path: str, resource: str = "BULK_MUTATION_VARIABLES", mime_type: str = "text/jsonl"):
+        """Sube un archivo a un staged upload de Shopify.
+
+        Returns:
+            str: El stagedUploadPath para usar en la bulk mutation, o None si fallo
+        """
+        body = """mutation stagedUploadsCreate($input: [StagedUploadInput!]!) {
+            stagedUploadsCreate(input: $input) {
+                stagedTargets {
+                    url
+                    resourceUrl
+                    parameters {
+                        name
+                        value
+                    }
+                }
+                userErrors {
+                    field
+                    message
+                }
             }
-            time.sleep(0.3)
-            self.set_inventory_level(data)
+        }"""
+        filename = os.path.basename(path)
+        variables = {
+            "input": [{
+                "resource": resource,
+                "filename": filename,
+                "mimeType": mime_type,
+                "httpMethod": "POST"
+            }]
+        }
+        response = self._graphql({"query": body, "variables": variables})
+        result = ((response.json() if response.status_code == 200 else {}).get("data") or {}).get("stagedUploadsCreate") or {}
+        if not result.get("stagedTargets") or result.get("userErrors"):
+            logger.error(f"Error creating staged upload in Shopify: {response.status_code} - {response.text}")
+            return None
+
+        target = result["stagedTargets"][0]
+        parameters = {parameter["name"]: parameter["value"] for parameter in target["parameters"]}
+        # El archivo va directo al storage de Shopify, sin el token ni el rate limit de la API
+        with open(path, "rb") as file:
+            upload = self.session.post(target["url"], data=parameters, files={"file": (filename, file, mime_type)})
+        if upload.status_code not in (200, 201, 204):
+            logger.error(f"Error uploading {filename} to Shopify: {upload.status_code} - {upload.text}")
+            return None
+        logger.info(f"Uploaded {filename} to Shopify")
+        return parameters.get("key")
+
+    def run_bulk_mutation(self, mutation: str, staged_upload_path: str):
+        """Lanza una bulk mutation sobre las variables subidas. Devuelve el ID de la operacion."""
+        body = """mutation bulkOperationRunMutation($mutation: String!, $stagedUploadPath: String!) {
+            bulkOperationRunMutation(mutation: $mutation, stagedUploadPath: $stagedUploadPath) {
+                bulkOperation {
+                    id
+                    status
+                }
+                userErrors {
+                    field
+                    message
+                }
+            }
+        }"""
+        variables = {"mutation": mutation, "stagedUploadPath": staged_upload_path}
+        return self._run_bulk_operation(body, variables, "bulkOperationRunMutation")
+
+    def run_bulk_query(self, query: str):
+        """Lanza una bulk query. Devuelve el ID de la operacion."""
+        body = """mutation bulkOperationRunQuery($query: String!) {
+            bulkOperationRunQuery(query: $query) {
+                bulkOperation {
+                    id
+                    status
+                }
+                userErrors {
+                    field
+                    message
+                }
+            }
+        }"""
+        return self._run_bulk_operation(body, {"query": query}, "bulkOperationRunQuery")
+
+    def _run_bulk_operation(self, body: str, variables: dict, name: str):
+        response = self._graphql({"query": body, "variables": variables})
+        result = ((response.json() if response.status_code == 200 else {}).get("data") or {}).get(name) or {}
+        if not result.get("bulkOperation") or result.get("userErrors"):
+            logger.error(f"Error starting bulk operation in Shopify: {response.status_code} - {response.text}")
+            return None
+        logger.info(f"Started bulk operation {result['bulkOperation']['id']}")
+        return result["bulkOperation"]["id"]
+
+    def get_bulk_operation(self, operation_id: str) -> dict:
+        body = """query bulkOperation($id: ID!) {
+            node(id: $id) {
+                ... on BulkOperation {
+                    id
+                    status
+                    errorCode
+                    objectCount
+                    url
+                    partialDataUrl
+                }
+            }
+        }"""
+        response = self._graphql({"query": body, "variables": {"id": operation_id}})
+        if response.status_code != 200:
+            logger.error(f"Error fetching bulk operation from Shopify: {response.status_code} - {response.text}")
+            return {}
+        return (response.json().get("data") or {}).get("node") or {}
+
+    def wait_bulk_operation(self, operation_id: str, poll_interval: float = 5.0, timeout: float = 4 * 3600) -> dict:
+        """Espera a que termine una bulk operation y la devuelve (con la URL del resultado)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            operation = self.get_bulk_operation(operation_id)
+            status = operation.get("status")
+            if status in BULK_OPERATION_DONE:
+                logger.info(f"Bulk operation {operation_id} {status.lower()} with {operation.get('objectCount')} objects")
+                return operation
+            if time.monotonic() >= deadline:
+                logger.error(f"Timed out waiting for bulk operation {operation_id} (last status {status})")
+                return operation
+            time.sleep(poll_interval)
+
+    def cancel_bulk_operation(self, operation_id: str) -> bool:
+        body = """mutation bulkOperationCancel($id: ID!) {
+            bulkOperationCancel(id: $id) {
+                bulkOperation {
+                    id
+                    status
+                }
+                userErrors {
+                    field
+                    message
+                }
+            }
+        }"""
+        response = self._graphql({"query": body, "variables": {"id": operation_id}})
+        result = ((response.json() if response.status_code == 200 else {}).get("data") or {}).get("bulkOperationCancel") or {}
+        if not result.get("bulkOperation") or result.get("userErrors"):
+            logger.error(f"Error canceling bulk operation {operation_id} in Shopify: {response.status_code} - {response.text}")
+            return False
+        logger.warning(f"Canceled bulk operation {operation_id}")
+        return True
+
+    def iter_jsonl(self, url: str):
+        """Recorre el JSONL de resultado de una bulk operation linea por linea, sin bajarlo entero."""
+        with self.session.get(url, stream=True) as response:
+            if response.status_code != 200:
+                logger.error(f"Error downloading bulk operation result: {response.status_code}")
+                return
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
 
     def get_delivery_profile(self, body=None):
         if not body:
@@ -251,7 +775,7 @@ class Shopify():
                     }
                 }
             }"""
-        response = requests.post(f"{self.SHOPIFY_API_URL}/graphql.json", headers=self.SHOPIFY_HEADERS, json={"query": body})
+        response = self._graphql({"query": body})
         return response.json()
 
     def add_variants_to_delivery_profile(self, delivery_profile_id, product_variants_id):
@@ -283,9 +807,90 @@ class Shopify():
             "variables": variables
         }
 
-        response = requests.post(f"{self.SHOPIFY_API_URL}/graphql.json", headers=self.SHOPIFY_HEADERS, json=data)
+        response = self._graphql(data)
         if response.status_code != 200:
             logger.error(f"Error adding variants to the delivery profile: {response.status_code} - {response.text}")
             return {}
         logger.info("Variants successfully added to the delivery profile")
         return response.json()
+
+
+class AsyncShopify():
+    """Cliente async de Shopify sobre httpx, para tener muchas llamadas en vuelo en un
+    mismo event loop (ver app.aio). Usa el mismo rate limiter que Shopify, asi las dos
+    versiones se reparten el mismo bucket.
+
+    Solo tiene las llamadas que se hacen en cantidad; el resto sigue en Shopify.
+    """
+
+    MAX_RETRIES = 5
+
+    def __init__(self, rate_limiter: ShopifyRateLimiter = None, client=None):
+        self.SHOPIFY_API_URL = f"{os.getenv('SHOPIFY_STORE_URL')}/admin/api/{os.getenv('SHOPIFY_API_VERSION')}"
+        self.SHOPIFY_HEADERS = {
+            "Content-Type": "application/json",
+            "X-Shopify-Access-Token": os.getenv("SHOPIFY_ACCESS_TOKEN", "")
+        }
+        self.rate_limiter = rate_limiter or shopify_rate_limiter
+        self._client = client
+
+    @property
+    def client(self):
+        # Se crea en el primer uso, dentro del event loop donde se va a usar
+        if self._client is None:
+            self._client = create_async_client(int(os.getenv("SHOPIFY_POOL_SIZE", 0)) or None)
+        return self._client
+
+    async def _request(self, method: str, url: str, **kwargs):
+        # Mismos reintentos y el mismo bucket que Shopify._request
+        return await self.rate_limiter.call_async(lambda: self.client.request(method, url, **kwargs),
+                                                  rest_retry_wait, self.MAX_RETRIES, f"{method} {url}")
+
+    async def _graphql(self, data: dict, cost: float = None):
+        return await self.rate_limiter.call_graphql_async(
+            lambda: self.client.post(f"{self.SHOPIFY_API_URL}/graphql.json", headers=self.SHOPIFY_HEADERS, json=data),
+            cost, self.MAX_RETRIES
+        )
+
+    async def get_products(self, params: dict = None):
+        response = await self._request("GET", f"{self.SHOPIFY_API_URL}/products.json", params=params, headers=self.SHOPIFY_HEADERS)
+        if response.status_code != 200:
+            logger.error(f"Error fetching products from Shopify: {response.status_code} - {response.text}")
+            return {}
+        return response.json()
+
+    async def get_product(self, product_id: int, params: dict = None):
+        response = await self._request("GET", f"{self.SHOPIFY_API_URL}/products/{product_id}.json", params=params, headers=self.SHOPIFY_HEADERS)
+        if response.status_code != 200:
+            logger.error(f"Error fetching product from Shopify: {response.status_code} - {response.text}")
+            return {}
+        logger.info(f"Fetched product {product_id} from Shopify")
+        return response.json()
+
+    async def fetch_shopify_variants_by_handles(self, handles, chunk_size: int = 50) -> dict:
+        """Como Shopify.fetch_shopify_variants_by_handles, con todas las tandas en paralelo."""
+        responses = await asyncio.gather(*(self.get_products(params) for params in handle_chunk_params(handles, chunk_size)))
+        products = {
+            str(product["handle"]): product
+            for response in responses
+            for product in response.get("products", [])
+        }
+        logger.info(f"Resolved {len(products)} products by handle in Shopify")
+        return products
+
+    async def set_inventory_quantities(self, quantities: list, reason: str = "correction") -> list:
+        response = await self._graphql(inventory_quantities_request(quantities, reason), cost=10)
+        errors = inventory_quantities_errors(response, len(quantities))
+        for index, error in enumerate(errors):
+            if error == NOT_STOCKED_AT_LOCATION:
+                errors[index] = await self.activate_inventory(quantities[index])
+        return errors
+
+    async def activate_inventory(self, item: dict):
+        response = await self._graphql(inventory_activate_request(item), cost=10)
+        return inventory_activate_error(response, item)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
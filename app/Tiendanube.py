@@ -1,21 +1,241 @@
+import os
+import math
+import threading
 import requests
-from datetime import datetime
+
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
 from app.logger import logger
+from app.rate_limit import LeakyBucket
+from app.session import create_async_client, create_session
+from app.utils import parse_datetime
+
+
+class TiendanubeRateLimiter(LeakyBucket):
+    """Leaky bucket de una tienda de Tiendanube (el limite es por token).
+
+    Se sincroniza con los headers x-rate-limit-limit, x-rate-limit-remaining y
+    x-rate-limit-reset (milisegundos hasta que el bucket se vacia por completo).
+    """
+
+    name = "Tiendanube"
+
+    def __init__(self, bucket_size: int = 40, leak_rate: float = 2.0, margin: int = 1):
+        super().__init__(bucket_size, leak_rate, margin)
+
+    def update_from_headers(self, headers):
+        try:
+            remaining = headers.get("x-rate-limit-remaining")
+            if remaining is None:
+                return
+            limit = float(headers.get("x-rate-limit-limit", self.bucket_size))
+            used = limit - float(remaining)
+            reset = float(headers.get("x-rate-limit-reset", 0)) / 1000
+        except (TypeError, ValueError):
+            return
+        # Si el bucket se vacia en `reset` segundos, la tasa de salida real es used / reset
+        leak_rate = used / reset if used > 0 and reset > 0 else None
+        self.sync(used, bucket_size=limit, leak_rate=leak_rate)
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(headers: dict) -> TiendanubeRateLimiter:
+    """Devuelve el limitador de la tienda, identificada por su token de acceso."""
+    key = headers.get("Authentication") or headers.get("Authorization") or str(sorted(headers.items()))
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = TiendanubeRateLimiter()
+        return _rate_limiters[key]
+
+
+def backoff_seconds(response, attempt: int) -> float:
+    """Tiempo de espera ante un 429: lo que indica la API o backoff exponencial."""
+    try:
+        reset = float(response.headers.get("x-rate-limit-reset", 0)) / 1000
+    except (TypeError, ValueError):
+        reset = 0
+    return max(reset, 0.5 * 2 ** attempt)
+
+
+def retry_wait(response, attempt: int):
+    """Solo se reintentan los 429."""
+    return backoff_seconds(response, attempt) if response.status_code == 429 else None
+
+
+class ProductListing():
+    """Productos de un listado de Tiendanube, pidiendo las paginas a medida que se recorren.
+
+    Con el x-total-count de la primera respuesta calcula cuantas paginas hay y pide las
+    siguientes en paralelo (hasta `workers` por delante de la que se esta recorriendo),
+    siempre dentro del rate limit de la tienda. Los productos salen en el orden de las
+    paginas y nunca hay mas de `workers` paginas en memoria, asi que se puede empezar a
+    procesar apenas llega la primera. Despues de recorrerlo, `complete` es False si alguna
+    pagina fallo aun con reintentos.
+
+    Args:
+        tiendanube: Cliente de Tiendanube
+        url: URL de /products de la tienda
+        headers: Headers de la tienda
+        params: Filtros de la API (published, updated_at_min, fields, ...)
+        per_page: Productos por pagina
+        limit: Cantidad maxima de productos (los mas nuevos)
+        oldest_first: Recorre del mas viejo al mas nuevo
+        workers: Paginas que se piden en paralelo
+    """
+
+    def __init__(self, tiendanube, url: str, headers: dict, params: dict = None,
+                 per_page: int = 200, limit: int = None, oldest_first: bool = False, workers: int = 4):
+        self.tiendanube = tiendanube
+        self.url = url
+        self.headers = headers
+        self.params = params or {}
+        self.per_page = per_page
+        self.limit = limit
+        self.oldest_first = oldest_first
+        self.workers = max(int(workers), 1)
+        self.complete = True
+
+    def __iter__(self):
+        self.complete = True
+        if not self.oldest_first:
+            yield from self._products("created-at-descending")
+        elif self.limit:
+            # Con limite son los N mas nuevos: hay que juntarlos para darlos vuelta,
+            # pero nunca son mas que `limit`
+            products = list(self._products("created-at-descending"))
+            yield from reversed(products)
+        else:
+            # Sin limite se lo pido ordenado a la API y no hace falta tener todo en memoria
+            yield from self._products("created-at-ascending")
+
+    def _products(self, sort_by: str):
+        fetched = 0
+        for current_products in self._pages(sort_by):
+            # Si se especificó un límite, no paso de ahi
+            if self.limit:
+                current_products = current_products[:self.limit - fetched]
+            fetched += len(current_products)
+            yield from current_products
+            if self.limit and fetched >= self.limit:
+                return
+
+    def _fetch(self, page: int, sort_by: str):
+        params = {**self.params, "per_page": self.per_page, "page": page, "sort_by": sort_by}
+        current_products, total = self.tiendanube.get_products_page(self.url, self.headers, params)
+        if current_products:
+            logger.info(f"Página {page} - Productos descargados: {len(current_products)}")
+        return current_products, total
+
+    def _pages(self, sort_by: str):
+        """Devuelve las paginas en orden; corta en la primera vacia o que fallo."""
+        current_products, total = self._fetch(1, sort_by)
+        if current_products is None:
+            self._incomplete()
+            return
+        if not current_products:
+            return
+        yield current_products
+
+        if total is None:
+            # Sin x-total-count no se sabe cuantas paginas hay: sigo de a una
+            page = 1
+            while len(current_products) == self.per_page:
+                page += 1
+                current_products, _ = self._fetch(page, sort_by)
+                if current_products is None:
+                    self._incomplete()
+                    return
+                if not current_products:
+                    return
+                yield current_products
+            return
+
+        wanted = min(total, self.limit) if self.limit else total
+        pages = iter(range(2, math.ceil(wanted / self.per_page) + 1))
+        prefix = threading.current_thread().name
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{prefix}-pages")
+        try:
+            pending = deque(executor.submit(self._fetch, page, sort_by) for page in islice(pages, self.workers))
+            while pending:
+                current_products, _ = pending.popleft().result()
+                for page in islice(pages, 1):
+                    pending.append(executor.submit(self._fetch, page, sort_by))
+                if current_products is None:
+                    self._incomplete()
+                    return
+                if not current_products:
+                    return
+                yield current_products
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _incomplete(self):
+        # La pagina fallo aun con reintentos: el listado queda incompleto
+        logger.warning(f"Incomplete product listing for {self.url}")
+        self.complete = False
 
 
 class Tiendanube():
+    MAX_RETRIES = 5
+
+    def __init__(self, session: requests.Session = None):
+        pool_size = int(os.getenv("TIENDANUBE_POOL_SIZE", 0)) or None
+        self.session = session or create_session(pool_size)
+        # Paginas de un listado que se piden en paralelo
+        self.page_workers = int(os.getenv("TIENDANUBE_PAGE_WORKERS", 4))
+
+    def _request(self, method: str, url: str, headers: dict, **kwargs):
+        """Hace una llamada respetando el rate limit de la tienda y reintentando los 429."""
+        return get_rate_limiter(headers).call(lambda: self.session.request(method, url, headers=headers, **kwargs),
+                                              retry_wait, self.MAX_RETRIES, f"{method} {url}")
 
     def get_products(self, url: str, headers: dict, params: dict):
-        response = requests.get(url, headers=headers, params=params)
+        """Devuelve una pagina de productos, o None si la llamada fallo
+        (para no confundir un error con el fin del catalogo)."""
+        products, _ = self.get_products_page(url, headers, params)
+        return products
+
+    def get_products_page(self, url: str, headers: dict, params: dict):
+        """Como get_products, pero devuelve tambien el total del listado.
+
+        Returns:
+            tuple: (productos o None, x-total-count o None si no vino)
+        """
+        response = self._request("GET", url, headers, params=params)
+        if response.status_code == 404 and params.get("page", 1) > 1:
+            # Tiendanube responde 404 cuando se pide una pagina que ya no existe
+            return [], None
         if response.status_code != 200:
             logger.error(f"Error fetching products from Tiendanube: {response.status_code} - {response.text}")
-            return []
+            return None, None
+        try:
+            total = int(response.headers.get("x-total-count"))
+        except (TypeError, ValueError):
+            total = None
         logger.info(f"Fetched {len(response.json())} products from Tiendanube")
+        return response.json(), total
+
+    def get_product(self, url: str, headers: dict, params: dict = None):
+        response = self._request("GET", url, headers, params=params)
+        if response.status_code != 200:
+            logger.error(f"Error fetching product from Tiendanube: {response.status_code} - {response.text}")
+            return {}
+        logger.info(f"Fetched product {url} from Tiendanube")
         return response.json()
 
+    def iter_products(self, url: str, headers: dict, params: dict = None, limit: int = None,
+                      oldest_first: bool = False) -> ProductListing:
+        """Devuelve un ProductListing que va trayendo las paginas a medida que se recorre."""
+        return ProductListing(self, url, headers, params, limit=limit, oldest_first=oldest_first,
+                              workers=self.page_workers)
+
     def update_stock(self, url: str, headers: dict, data: dict):
-        response = requests.post(url, headers=headers, json=data)
+        response = self._request("POST", url, headers, json=data)
         if response.status_code != 200:
             logger.error(f"Error updating stock in Tiendanube: {response.status_code} - {response.text}")
             return {}
@@ -23,7 +243,7 @@ class Tiendanube():
         return response.json()
 
     def get_categories(self, url: str, headers: dict, params: dict):
-        response = requests.get(url, headers=headers, params=params)
+        response = self._request("GET", url, headers, params=params)
         if response.status_code != 200:
             logger.error(f"Error fetching categories from Tiendanube: {response.status_code} - {response.text}")
             return []
@@ -33,38 +253,67 @@ class Tiendanube():
     def fetch_recent_variants(self, tienda_config, updated_at_min):
         url = f"{tienda_config['url']}/products"
         headers = tienda_config['headers']
-        page = 1
-        products = []
+        params = {
+            "published": "true",
+            "fields": "variants",
+            "updated_at_min": updated_at_min
+        }
+        min_date = parse_datetime(updated_at_min)
         variants = []
 
-        while True:
-            params = {
-                "per_page": 200,
-                "published": "true",
-                "fields": "variants",
-                "page": page,
-                "updated_at_min": updated_at_min
-            }
+        # Me quedo solo con las variantes de cada pagina, no con los productos
+        listing = self.iter_products(url, headers, params)
+        for product in listing:
+            for variant in product.get("variants", []):
+                variant_date = parse_datetime(variant["updated_at"])
+                if variant_date >= min_date:
+                    variants.append(variant)
 
-            response = requests.get(url, headers=headers, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                products.extend(data)
+        if not listing.complete:
+            logger.error(f"Error fetching products from Tiendanube for {url}")
+            return []
 
-                total_prod = int(response.headers.get("x-total-count", 0))
+        return variants
 
-                if len(products) >= total_prod:
-                    break
 
-                page += 1
-            else:
-                logger.error(f"Error fetching products from Tiendanube: {response.status_code} - {response.text}")
-                return []
+class AsyncTiendanube():
+    """Cliente async de Tiendanube sobre httpx (ver app.aio). Comparte con Tiendanube los
+    rate limiters por tienda, asi las dos versiones respetan el mismo limite."""
 
-        for product in products:
-            for variant in product.get("variants", []):
-                variant_date = datetime.strptime(variant["updated_at"], "%Y-%m-%dT%H:%M:%S%z").isoformat()
-                if variant_date >= updated_at_min:
-                    variants.append(variant)
+    MAX_RETRIES = 5
 
-        return variants
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        # Se crea en el primer uso, dentro del event loop donde se va a usar
+        if self._client is None:
+            self._client = create_async_client(int(os.getenv("TIENDANUBE_POOL_SIZE", 0)) or None)
+        return self._client
+
+    async def _request(self, method: str, url: str, headers: dict, **kwargs):
+        # Mismos reintentos y el mismo bucket por tienda que Tiendanube._request
+        return await get_rate_limiter(headers).call_async(lambda: self.client.request(method, url, headers=headers, **kwargs),
+                                                          retry_wait, self.MAX_RETRIES, f"{method} {url}")
+
+    async def get_product(self, url: str, headers: dict, params: dict = None):
+        response = await self._request("GET", url, headers, params=params)
+        if response.status_code != 200:
+            logger.error(f"Error fetching product from Tiendanube: {response.status_code} - {response.text}")
+            return {}
+        logger.info(f"Fetched product {url} from Tiendanube")
+        return response.json()
+
+    async def update_stock(self, url: str, headers: dict, data: dict):
+        response = await self._request("POST", url, headers, json=data)
+        if response.status_code != 200:
+            logger.error(f"Error updating stock in Tiendanube: {response.status_code} - {response.text}")
+            return {}
+        logger.info("Stock updated in Tiendanube")
+        return response.json()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
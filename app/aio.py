@@ -0,0 +1,40 @@
+import asyncio
+import threading
+
+from app.logger import logger
+
+
+class BackgroundLoop():
+    """Event loop de asyncio corriendo en su propio hilo.
+
+    Los clientes async (AsyncShopify, AsyncTiendanube) guardan conexiones atadas a un
+    loop, asi que todo lo async del proceso corre en este. Los jobs del scheduler y el
+    worker de pedidos, que son hilos comunes, le mandan corutinas con `run` y esperan el
+    resultado; adentro pueden tener cientos de llamadas en vuelo a la vez.
+    """
+
+    def __init__(self, name: str = "asyncio"):
+        self.name = name
+        self.loop = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self.loop.run_forever, name=self.name, daemon=True)
+                thread.start()
+                logger.info("Started the background event loop")
+        return self.loop
+
+    def run(self, coroutine, timeout: float = None):
+        """Corre la corutina en el loop y bloquea hasta que termina (devuelve su resultado)."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._start()).result(timeout)
+
+
+background_loop = BackgroundLoop()
+
+
+def run_async(coroutine, timeout: float = None):
+    """Version sincronica de una llamada async, para usar desde el scheduler."""
+    return background_loop.run(coroutine, timeout)
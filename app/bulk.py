@@ -0,0 +1,368 @@
+import os
+import json
+import tempfile
+import threading
+
+from app.logger import logger
+from app.Shopify import BULK_OPERATION_DONE
+
+# Shopify corre una sola bulk operation por vez en la tienda, asi que las tiendas esperan su turno
+_bulk_lock = threading.Lock()
+
+PRODUCT_SET_MUTATION = """mutation productSet($input: ProductSetInput!) {
+    productSet(input: $input) {
+        product {
+            id
+            legacyResourceId
+            handle
+            status
+            variants(first: 250) {
+                nodes {
+                    id
+                    legacyResourceId
+                    sku
+                    inventoryItem {
+                        legacyResourceId
+                    }
+                }
+            }
+        }
+        userErrors {
+            field
+            message
+        }
+    }
+}"""
+
+# Lo minimo para reconciliar un vendor: handles, SKUs e inventory items. Una bulk query
+# admite a lo sumo dos niveles de conexiones, asi que el stock va en INVENTORY_LEVELS_QUERY
+CATALOG_QUERY = """{
+    products(query: "vendor:'%s'") {
+        edges {
+            node {
+                id
+                handle
+                variants {
+                    edges {
+                        node {
+                            id
+                            sku
+                            inventoryItem {
+                                id
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}"""
+
+# Stock disponible de cada inventory item por deposito; se cruza con el resto por el ID del item
+INVENTORY_LEVELS_QUERY = """{
+    inventoryItems {
+        edges {
+            node {
+                id
+                inventoryLevels {
+                    edges {
+                        node {
+                            id
+                            location {
+                                id
+                            }
+                            quantities(names: ["available"]) {
+                                name
+                                quantity
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}"""
+
+PUBLISH_MUTATION = """mutation publishablePublish($id: ID!, $input: [PublicationInput!]!) {
+    publishablePublish(id: $id, input: $input) {
+        userErrors {
+            field
+            message
+        }
+    }
+}"""
+
+
+def finish_bulk_operation(shopify, operation_id: str, poll_interval: float = 5.0) -> dict:
+    """Espera a que termine la bulk operation; si se vence la espera, la cancela y espera a
+    que quede cancelada. Se llama con `_bulk_lock` tomado: soltarlo con la operacion todavia
+    corriendo haria fallar la de la tienda siguiente."""
+    operation = shopify.wait_bulk_operation(operation_id, poll_interval)
+    if operation.get("status") in BULK_OPERATION_DONE:
+        return operation
+    shopify.cancel_bulk_operation(operation_id)
+    return shopify.wait_bulk_operation(operation_id, poll_interval, timeout=float("inf"))
+
+
+class BulkMutation():
+    """Una bulk mutation de Shopify: cada llamada es una linea de variables en un JSONL.
+
+    Las lineas se escriben a disco a medida que se agregan (no quedan en memoria) y se
+    parten en varios archivos si superan el tamaño maximo que acepta Shopify. `run` sube
+    cada archivo a un staged upload, lanza la mutation, espera a que termine y devuelve
+    los resultados leyendo el JSONL de respuesta linea por linea.
+
+    Args:
+        shopify: Cliente de Shopify
+        mutation: La mutation a correr por cada linea
+        poll_interval: Segundos entre cada consulta del estado de la operacion
+    """
+
+    MAX_FILE_BYTES = 19 * 1024 * 1024
+
+    def __init__(self, shopify, mutation: str, poll_interval: float = 5.0):
+        self.shopify = shopify
+        self.mutation = mutation
+        self.poll_interval = poll_interval
+        self.files = []
+        self._file = None
+        self._keys = None
+        self._size = 0
+
+    def __len__(self):
+        return sum(len(keys) for _, keys in self.files)
+
+    def add(self, key, variables: dict):
+        """Agrega una llamada; `key` identifica su resultado en `run`."""
+        line = (json.dumps(variables, ensure_ascii=False) + "\n").encode("utf-8")
+        if self._file is None or self._size + len(line) > self.MAX_FILE_BYTES:
+            self._open()
+        self._file.write(line)
+        self._keys.append(key)
+        self._size += len(line)
+
+    def _open(self):
+        if self._file:
+            self._file.close()
+        self._file = tempfile.NamedTemporaryFile(prefix="bulk-", suffix=".jsonl", delete=False)
+        self._keys = []
+        self._size = 0
+        self.files.append((self._file.name, self._keys))
+
+    def run(self):
+        """Corre la mutation y devuelve (key, resultado) por cada linea agregada.
+
+        El resultado es la linea del JSONL de Shopify ({"data": ...} o {"errors": ...}), o
+        None si la operacion fallo y esa linea no tiene resultado.
+        """
+        if self._file:
+            self._file.close()
+            self._file = None
+        try:
+            for path, keys in self.files:
+                yield from self._run_file(path, keys)
+        finally:
+            for path, _ in self.files:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.files = []
+
+    def _run_file(self, path: str, keys: list):
+        answered = set()
+        with _bulk_lock:
+            operation = {}
+            staged_upload_path = self.shopify.staged_upload(path)
+            operation_id = self.shopify.run_bulk_mutation(self.mutation, staged_upload_path) if staged_upload_path else None
+            if operation_id:
+                operation = finish_bulk_operation(self.shopify, operation_id, self.poll_interval)
+
+        if operation.get("status") != "COMPLETED":
+            logger.error(f"Bulk operation {operation.get('id')} did not complete: {operation.get('status')} {operation.get('errorCode')}")
+        # Si fallo a mitad de camino puede haber un resultado parcial
+        url = operation.get("url") or operation.get("partialDataUrl")
+        if url:
+            for result in self.shopify.iter_jsonl(url):
+                line_number = result.get("__lineNumber")
+                if line_number is None or line_number >= len(keys):
+                    continue
+                answered.add(line_number)
+                yield keys[line_number], result
+
+        for line_number, key in enumerate(keys):
+            if line_number not in answered:
+                yield key, None
+
+
+def money(value):
+    """Los precios van como string decimal en GraphQL."""
+    return None if value is None else str(value)
+
+
+def product_set_input(item: dict, tienda: str, category: str, shopify_product: dict = None) -> dict:
+    """Arma el ProductSetInput de un producto transformado (ver prepare_product).
+
+    Si el producto ya existe en Shopify se manda su ID y el de cada variante (por SKU),
+    asi productSet los actualiza en lugar de recrearlos y no se pierden los inventory items.
+    Las imagenes no van aca: se suben despues como en el sync por REST, para poder
+    asociarlas a sus variantes.
+    """
+    product = item["product"]
+    option_names = [option["name"] for option in item["options"]]
+    existing_variants = {
+        str(variant.get("sku")): variant.get("admin_graphql_api_id")
+        for variant in (shopify_product or {}).get("variants", [])
+    }
+
+    variants = []
+    option_values = [[] for _ in option_names]
+    for variant in item["variants"]:
+        values = [variant.get(f"option{position}") or "Default Title" for position in range(1, len(option_names) + 1)]
+        for position, value in enumerate(values):
+            if value not in option_values[position]:
+                option_values[position].append(value)
+
+        variant_input = {
+            "optionValues": [{"optionName": name, "name": value} for name, value in zip(option_names, values)],
+            "price": money(variant["price"]),
+            "compareAtPrice": money(variant["compare_at_price"]),
+            "barcode": variant["barcode"],
+            "position": variant["position"],
+            "inventoryPolicy": variant["inventory_policy"].upper(),
+            "inventoryItem": {"sku": str(variant["sku"]), "tracked": True},
+        }
+        if variant.get("weight") not in (None, ""):
+            variant_input["inventoryItem"]["measurement"] = {
+                "weight": {"value": float(variant["weight"]), "unit": "KILOGRAMS"}
+            }
+        if existing_variants.get(str(variant["sku"])):
+            variant_input["id"] = existing_variants[str(variant["sku"])]
+        variants.append(variant_input)
+
+    product_input = {
+        "handle": str(product["id"]),
+        "title": product["name"]["es"],
+        "descriptionHtml": item["description"],
+        "vendor": tienda,
+        "productType": category,
+        "tags": [tag for tag in item["tags"] if tag],
+        "status": "ACTIVE",
+        "productOptions": [
+            {"name": name, "position": position, "values": [{"name": value} for value in option_values[position - 1]]}
+            for position, name in enumerate(option_names, start=1)
+        ],
+        "variants": variants,
+    }
+    if shopify_product:
+        product_input["id"] = f"gid://shopify/Product/{shopify_product['id']}"
+    return product_input
+
+
+def product_from_result(result: dict):
+    """Convierte el resultado de productSet al formato de la API REST (el que usan el
+    HandleIndex y el mapeo).
+
+    Returns:
+        tuple: (producto o None, error o None)
+    """
+    if result is None:
+        return None, "The bulk operation returned no result"
+    if result.get("errors"):
+        return None, str(result["errors"])
+    data = (result.get("data") or {}).get("productSet") or {}
+    if data.get("userErrors"):
+        return None, str(data["userErrors"])
+    product = data.get("product")
+    if not product:
+        return None, "The bulk operation returned no product"
+
+    return {
+        "id": int(product["legacyResourceId"]),
+        "handle": product["handle"],
+        "status": (product.get("status") or "").lower(),
+        "variants": [
+            {
+                "id": int(variant["legacyResourceId"]),
+                "sku": variant.get("sku"),
+                "inventory_item_id": int(variant["inventoryItem"]["legacyResourceId"]) if variant.get("inventoryItem") else None,
+                "admin_graphql_api_id": variant["id"],
+            }
+            for variant in product.get("variants", {}).get("nodes", [])
+        ],
+    }, None
+
+
+def legacy_id(gid) -> int:
+    """gid://shopify/Product/123 -> 123"""
+    return int(str(gid).rsplit("/", 1)[-1])
+
+
+def run_bulk_query(shopify, query: str, poll_interval: float = 5.0):
+    """Corre una bulk query y devuelve las lineas del resultado a medida que se leen.
+
+    Returns:
+        Iterador de dicts (uno por linea del JSONL), o None si la operacion no termino bien
+    """
+    with _bulk_lock:
+        operation_id = shopify.run_bulk_query(query)
+        operation = finish_bulk_operation(shopify, operation_id, poll_interval) if operation_id else {}
+    if operation.get("status") != "COMPLETED":
+        logger.error(f"Bulk query {operation.get('id')} did not complete: {operation.get('status')} {operation.get('errorCode')}")
+        return None
+    # Sin resultados Shopify no genera archivo
+    if not operation.get("url"):
+        return iter([])
+    return shopify.iter_jsonl(operation["url"])
+
+
+def iter_catalog(lines):
+    """Arma los productos de un export de CATALOG_QUERY a partir de sus lineas.
+
+    En el JSONL de una bulk query cada producto y cada variante es una linea, y las
+    variantes vienen despues de su producto con su ID en __parentId. Se junta de a un
+    producto por vez, asi la memoria no depende del tamaño del export.
+
+    Yields:
+        dict: {"id", "gid", "handle", "variants": [{"id", "sku", "inventory_item_id",
+        "admin_graphql_api_id"}]}
+    """
+    product = None
+    orphans = 0
+    for line in lines:
+        gid = line.get("id") or ""
+        parent = line.get("__parentId")
+        if gid.startswith("gid://shopify/Product/"):
+            if product:
+                yield product
+            product = {"id": legacy_id(gid), "handle": line.get("handle"), "variants": [], "gid": gid}
+        elif gid.startswith("gid://shopify/ProductVariant/"):
+            if not product or parent != product["gid"]:
+                orphans += 1
+                continue
+            inventory_item = line.get("inventoryItem") or {}
+            product["variants"].append({
+                "id": legacy_id(gid),
+                "sku": line.get("sku"),
+                "inventory_item_id": legacy_id(inventory_item["id"]) if inventory_item.get("id") else None,
+                "admin_graphql_api_id": gid,
+            })
+    if product:
+        yield product
+    if orphans:
+        logger.warning(f"{orphans} lines of the bulk export did not follow their parent and were skipped")
+
+
+def iter_inventory_levels(lines):
+    """Recorre un export de INVENTORY_LEVELS_QUERY nivel por nivel.
+
+    Cada nivel es una linea con el ID de su inventory item en __parentId, asi que no hace
+    falta juntar nada: la memoria es constante.
+
+    Yields:
+        tuple: (inventory_item_id, location_id, disponible), los IDs como str
+    """
+    for line in lines:
+        parent = line.get("__parentId") or ""
+        if "location" not in line or not parent.startswith("gid://shopify/InventoryItem/"):
+            continue
+        available = next((q["quantity"] for q in line.get("quantities", []) if q.get("name") == "available"), None)
+        yield str(legacy_id(parent)), str(legacy_id(line["location"]["id"])), available
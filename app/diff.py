@@ -0,0 +1,149 @@
+PRODUCT_DIFF_FIELDS = ("title", "body_html", "vendor", "product_type", "tags", "status", "published")
+
+VARIANT_DIFF_FIELDS = ("price", "compare_at_price", "option1", "option2", "option3", "barcode", "position")
+
+# Factor a kilos de cada weight_unit de Shopify; sin unidad es kilos, como en Tiendanube
+WEIGHT_UNITS = {None: 1.0, "kg": 1.0, "g": 0.001, "lb": 0.45359237, "oz": 0.028349523125}
+
+
+def _normalize_tags(tags):
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return {str(tag).strip() for tag in tags or [] if tag is not None and str(tag).strip()}
+
+
+def _normalize_number(value):
+    try:
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        return None
+
+
+def _normalize_compare_at_price(value):
+    # Shopify guarda null cuando no hay precio de comparacion, nosotros mandamos 0
+    value = _normalize_number(value)
+    return value or None
+
+
+def _normalize_text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def normalize_product_field(field, value):
+    if field == "tags":
+        return _normalize_tags(value)
+    if field == "published":
+        return bool(value)
+    return _normalize_text(value)
+
+
+def normalize_weight(variant: dict):
+    """Peso de la variante en kilos, segun su weight_unit."""
+    weight = _normalize_number(variant.get("weight"))
+    factor = WEIGHT_UNITS.get(variant.get("weight_unit"))
+    if weight is None or factor is None:
+        return weight
+    return round(weight * factor, 3)
+
+
+def normalize_variant_field(field, value):
+    if field == "price":
+        return _normalize_number(value)
+    if field == "compare_at_price":
+        return _normalize_compare_at_price(value)
+    if field == "position":
+        return int(value) if value is not None else None
+    return _normalize_text(value)
+
+
+def diff_product(desired: dict, current: dict) -> dict:
+    """Devuelve los campos del producto (sin variantes ni opciones) que cambiaron.
+
+    Args:
+        desired: Producto como se lo mandaria a Shopify
+        current: Producto actual en Shopify (del HandleIndex)
+
+    Returns:
+        dict: Solo los campos de `desired` que difieren de `current`
+    """
+    current = dict(current)
+    # Shopify no devuelve "published", se deduce de published_at
+    current["published"] = current.get("published_at") is not None
+
+    changes = {}
+    for field in PRODUCT_DIFF_FIELDS:
+        if field not in desired:
+            continue
+        if normalize_product_field(field, desired[field]) != normalize_product_field(field, current.get(field)):
+            changes[field] = desired[field]
+    return changes
+
+
+def diff_variants(desired_variants: list, current_variants: list):
+    """Compara las variantes por SKU.
+
+    Returns:
+        list | None: Lista de {"id": variant_id, <campos que cambiaron>} con una entrada por
+        variante modificada, o None si cambio el conjunto de variantes (hay que crear o borrar)
+        y no alcanza con actualizar campo por campo.
+    """
+    current_by_sku = {str(variant.get("sku")): variant for variant in current_variants}
+    desired_skus = [str(variant.get("sku")) for variant in desired_variants]
+    if set(desired_skus) != set(current_by_sku) or len(desired_skus) != len(current_by_sku):
+        return None
+
+    updates = []
+    for variant in desired_variants:
+        current = current_by_sku[str(variant.get("sku"))]
+        changes = {}
+        for field in VARIANT_DIFF_FIELDS:
+            if field not in variant:
+                continue
+            if normalize_variant_field(field, variant[field]) != normalize_variant_field(field, current.get(field)):
+                changes[field] = variant[field]
+        # El peso se compara en kilos: 100 en gramos no es lo mismo que 100 en kilos
+        if "weight" in variant and normalize_weight(variant) != normalize_weight(current):
+            changes["weight"] = variant["weight"]
+            changes["weight_unit"] = variant.get("weight_unit") or "kg"
+        if changes:
+            updates.append({"id": current["id"], **changes})
+    return updates
+
+
+def options_changed(desired_options: list, current_options: list) -> bool:
+    desired_names = [option.get("name") for option in desired_options or []]
+    current_names = [option.get("name") for option in current_options or []]
+    return desired_names != current_names
+
+
+def diff_images(desired: list, manifest: dict):
+    """Compara las imagenes de Tiendanube con el manifiesto de lo que hay en Shopify.
+
+    Cada imagen es {"tn_image_id", "src", "position", "variant_ids"}. En el manifiesto un
+    src None es desconocido (se armo leyendo Shopify) y no fuerza a volver a subirla.
+
+    Returns:
+        tuple: (imagenes a subir, (entrada del manifiesto, imagen) a actualizar,
+        entradas del manifiesto a borrar de Shopify)
+    """
+    to_upload = []
+    to_update = []
+    to_delete = []
+    desired_ids = set()
+    for image in desired:
+        tn_image_id = str(image["tn_image_id"])
+        desired_ids.add(tn_image_id)
+        current = manifest.get(tn_image_id)
+        if current is None:
+            to_upload.append(image)
+        elif current["src"] is not None and current["src"] != image["src"]:
+            # Cambio el archivo: se borra la vieja y se sube la nueva
+            to_delete.append(current)
+            to_upload.append(image)
+        elif current["position"] != image["position"] or sorted(current["variant_ids"]) != sorted(image["variant_ids"]):
+            to_update.append((current, image))
+    to_delete.extend(current for tn_image_id, current in manifest.items() if tn_image_id not in desired_ids)
+    return to_upload, to_update, to_delete
@@ -0,0 +1,68 @@
+from app.logger import logger
+
+PRODUCT_FIELDS = "id,handle,title,body_html,vendor,product_type,tags,status,published_at,options,variants"
+
+VARIANT_FIELDS = (
+    "id", "sku", "inventory_item_id", "inventory_quantity", "admin_graphql_api_id",
+    "price", "compare_at_price", "option1", "option2", "option3", "barcode", "weight", "weight_unit", "position",
+)
+
+
+class HandleIndex():
+    """Indice handle -> producto de Shopify de un vendor.
+
+    Se arma una sola vez por corrida con una descarga paginada del vendor, y se mantiene
+    al dia con las respuestas de create/update, asi los chequeos de existencia, el mapeo
+    de variantes y los updates no necesitan llamadas extra a Shopify.
+    """
+
+    def __init__(self, products: list = None):
+        self.products = {}
+        for product in products or []:
+            self.add(product)
+
+    @classmethod
+    def build(cls, shopify, vendor: str):
+        params = {
+            "vendor": vendor,
+            "limit": 250,
+            "fields": PRODUCT_FIELDS
+        }
+        index = cls(shopify.get_products_by_vendor(vendor, params))
+        logger.info(f"Built Shopify handle index for vendor {vendor} with {len(index)} products")
+        return index
+
+    def add(self, product: dict):
+        """Agrega (o reemplaza) un producto de Shopify, tal como viene de la API."""
+        if not product or not product.get("handle"):
+            return
+        entry = {key: value for key, value in product.items() if key not in ("variants", "images")}
+        entry["variants"] = [
+            {field: variant.get(field) for field in VARIANT_FIELDS}
+            for variant in product.get("variants", [])
+        ]
+        self.products[str(product["handle"])] = entry
+
+    def get(self, handle):
+        return self.products.get(str(handle))
+
+    def update_variant(self, handle, variant: dict):
+        """Actualiza una variante del indice con la respuesta del endpoint de variantes."""
+        entry = self.get(handle)
+        if entry is None or not variant:
+            return
+        for current in entry["variants"]:
+            if current["id"] == variant.get("id"):
+                current.update({field: variant[field] for field in VARIANT_FIELDS if field in variant})
+
+    def remove(self, handle):
+        self.products.pop(str(handle), None)
+
+    def handles(self) -> set:
+        return set(self.products)
+
+    def __contains__(self, handle):
+        return str(handle) in self.products
+
+    def __len__(self):
+        return len(self.products)
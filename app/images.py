@@ -0,0 +1,150 @@
+import time
+import queue
+import threading
+
+from app.logger import logger
+
+
+class ImageUploadPool():
+    """Pool de subida de imagenes a Shopify, unico para todo el proceso.
+
+    Los hilos se crean una sola vez y toman las subidas de una cola acotada que comparten
+    todos los productos y todas las tiendas: un producto con muchas imagenes ya no frena al
+    siguiente, y si la cola se llena quien encola espera (no se acumulan imagenes en
+    memoria). Las subidas que fallan por 5xx o error de red se reintentan con backoff; los 429
+    ya los reintenta `Shopify._request` respetando el Retry-After.
+
+    Args:
+        shopify: Cliente de Shopify (usa upload_image_to_shopify, que respeta el rate limit)
+        workers: Subidas en paralelo
+        queue_size: Subidas que pueden esperar en la cola
+        max_retries: Reintentos de cada subida
+        retry_delay: Espera antes del primer reintento (se duplica en cada uno)
+    """
+
+    def __init__(self, shopify, workers: int = 4, queue_size: int = 100, max_retries: int = 3,
+                 retry_delay: float = 2.0):
+        self.shopify = shopify
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = {"uploaded": 0, "failed": 0, "retried": 0}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"images-{number + 1}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Started image upload pool with {self.workers} workers")
+
+    def batch(self):
+        """Agrupa las subidas de una corrida para poder esperarlas con `wait`."""
+        self._start()
+        return ImageUploadBatch(self)
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _work(self):
+        while True:
+            product_id, image, variant_ids, on_done = self.queue.get()
+            try:
+                result = self._upload(product_id, image, variant_ids)
+                on_done(result)
+            except Exception as e:
+                logger.exception(f"Error finishing image {image.get('alt')} of product {product_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _upload(self, product_id, image, variant_ids) -> dict:
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = self.shopify.upload_image_to_shopify(image, product_id, variant_ids)
+            except Exception as e:
+                result = {"status": None, "response": str(e), "image_alt": image.get("alt")}
+
+            if result["status"] == 200:
+                self._count("uploaded")
+                logger.info(f"Uploaded image {result['image_alt']} to Shopify product {product_id}")
+                return result
+            retryable = result["status"] is None or result["status"] >= 500
+            if not retryable or attempt == self.max_retries:
+                break
+            wait = self.retry_delay * 2 ** attempt
+            self._count("retried")
+            logger.warning(f"Image {result['image_alt']} of product {product_id} failed with {result['status']}, retrying in {wait:.1f}s")
+            time.sleep(wait)
+
+        self._count("failed")
+        logger.error(f"Error uploading image {result['image_alt']} to Shopify product {product_id}: {result['status']} - {result['response']}")
+        return result
+
+
+class ImageUploadBatch():
+    """Subidas de un grupo de productos en el ImageUploadPool.
+
+    Por cada producto se encolan sus imagenes y, cuando terminan todas, se llama a
+    `on_complete(ok)`; `wait` bloquea hasta que se completaron todos los productos del grupo.
+    """
+
+    def __init__(self, pool: ImageUploadPool):
+        self.pool = pool
+        self._pending = 0
+        self._condition = threading.Condition()
+
+    def submit(self, product_id, uploads: list, on_image=None, on_complete=None):
+        """Encola las imagenes de un producto.
+
+        Args:
+            product_id: ID del producto en Shopify
+            uploads: Lista de (imagen, variant_ids)
+            on_image: Se llama con el resultado de cada imagen subida bien
+            on_complete: Se llama con True si se subieron todas, False si alguna fallo
+        """
+        if not uploads:
+            if on_complete:
+                on_complete(True)
+            return
+
+        state = {"remaining": len(uploads), "ok": True}
+        state_lock = threading.Lock()
+        with self._condition:
+            self._pending += 1
+
+        def done(result):
+            try:
+                ok = result["status"] == 200
+                if ok and on_image:
+                    on_image(result)
+            finally:
+                with state_lock:
+                    state["ok"] = state["ok"] and ok
+                    state["remaining"] -= 1
+                    last = state["remaining"] == 0
+                if last:
+                    self._complete(on_complete, state["ok"])
+
+        for image, variant_ids in uploads:
+            self.pool.queue.put((product_id, image, variant_ids, done))
+
+    def _complete(self, on_complete, ok: bool):
+        try:
+            if on_complete:
+                on_complete(ok)
+        finally:
+            with self._condition:
+                self._pending -= 1
+                self._condition.notify_all()
+
+    def wait(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending == 0)
+        stats = self.pool.stats
+        logger.info(f"Image uploads so far: {stats['uploaded']} uploaded, {stats['failed']} failed, {stats['retried']} retried")
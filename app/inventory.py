@@ -0,0 +1,74 @@
+import threading
+
+from app.logger import logger
+
+
+class InventoryWriter():
+    """Junta los cambios de stock y los manda a Shopify en lotes de una sola mutation.
+
+    Cada cambio es (inventory_item_id, location_id, cantidad); si el mismo item y deposito
+    se setea dos veces antes de mandarse, queda el ultimo valor. Cuando se juntan
+    `chunk_size` cambios se mandan solos, y `flush` manda lo que quede.
+
+    Con un `mirror` (InventoryStore) no se manda lo que ya tiene esa cantidad segun la
+    ultima escritura exitosa, y lo que se escribe bien queda guardado ahi.
+
+    Args:
+        shopify: Cliente de Shopify (usa set_inventory_quantities)
+        chunk_size: Cambios por mutation (Shopify acepta hasta 250)
+        mirror: InventoryStore con lo ultimo que se seteo en Shopify
+    """
+
+    def __init__(self, shopify, chunk_size: int = 250, mirror=None):
+        self.shopify = shopify
+        self.chunk_size = chunk_size
+        self.mirror = mirror
+        self.pending = {}
+        self.errors = {}
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def set(self, inventory_item_id, location_id, quantity: int, force: bool = False):
+        """Encola un cambio de stock; con `force` se manda aunque el espejo diga que ya esta."""
+        if not force and self.mirror and self.mirror.get(inventory_item_id, location_id) == quantity:
+            with self._lock:
+                self.skipped += 1
+            return
+        with self._lock:
+            self.pending[(str(inventory_item_id), str(location_id))] = quantity
+            full = len(self.pending) >= self.chunk_size
+        if full:
+            self.flush()
+
+    def flush(self) -> dict:
+        """Manda todo lo pendiente.
+
+        Returns:
+            dict: (inventory_item_id, location_id) -> error, de los que fallaron en este flush.
+            Tambien se acumulan en `self.errors`.
+        """
+        with self._lock:
+            pending, self.pending = self.pending, {}
+
+        errors = {}
+        items = list(pending.items())
+        for start in range(0, len(items), self.chunk_size):
+            chunk = items[start:start + self.chunk_size]
+            quantities = [
+                {"inventory_item_id": item_id, "location_id": location_id, "quantity": quantity}
+                for (item_id, location_id), quantity in chunk
+            ]
+            results = self.shopify.set_inventory_quantities(quantities)
+            written = []
+            for (key, quantity), error in zip(chunk, results):
+                if error:
+                    logger.error(f"Error setting stock of inventory item {key[0]} at location {key[1]}: {error}")
+                    errors[key] = error
+                else:
+                    written.append((key[0], key[1], quantity))
+            if self.mirror and written:
+                self.mirror.save_many(written)
+
+        with self._lock:
+            self.errors.update(errors)
+        return errors
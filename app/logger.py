@@ -34,7 +34,7 @@ log_filename = f"logs/{fecha_log}.log"
 logger = logging.getLogger("my_logger")
 logger.setLevel(logging.INFO)
 
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(threadName)s - %(message)s")
 
 file_handler = logging.FileHandler(log_filename)
 file_handler.setFormatter(formatter)
@@ -1,20 +1,34 @@
 import time
 import os
+import asyncio
 import json
 import html
+import threading
 
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from apscheduler.schedulers.background import BackgroundScheduler
 
+from app.aio import run_async
 from app.logger import logger
-from app.Shopify import Shopify
-from app.Tiendanube import Tiendanube
-from app.utils import calculate_execution_time, preparar_imagen_por_src, calculate_price, create_tags, CATEGORIES_TO_CREATE
+from app.Shopify import AsyncShopify, Shopify
+from app.Tiendanube import AsyncTiendanube, Tiendanube
+from app.bulk import (BulkMutation, CATALOG_QUERY, INVENTORY_LEVELS_QUERY, PRODUCT_SET_MUTATION, PUBLISH_MUTATION,
+                      iter_catalog, iter_inventory_levels, product_from_result, product_set_input, run_bulk_query)
+from app.handle_index import HandleIndex
+from app.images import ImageUploadPool
+from app.inventory import InventoryWriter
+from app.orders import resolve_line_item
+from app.pipeline import Pipeline, Stage
+from app.webhooks import IdempotencyLedger, OrderQueueWorker
+from app.diff import diff_images, diff_product, diff_variants, options_changed
+from app.storage import Database, MappingStore, FingerprintStore, WatermarkStore, CheckpointStore, InventoryStore, OrderQueueStore, WebhookLedgerStore, ImageManifestStore
+from app.utils import calculate_execution_time, calculate_fingerprint, calculate_watermark, parse_datetime, preparar_imagen_por_src, calculate_price, create_tags, CATEGORIES_TO_CREATE
 
 # Cargar variables de entorno desde el archivo .env
 env_path = Path(__file__).resolve().parent.parent / '.env'
@@ -30,6 +44,56 @@ app = FastAPI()
 scheduler = BackgroundScheduler()
 tiendanube = Tiendanube()
 shopify = Shopify()
+# Versiones async de los clientes para las tandas de muchas llamadas (comparten el rate limit)
+async_tiendanube = AsyncTiendanube()
+async_shopify = AsyncShopify()
+database = Database()
+mapping_store = MappingStore(database)
+fingerprint_store = FingerprintStore(database)
+watermark_store = WatermarkStore(database)
+checkpoint_store = CheckpointStore(database)
+inventory_store = InventoryStore(database)
+image_manifest_store = ImageManifestStore(database)
+order_queue_store = OrderQueueStore(database)
+
+# Cuanto se recuerdan los webhooks ya recibidos: en memoria y en la base (Shopify reintenta hasta 48 hs)
+WEBHOOK_LEDGER_TTL_HOURS = int(os.getenv("WEBHOOK_LEDGER_TTL_HOURS", 48))
+WEBHOOK_LEDGER_RETENTION_DAYS = int(os.getenv("WEBHOOK_LEDGER_RETENTION_DAYS", 7))
+# Dias que se guardan los pedidos resueltos y los descuentos ya mandados a Tiendanube
+ORDER_QUEUE_RETENTION_DAYS = int(os.getenv("ORDER_QUEUE_RETENTION_DAYS", 7))
+
+# Ventanas por defecto de los jobs incrementales cuando una tienda todavia no tiene marca de agua
+PRODUCTS_WINDOW = timedelta(hours=6)
+STOCK_WINDOW = timedelta(minutes=15)
+
+# Modo bulk del sync completo: los productos van en una bulk mutation de Shopify
+BULK_SYNC = os.getenv("BULK_SYNC", "false").lower() == "true"
+BULK_POLL_INTERVAL = float(os.getenv("BULK_POLL_INTERVAL", 5))
+# Canal de venta (Online Store) donde se publican los productos creados en bulk
+SHOPIFY_PUBLICATION_ID = os.getenv("SHOPIFY_PUBLICATION_ID")
+
+# Cada cuanto se compara el espejo de stock con Shopify para corregir diferencias
+INVENTORY_VERIFY_HOURS = int(os.getenv("INVENTORY_VERIFY_HOURS", 24))
+
+# Segundos que se juntan los pedidos de los webhooks antes de descontar el stock en Tiendanube
+ORDER_QUEUE_WINDOW = float(os.getenv("ORDER_QUEUE_WINDOW", 2))
+
+# Tiendas que se sincronizan en paralelo (por defecto todas)
+STORE_WORKERS = int(os.getenv("STORE_WORKERS", 0))
+
+# Pipeline de productos: workers por etapa y tamaño de las colas entre etapas
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 20))
+PIPELINE_TRANSFORM_WORKERS = int(os.getenv("PIPELINE_TRANSFORM_WORKERS", 1))
+PIPELINE_WRITE_WORKERS = int(os.getenv("PIPELINE_WRITE_WORKERS", 2))
+
+# Pool global de subida de imagenes: por defecto el doble de la tasa REST de Shopify, que a
+# ~2 s por subida alcanza para usarla entera (el rate limiter pacea el resto)
+IMAGE_UPLOAD_WORKERS = int(os.getenv("IMAGE_UPLOAD_WORKERS", 0)) or max(2, int(shopify.rate_limiter.leak_rate * 2))
+IMAGE_UPLOAD_QUEUE_SIZE = int(os.getenv("IMAGE_UPLOAD_QUEUE_SIZE", 100))
+IMAGE_UPLOAD_RETRIES = int(os.getenv("IMAGE_UPLOAD_RETRIES", 3))
+image_pool = ImageUploadPool(shopify, IMAGE_UPLOAD_WORKERS, IMAGE_UPLOAD_QUEUE_SIZE, IMAGE_UPLOAD_RETRIES)
+# Cada cuanto el manifiesto de imagenes de un producto se vuelve a comparar con Shopify
+IMAGE_MANIFEST_VERIFY_DAYS = int(os.getenv("IMAGE_MANIFEST_VERIFY_DAYS", 7))
 
 
 @app.get("/")
@@ -48,668 +112,841 @@ def root():
         return {"error": "An error occurred"}
 
 
-@app.post("/sync-tiendanube")
-def sync(body: dict):
+async def decrement_tiendanube_stock(tienda, tn_product_id, tn_variant_id, quantity):
+    """Descuenta `quantity` del stock de una variante en Tiendanube; devuelve si salio bien."""
+    url = f"{TIENDANUBE_STORES[str(tienda)]['url']}/products/{tn_product_id}/variants/stock"
+    headers = TIENDANUBE_STORES[str(tienda)]['headers']
+    data = {
+        "action": "variation",
+        "value": quantity * -1,
+        "id": tn_variant_id
+    }
+    logger.info(f"Sending request to {url} with data {data}")
+    return bool(await async_tiendanube.update_stock(url, headers, data))
+
+
+def resolve_order_line_item(line_item):
+    # SKU y vendor vienen en el pedido; el producto sale del mapeo local y solo si falta se pide a Shopify
+    if not line_item.get('vendor'):
+        logger.warning("Vendor not found in the product")
+    return resolve_line_item(line_item, mapping_store, shopify, TIENDANUBE_STORES)
+
+
+order_queue_worker = OrderQueueWorker(order_queue_store, resolve_order_line_item, decrement_tiendanube_stock,
+                                      window=ORDER_QUEUE_WINDOW)
+webhook_ledger = IdempotencyLedger(WebhookLedgerStore(database), ttl=WEBHOOK_LEDGER_TTL_HOURS * 3600)
+
+
+# Es def (no async) a proposito: la base es sincronica y comparte el lock con los jobs, asi
+# que FastAPI la corre en su threadpool y una escritura larga no frena el event loop
+@app.post("/sync-tiendanube", status_code=202)
+def sync(body: dict, x_shopify_webhook_id: str = Header(None)):
     try:
         logger.info("Request received at sync-tiendanube endpoint")
+        # Los reintentos de Shopify (o el mismo pedido por otro webhook) se contestan sin hacer nada
+        if not webhook_ledger.claim(x_shopify_webhook_id, body.get("id")):
+            logger.info(f"Duplicate webhook {x_shopify_webhook_id} for order {body.get('id')}, skipping")
+            return {"message": "Pedido ya recibido"}
+
         # Obtengo los productos del pedido
         list_products = body.get("line_items", [])
         if not list_products:
             logger.warning("No products found in the order")
             return {"error": "No products found in the order"}
 
-        pedidos = []
-
-        # Recorro los productos del pedido
-        logger.info(f"Number of products in the order: {len(list_products)}")
-        for product in list_products:
-
-            logger.info(f"Processing order: {product.get('id')}")
-            pedido = {
-                "vendor": product.get("vendor"),
-                "quantity": product.get("quantity")
+        # El pedido se guarda y se procesa en segundo plano, asi Shopify no espera las llamadas a las APIs
+        try:
+            queue_id = order_queue_store.enqueue(body.get("id"), body)
+        except Exception:
+            # Si no se pudo guardar, el reintento de Shopify tiene que poder entrar
+            webhook_ledger.release(x_shopify_webhook_id, body.get("id"))
+            raise
+        order_queue_worker.notify()
+        logger.info(f"Order {body.get('id')} with {len(list_products)} products queued as {queue_id}")
+
+        return {"message": "Pedido encolado"}
+    except Exception as e:
+        logger.exception(f"Error occurred during synchronization: {e}")
+        # Con un 5xx Shopify reintenta el webhook; con un 202 el pedido se perderia
+        return JSONResponse(status_code=500, content={"error": "An error occurred during synchronization"})
+
+
+def run_for_each_store(job, *args):
+    """Corre `job(tienda, *args)` para todas las tiendas en paralelo.
+
+    Cada tienda usa su propio token (y su propio rate limit) de Tiendanube, asi que la
+    descarga y la transformacion avanzan en paralelo; las escrituras a Shopify pasan todas
+    por el mismo limitador global. Un error en una tienda no corta a las demas.
+    """
+    def run(tienda):
+        threading.current_thread().name = f"store-{tienda}"
+        return job(tienda, *args)
+
+    workers = STORE_WORKERS or len(TIENDANUBE_STORES) or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, tienda): tienda for tienda in TIENDANUBE_STORES}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.exception(f"Error occurred synchronizing store {TIENDANUBE_STORES[futures[future]]['name']}: {e}")
+
+
+def export_shopify_catalog(tienda):
+    """Productos del vendor en Shopify (handles, variantes e inventory items) desde una
+    bulk query, de a uno por vez. None si el export fallo."""
+    lines = run_bulk_query(shopify, CATALOG_QUERY % tienda, BULK_POLL_INTERVAL)
+    return iter_catalog(lines) if lines is not None else None
+
+
+def export_inventory_levels():
+    """(inventory_item_id, deposito, disponible) de todo el stock de Shopify desde una bulk
+    query, de a uno por vez. None si el export fallo."""
+    lines = run_bulk_query(shopify, INVENTORY_LEVELS_QUERY, BULK_POLL_INTERVAL)
+    return iter_inventory_levels(lines) if lines is not None else None
+
+
+def iter_tiendanube_products(tienda, extra_params: dict = None, oldest_first: bool = False):
+    """Listado de los productos publicados de una tienda, que se descarga a medida que se recorre.
+
+    Args:
+        tienda: Clave de la tienda en TIENDANUBE_STORES
+        extra_params: Filtros adicionales para la API (ej: updated_at_min, fields)
+        oldest_first: Recorre del mas viejo al mas nuevo (el orden en que se crean en Shopify)
+
+    Returns:
+        ProductListing: iterable de productos; despues de recorrerlo `complete` es False si
+        alguna pagina fallo aun con reintentos.
+    """
+    url = f"{TIENDANUBE_STORES[tienda]['url']}/products"
+    headers = TIENDANUBE_STORES[tienda]['headers']
+    params = {"published": "true", **(extra_params or {})}
+    limit = TIENDANUBE_STORES[tienda].get('product_quantity')
+    return tiendanube.iter_products(url, headers, params, limit=limit, oldest_first=oldest_first)
+
+
+def push_product_update(handle_index, handle, data):
+    """Actualiza un producto existente mandando a Shopify solo lo que cambio.
+
+    Los campos del producto que cambiaron van en un PUT chico sin variantes, y cada variante
+    modificada por el endpoint de variantes. Si cambiaron las opciones o el conjunto de
+    variantes (hay que crear o borrar alguna) se reescribe el producto completo.
+
+    Returns:
+        dict: El producto actualizado (del HandleIndex), o None si fallo alguna llamada
+    """
+    current = handle_index.get(handle)
+    desired = data["product"]
+
+    variant_updates = diff_variants(desired["variants"], current["variants"])
+    if variant_updates is None or options_changed(desired["options"], current.get("options")):
+        logger.info(f"Variants or options changed for product {handle}, sending the full product")
+        response = shopify.update_product(current['id'], data)
+        if not response:
+            return None
+        handle_index.add(response.get("product"))
+        return response.get("product")
+
+    changes = diff_product(desired, current)
+    logger.info(f"Product {handle}: {len(changes)} fields and {len(variant_updates)} variants changed")
+
+    if changes:
+        response = shopify.update_product(current['id'], {"product": {"id": current['id'], **changes}})
+        if not response:
+            return None
+        handle_index.add(response.get("product"))
+
+    for variant in variant_updates:
+        response = shopify.update_variant(variant['id'], {"variant": variant})
+        if not response:
+            return None
+        handle_index.update_variant(handle, response.get("variant"))
+
+    return handle_index.get(handle)
+
+
+def prepare_product(tienda, item):
+    """Etapa de transformacion: arma variantes, tags, opciones, descripcion y huella.
+
+    No hace llamadas a Shopify, solo completa `item` (que trae el producto de Tiendanube
+    en item["product"]) para la etapa de escritura.
+    """
+    product = item["product"]
+    logger.info(f"Processing product {product['id']} from Tiendanube")
+
+    # Creo un array de las variantes de cada producto
+    tiendanube_variants = []
+    relacion_variante_imagen = []
+    for variant in product.get("variants", []):
+        stock = variant["stock"] if variant["stock"] is not None else 999
+        values = [v.get("es") for v in variant.get("values", [])]
+        option1 = values[0] if len(values) > 0 else None
+        option2 = values[1] if len(values) > 1 else None
+        option3 = values[2] if len(values) > 2 else None
+
+        tiendanube_variants.append({
+            "sku": variant["id"],
+            "grams": None,
+            "price": calculate_price(variant["price"], variant["promotional_price"]),
+            "weight": variant["weight"],
+            "barcode": variant["barcode"],
+            "option1": option1,
+            "option2": option2,
+            "option3": option3,
+            "taxcode": None,
+            "position": variant["position"],
+            "weight_unit": "kg",
+            "compare_at_price": calculate_price(variant["compare_at_price"]),
+            "inventory_policy": "deny",
+            "inventory_quantity": stock,
+            "presentment_prices": [],
+            "fulfillment_service": "manual",
+            "inventory_management": "shopify"
+        })
+
+        # Relaciono la variante con la imagen
+        # TODO aca se puede agregar el stock para actualizarlo si hace falta
+        relacion_variante_imagen.append({
+            "variant_id": variant["id"],  # es el sku de la variante en shopify
+            "image_id": variant["image_id"]  # es el alt de la imagen en shopify
+        })
+
+    logger.info(f"Fetched {len(tiendanube_variants)} variants for product {product['id']}")
+
+    tiendanube_images = []
+    for img in product.get("images", []):
+        imagen = preparar_imagen_por_src(img)
+        if imagen:
+            tiendanube_images.append(imagen)
+
+    existing_tags = set(product.get("tags", "").split(","))
+
+    # Limpiá espacios (por si vienen tags con espacio al principio o final)
+    existing_tags = {tag.strip() for tag in existing_tags if tag.strip()}
+
+    # Agregá las categorías si no están ya
+    for handle_category in product.get("categories", []):
+        tag_handle = handle_category["handle"]["es"].strip()
+        tag_name = handle_category["name"]["es"].strip()
+        if tag_handle not in existing_tags:
+            existing_tags.add(tag_handle)
+        if tag_name not in existing_tags:
+            existing_tags.add(tag_name)
+
+    existing_tags.add(tienda)
+    existing_tags.add(TIENDANUBE_STORES[tienda]['category'])
+
+    # Convertilo de nuevo a lista si necesitás
+    tiendanube_tags = []
+    tiendanube_tags = create_tags(existing_tags)
+
+    logger.info(f"Tags for product {product['id']}: {tiendanube_tags}")
+
+    # formateo los atributos = options
+    tiendanube_attributes = [{"name": attr.get("es")} for attr in product.get("attributes", [])]
+    if not tiendanube_attributes:
+        tiendanube_attributes.append({
+            "name": "Title"
+        })
+
+    product_description = product["description"]["es"]
+    soup = BeautifulSoup(product_description, "html.parser")
+    text_only = soup.get_text(separator="\n")
+    product_description = html.unescape(text_only)
+
+    # Huella del payload transformado: si no cambio desde el ultimo push exitoso no hay nada que hacer
+    fingerprint = calculate_fingerprint({
+        "title": product["name"]["es"],
+        "body_html": product_description,
+        "vendor": tienda,
+        "product_type": TIENDANUBE_STORES[tienda]['category'],
+        "tags": tiendanube_tags,
+        "variants": tiendanube_variants,
+        "options": tiendanube_attributes,
+        "images": tiendanube_images,
+        "published": product["published"],
+    })
+
+    item.update({
+        "variants": tiendanube_variants,
+        "relacion_variante_imagen": relacion_variante_imagen,
+        "images": tiendanube_images,
+        "tags": tiendanube_tags,
+        "options": tiendanube_attributes,
+        "description": product_description,
+        "fingerprint": fingerprint,
+    })
+    return item
+
+
+def find_shopify_product(handle_index, tn_product_id):
+    """Busca el producto en el indice de Shopify por su handle, que es el id del producto en Tiendanube."""
+    shopify_product = handle_index.get(tn_product_id)
+    if not shopify_product:
+        # Si no esta en el indice pero ya lo habiamos creado, lo traigo por ID para no duplicarlo
+        mapping = mapping_store.get_product(tn_product_id)
+        if mapping:
+            response = shopify.get_product(mapping["shopify_product_id"])
+            if response:
+                handle_index.add(response.get("product"))
+                shopify_product = handle_index.get(tn_product_id)
+    return shopify_product
+
+
+def queue_product_stock(tienda, product, shopify_product, inventory):
+    """Encola en `inventory` el stock de Tiendanube de cada variante del producto de Shopify.
+
+    Returns:
+        tuple: (sku -> ID de variante en Shopify, admin_graphql_api_id de las variantes)
+    """
+    variants_graphql_api_id = []
+
+    # Mapear variantes de Tiendanube (por SKU) a IDs de variantes en Shopify
+    shopify_variant_map = {}
+    for variant in shopify_product.get("variants", []):
+
+        variants_graphql_api_id.append(variant["admin_graphql_api_id"])
+
+        # shopify_variant_map[str(variant.get("sku"))] = variant.get("id")
+        sku = str(variant.get("sku"))
+        shopify_variant_map[sku] = variant.get("id")
+
+        inventory_item_id = variant.get("inventory_item_id")
+        if not inventory_item_id:
+            continue  # Evitar errores si no viene
+
+        # Buscar el stock correspondiente a este SKU
+        tiendanube_stock_variant = next(
+            (v for v in product.get("variants", []) if str(v["id"]) == sku),
+            None
+        )
+        if not tiendanube_stock_variant:
+            continue
+
+        # Si el stock no cambio desde la ultima escritura, el espejo de stock la saltea
+        stock = tiendanube_stock_variant.get("stock") if tiendanube_stock_variant.get("stock") is not None else 999
+        inventory.set(variant['inventory_item_id'], TIENDANUBE_STORES[tienda]['deposit'], stock)
+        if TIENDANUBE_STORES[tienda]['deposit'] != shopify.DEFAULT_DEPOSIT:
+            # El stock de la tienda va en su deposito, el deposito por defecto queda en 0
+            inventory.set(variant['inventory_item_id'], shopify.DEFAULT_DEPOSIT, 0)
+
+    return shopify_variant_map, variants_graphql_api_id
+
+
+def write_product(tienda, item, handle_index, activate=False):
+    """Etapa de escritura: crea o actualiza el producto en Shopify con su stock.
+
+    Si el producto no cambio o no se pudo guardar, marca el item como terminado
+    (item["done"]) para que la etapa de imagenes lo deje pasar.
+    """
+    product = item["product"]
+    shopify_product = find_shopify_product(handle_index, product["id"])
+
+    needs_activation = activate and shopify_product and shopify_product.get("status") != "active"
+    if shopify_product and not needs_activation and fingerprint_store.get(product["id"]) == item["fingerprint"]:
+        logger.info(f"Product {product['id']} has not changed since the last sync, skipping")
+        item.update({"done": True, "ok": True})
+        return item
+
+    if shopify_product:
+        # Si el producto existe, lo actualizo
+        logger.info(f"Updating product {product['id']} in Shopify")
+        data = {
+            "product": {
+                "id": shopify_product['id'],
+                "handle": product["id"],
+                "title": product["name"]["es"],
+                "body_html": item["description"],
+                "vendor": tienda,
+                "product_type": TIENDANUBE_STORES[tienda]['category'],
+                "tags": item["tags"],
+                "variants": item["variants"],
+                "published": product["published"],
+                "options": item["options"] or shopify_product['options']
             }
-
-            if not pedido['vendor']:
-                logger.warning("Vendor not found in the product")
-                # return {"error": "Vendor not found in the product"}
-
-            logger.info(f"Obtaining product {product['product_id']} from Shopify")
-            params = {
-                "fields": "handle",
+        }
+        if activate:
+            data["product"]["status"] = "active"
+        shopify_product = push_product_update(handle_index, product["id"], data)
+
+    else:
+        # Si el producto no existe, lo creo
+        data = {
+            "product": {
+                "title": product["name"]["es"],
+                "handle": product["id"],
+                "options": item["options"],
+                "body_html": item["description"],
+                "vendor": tienda,
+                "product_type": TIENDANUBE_STORES[tienda]['category'],
+                "tags": item["tags"],
+                "published": product["published"],
+                "status": "active",
+                "variants": item["variants"]
             }
-            response = shopify.get_product(product['product_id'], params=params)
-            if response:
-                pedido['product_id'] = response['product']['handle']
+        }
 
-            logger.info(f"Obtaining variant {product['variant_id']} from Shopify")
-            params = {
-                "fields": "sku"
-            }
-            response = shopify.get_product_variants(product['variant_id'], params=params)
-            if response:
-                pedido['variant_id'] = response['variants'][0]['sku']
-
-            pedidos.append(pedido)
-            logger.info(f"Product {pedido['product_id']} with variant {pedido['variant_id']} and quantity {pedido['quantity']} added to the list")
-
-        logger.info(f"Number of products to update: {len(pedidos)}")
-        for pedido in pedidos:
-            logger.info(f"Updating stock for product {pedido['product_id']} with variant {pedido['variant_id']} and quantity {pedido['quantity']} from vendor {pedido['vendor']}")
-            url = f"{TIENDANUBE_STORES[str(pedido['vendor'])]['url']}/products/{pedido['product_id']}/variants/stock"
-            headers = TIENDANUBE_STORES[str(pedido['vendor'])]['headers']
-            data = {
-                "action": "variation",
-                "value": pedido['quantity'] * -1,
-                "id": pedido['variant_id']
+        response = shopify.create_product(data)
+        shopify_product = response.get("product") if response else None
+        handle_index.add(shopify_product)
+        item["created"] = True
+
+    if not shopify_product:
+        logger.error(f"Product {product['id']} could not be saved in Shopify")
+        item.update({"done": True, "ok": False})
+        return item
+
+    # Si el producto se guarda correctamente, actualizo el stock y las imagenes
+    mapping_store.save_product(tienda, shopify_product, TIENDANUBE_STORES[tienda]['deposit'])
+    pushed_ok = True
+
+    inventory = InventoryWriter(shopify, mirror=inventory_store)
+    shopify_variant_map, variants_graphql_api_id = queue_product_stock(tienda, product, shopify_product, inventory)
+
+    # Todo el stock del producto (variantes y depositos) en una sola llamada
+    if inventory.flush():
+        pushed_ok = False
+
+    delivery_profile = TIENDANUBE_STORES[tienda].get('delivery_profile')
+    if delivery_profile:
+        shopify.add_variants_to_delivery_profile(delivery_profile, variants_graphql_api_id)
+
+    item.update({
+        "done": False,
+        "ok": pushed_ok,
+        "shopify_product": shopify_product,
+        "shopify_variant_map": shopify_variant_map,
+    })
+    return item
+
+
+def load_image_manifest(item):
+    """Manifiesto de imagenes del producto (ver ImageManifestStore).
+
+    Solo se lee el listado de imagenes de Shopify si no hay manifiesto o toca verificarlo;
+    un producto recien creado no tiene imagenes, asi que ni eso.
+
+    Returns:
+        dict: tn_image_id -> entrada, o None si no se pudo leer de Shopify
+    """
+    tn_product_id = item["product"]["id"]
+    shopify_product_id = item["shopify_product"]["id"]
+    manifest = image_manifest_store.get(tn_product_id, shopify_product_id, timedelta(days=IMAGE_MANIFEST_VERIFY_DAYS))
+    if manifest is not None:
+        return manifest
+    if item.get("created"):
+        image_manifest_store.replace(tn_product_id, shopify_product_id, [])
+        return {}
+
+    response = shopify.get_product_images(shopify_product_id)
+    if not response:
+        return None
+    images = {}
+    for image in response.get("images", []):
+        # El alt es el ID de la imagen en Tiendanube; el src de Shopify es otro, queda como desconocido
+        tn_image_id = str(image.get("alt") or "")
+        if tn_image_id and tn_image_id not in images:
+            images[tn_image_id] = {
+                "tn_image_id": tn_image_id,
+                "shopify_image_id": image["id"],
+                "src": None,
+                "position": image.get("position"),
+                "variant_ids": sorted(image.get("variant_ids") or []),
             }
+    image_manifest_store.replace(tn_product_id, shopify_product_id, list(images.values()))
+    return images
+
+
+def sync_product_images(tienda, item, images, on_done):
+    """Etapa de imagenes: diff local contra el manifiesto del producto.
+
+    Borra de Shopify las imagenes que ya no estan en Tiendanube (o cambiaron de archivo),
+    actualiza la posicion y las variantes de las que cambiaron, y encola en el pool las que
+    faltan, sin esperarlas. Cuando terminan las subidas (o enseguida si no hay) se guarda la
+    huella, si salio todo bien, y se llama a `on_done(item)`.
+    """
+    if item["done"]:
+        on_done(item)
+        return item
+
+    product = item["product"]
+    shopify_product = item["shopify_product"]
+    shopify_variant_map = item["shopify_variant_map"]
+
+    logger.info(f"Updating images for product {product['id']} in Shopify")
+
+    manifest = load_image_manifest(item)
+    if manifest is None:
+        logger.error(f"Images of product {product['id']} could not be read from Shopify")
+        item.update({"done": True, "ok": False})
+        on_done(item)
+        return item
+
+    desired = {}
+    for image in item["images"]:
+        # ⚠️ Convertir los variant_ids de Tiendanube a los de Shopify (vía SKU)
+        variant_ids = [
+            shopify_variant_map.get(str(rel["variant_id"]))
+            for rel in item["relacion_variante_imagen"]
+            if rel["image_id"] == image.get("alt") and shopify_variant_map.get(str(rel["variant_id"])) is not None
+        ]
+        desired[str(image.get("alt"))] = {
+            "tn_image_id": str(image.get("alt")),
+            "src": image["src"],
+            "position": image.get("position"),
+            "variant_ids": sorted(variant_ids),
+        }
 
-            logger.info(f"Sending request to {url} with data {data}")
-            # TODO ver de mejorar el mensaje dentro de la funcion de tiendanube o despues de la funcion
-            response = tiendanube.update_stock(url, headers, data)
+    to_upload, to_update, to_delete = diff_images(list(desired.values()), manifest)
+    logger.info(f"Images of product {product['id']}: {len(to_upload)} to upload, {len(to_update)} to update, {len(to_delete)} to delete")
 
-        logger.info("Stock updated successfully for all products in the order")
-        logger.info("Synchronization completed successfully")
+    images_ok = True
+    for current in to_delete:
+        if shopify.delete_product_image(shopify_product['id'], current["shopify_image_id"]):
+            image_manifest_store.delete_image(current["tn_image_id"])
+        else:
+            images_ok = False
 
-        return {"message": "Sincronización exitosa"}
-    except Exception as e:
-        logger.exception(f"Error occurred during synchronization: {e}")
-        return {"error": "An error occurred during synchronization"}
+    for current, image in to_update:
+        data = {"image": {"id": current["shopify_image_id"], "position": image["position"], "variant_ids": image["variant_ids"]}}
+        if shopify.update_product_image(shopify_product['id'], current["shopify_image_id"], data):
+            image_manifest_store.save_image(product["id"], {**current, **image})
+        else:
+            images_ok = False
+
+    # Las que se armaron leyendo Shopify y coinciden se quedan con el src de Tiendanube
+    changed = {image["tn_image_id"] for image in to_upload} | {image["tn_image_id"] for _, image in to_update}
+    for tn_image_id, current in manifest.items():
+        if current["src"] is None and tn_image_id in desired and tn_image_id not in changed:
+            image_manifest_store.save_image(product["id"], {**current, "src": desired[tn_image_id]["src"]})
+
+    uploads = [
+        ({"src": image["src"], "alt": image["tn_image_id"], "position": image["position"]}, image["variant_ids"])
+        for image in to_upload
+    ]
+
+    def uploaded(result):
+        shopify_image = result["response"].get("image") or {}
+        image_manifest_store.save_image(product["id"], {**desired[str(result["image_alt"])], "shopify_image_id": shopify_image["id"]})
+
+    def complete(uploads_ok):
+        pushed_ok = item["ok"] and images_ok and uploads_ok
+        # Solo guardo la huella si se pudo subir todo, asi lo que fallo se reintenta en la proxima corrida
+        if pushed_ok:
+            fingerprint_store.save(product["id"], tienda, item["fingerprint"])
+        logger.info(f"Product {product['id']} processed successfully")
+        item.update({"done": True, "ok": pushed_ok})
+        on_done(item)
+
+    images.submit(shopify_product['id'], uploads, on_image=uploaded, on_complete=complete)
+    return item
+
+
+def process_products(tienda, products, handle_index, activate=False, on_result=None):
+    """Sincroniza los productos de Tiendanube con Shopify en un pipeline por etapas.
+
+    transformacion -> escritura (producto, stock, perfil de envio) -> imagenes, conectadas
+    por colas acotadas: mientras un producto sube sus imagenes el siguiente ya se esta
+    escribiendo y los de atras se estan transformando.
+
+    Args:
+        tienda: Clave de la tienda en TIENDANUBE_STORES (es el vendor en Shopify)
+        products: Iterable de productos de Tiendanube
+        handle_index: HandleIndex del vendor, se actualiza con las respuestas de Shopify
+        activate: Si es True, los productos existentes se vuelven a poner en "active"
+        on_result: Se llama con (producto, ok, error) cuando termina cada producto
+    """
+    # El resultado de cada producto llega cuando terminan sus imagenes, desde los hilos del pool
+    lock = threading.Lock()
+
+    def finish(item):
+        error = None if item["ok"] else "Product could not be fully synchronized"
+        if on_result:
+            with lock:
+                on_result(item["product"], item["ok"], error)
+
+    def fail(item, exception):
+        # item es None si fallo la lectura de los productos, no hay nada que anotar
+        if item is not None and on_result:
+            with lock:
+                on_result(item["product"], False, str(exception))
+
+    images = image_pool.batch()
+    pipeline = Pipeline([
+        Stage("transform", lambda item: prepare_product(tienda, item), PIPELINE_TRANSFORM_WORKERS),
+        Stage("write", lambda item: write_product(tienda, item, handle_index, activate), PIPELINE_WRITE_WORKERS),
+        Stage("images", lambda item: sync_product_images(tienda, item, images, finish)),
+    ], queue_size=PIPELINE_QUEUE_SIZE, on_error=fail)
+    pipeline.run({"product": product} for product in products)
+    images.wait()
+
+
+def sync_store_products(tienda):
+    logger.info("#" * 50)
+    logger.info(f"Fetching products from {TIENDANUBE_STORES[tienda]['name']}")
+
+    # Retomo desde el ultimo updated_at procesado (o las ultimas 6 horas si es la primera vez)
+    watermark = watermark_store.get(tienda, "products") or datetime.now(timezone.utc) - PRODUCTS_WINDOW
+    updated_at_min = watermark.isoformat()
+
+    # Para detectar los productos borrados alcanza con los IDs del catalogo completo
+    product_ids = iter_tiendanube_products(tienda, {"fields": "id"})
+    ids_tiendanube = {str(p.get("id")) for p in product_ids}
+
+    # Los productos de Shopify salen de un export (bulk query) que trae solo handles, variantes
+    # e inventory items, y con eso se refresca el mapeo; el indice se va llenando solo con los
+    # productos que cambiaron. Si el export falla, bajo el vendor entero como antes.
+    catalog = export_shopify_catalog(tienda)
+    if catalog is None:
+        handle_index = HandleIndex.build(shopify, tienda)
+        shopify_handles = {handle: handle_index.get(handle)['id'] for handle in handle_index.handles()}
+    else:
+        handle_index = HandleIndex()
+        shopify_handles = {}
+        for shopify_product in catalog:
+            shopify_handles[str(shopify_product['handle'])] = shopify_product['id']
+            mapping_store.save_product(tienda, shopify_product, TIENDANUBE_STORES[tienda]['deposit'])
+    logger.info(f"Total products from Shopify: {len(shopify_handles)}")
+
+    products_to_eliminate = []
+    if product_ids.complete:
+        products_to_eliminate = [handle for handle in shopify_handles if handle not in ids_tiendanube]
+    else:
+        # Sin el catalogo completo no se puede saber que productos ya no existen
+        logger.warning(f"Incomplete product listing for {TIENDANUBE_STORES[tienda]['name']}, skipping deletions")
+
+    logger.info(f"Productos a eliminar de Shopify: {len(products_to_eliminate)}")
+    for handle in products_to_eliminate:
+        logger.info(f"Eliminando producto: ID={shopify_handles[handle]} HANDLE={handle}")
+        shopify.delete_product(shopify_handles[handle])
+        fingerprint_store.delete(handle)
+        image_manifest_store.delete_product(handle)
+
+    # Solo pido a Tiendanube los productos que cambiaron en la ventana, y los voy
+    # procesando a medida que llegan las paginas
+    recently_updated_products = iter_tiendanube_products(tienda, {"updated_at_min": updated_at_min}, oldest_first=True)
+
+    processed = []
+
+    def record(product, ok, error):
+        processed.append((parse_datetime(product.get("updated_at")), ok))
+
+    process_products(tienda, recently_updated_products, handle_index, activate=True, on_result=record)
+    logger.info(f"Productos sincronizados por actualización reciente: {len(processed)}")
+
+    # Si alguna pagina no se pudo leer, sus productos no se procesaron: la marca no avanza
+    if recently_updated_products.complete:
+        watermark_store.save(tienda, "products", calculate_watermark(watermark, processed))
+    else:
+        logger.warning(f"Incomplete listing of updated products for {TIENDANUBE_STORES[tienda]['name']}, keeping the watermark at {updated_at_min}")
 
 
 def sync_products():
     start_time = time.time()
     logger.info("==========> Synchronizing products... <==========")
-    try:
-        for tienda in TIENDANUBE_STORES:
-            logger.info("#" * 50)
-            logger.info(f"Fetching products from {TIENDANUBE_STORES[tienda]['name']}")
-
-            updated_at_min = (datetime.now() - timedelta(hours=6)).isoformat()
-
-            # Obtengo los productos de Tiendanube
-            products = []
-            headers = TIENDANUBE_STORES[tienda]['headers']
-            products_quantity = TIENDANUBE_STORES[tienda].get('product_quantity')
-
-            fetched = 0
-            page = 1
-            products = []
-            per_page = 200
-
-            while True:
-                params = {
-                    "per_page": per_page,
-                    "page": page,
-                    "published": "true",
-                    "sort_by": "created-at-descending",
-                }
-
-                url = f"{TIENDANUBE_STORES[tienda]['url']}/products"
-                current_products = tiendanube.get_products(url, headers, params)
-                if not current_products:
-                    break
-
-                products.extend(current_products)
-                fetched += len(current_products)
-
-                logger.info(f"Página {page} - Productos descargados: {len(current_products)}")
-
-                # Si se especificó un límite y lo alcanzamos, cortamos
-                if products_quantity and fetched >= products_quantity:
-                    products = products[:products_quantity]
-                    break
-
-                # Si trajo menos de per_page, ya no hay más páginas
-                if len(current_products) < per_page:
-                    break
-
-                page += 1
-
-            # Obtengo los productos de Shopify
-            products_from_shopify = shopify.get_products_by_vendor(tienda)
-            logger.info(f"Total products from Shopify: {len(products_from_shopify)}")
-
-            products_to_eliminate = []
-            ids_tiendanube = {str(p.get("id")) for p in products}
-
-            for product in products_from_shopify:
-                if product.get("handle") not in ids_tiendanube:
-                    products_to_eliminate.append(product)
-
-            logger.info(f"Productos a eliminar de Shopify: {len(products_to_eliminate)}")
-            for product in products_to_eliminate:
-                logger.info(f"Eliminando producto: ID={product.get('id')} HANDLE={product.get('handle')}")
-                shopify.delete_product(product.get("id"))
-
-            recently_updated_products = []
-            for product in products:
-                if product.get('updated_at') and product['updated_at'] >= updated_at_min:
-                    recently_updated_products.append(product)
-                    continue
-
-                for variant in product.get('variants', []):
-                    if variant.get('updated_at') and variant['updated_at'] >= updated_at_min:
-                        recently_updated_products.append(product)
-                        break
-
-            logger.info(f"Productos a sincronizar por actualización reciente: {len(recently_updated_products)}")
-
-            # Resultado final
-            products = recently_updated_products
-            products.reverse()
-
-            data = []
-
-            for product in products:
-
-                logger.info(f"Processing product {product['id']} from Tiendanube")
-
-                # Creo un array de las variantes de cada producto
-                tiendanube_variants = []
-                relacion_variante_imagen = []
-                for variant in product.get("variants", []):
-                    stock = variant["stock"] if variant["stock"] is not None else 999
-                    values = [v.get("es") for v in variant.get("values", [])]
-                    option1 = values[0] if len(values) > 0 else None
-                    option2 = values[1] if len(values) > 1 else None
-                    option3 = values[2] if len(values) > 2 else None
-
-                    tiendanube_variants.append({
-                        "sku": variant["id"],
-                        "grams": None,
-                        "price": calculate_price(variant["price"], variant["promotional_price"]),
-                        "weight": variant["weight"],
-                        "barcode": variant["barcode"],
-                        "option1": option1,
-                        "option2": option2,
-                        "option3": option3,
-                        "taxcode": None,
-                        "position": variant["position"],
-                        "weight_unit": None,
-                        "compare_at_price": calculate_price(variant["compare_at_price"]),
-                        "inventory_policy": "deny",
-                        "inventory_quantity": stock,
-                        "presentment_prices": [],
-                        "fulfillment_service": "manual",
-                        "inventory_management": "shopify"
-                    })
-
-                    # Relaciono la variante con la imagen
-                    # TODO aca se puede agregar el stock para actualizarlo si hace falta
-                    relacion_variante_imagen.append({
-                        "variant_id": variant["id"],  # es el sku de la variante en shopify
-                        "image_id": variant["image_id"]  # es el alt de la imagen en shopify
-                    })
-
-                logger.info(f"Fetched {len(tiendanube_variants)} variants for product {product['id']}")
-
-                tiendanube_images = []
-                for img in product.get("images", []):
-                    imagen = preparar_imagen_por_src(img)
-                    if imagen:
-                        tiendanube_images.append(imagen)
-
-                existing_tags = set(product.get("tags", "").split(","))
-
-                # Limpiá espacios (por si vienen tags con espacio al principio o final)
-                existing_tags = {tag.strip() for tag in existing_tags if tag.strip()}
-
-                # Agregá las categorías si no están ya
-                for handle_category in product.get("categories", []):
-                    tag_handle = handle_category["handle"]["es"].strip()
-                    tag_name = handle_category["name"]["es"].strip()
-                    if tag_handle not in existing_tags:
-                        existing_tags.add(tag_handle)
-                    if tag_name not in existing_tags:
-                        existing_tags.add(tag_name)
-
-                existing_tags.add(tienda)
-                existing_tags.add(TIENDANUBE_STORES[tienda]['category'])
-
-                # Convertilo de nuevo a lista si necesitás
-                tiendanube_tags = []
-                tiendanube_tags = create_tags(existing_tags)
-
-                logger.info(f"Tags for product {product['id']}: {tiendanube_tags}")
-
-                # busco el producto en shopify por su handle, que es el id del producto en Tiendanube
-                logger.info(f"Searching for product {product['id']} in Shopify")
-                time.sleep(1)
-                shopify_product = None
-                params = {
-                    "handle": product["id"]
-                }
-                shopify_product = shopify.get_products(params)
-                shopify_product = shopify_product.get("products", [])[0] if shopify_product.get("products", []) else []
-
-                # formateo los atributos = options
-                tiendanube_attributes = [{"name": attr.get("es")} for attr in product.get("attributes", [])]
-                if not tiendanube_attributes:
-                    tiendanube_attributes.append({
-                        "name": "Title"
-                    })
-
-                product_description = product["description"]["es"]
-                soup = BeautifulSoup(product_description, "html.parser")
-                text_only = soup.get_text(separator="\n")
-                product_description = html.unescape(text_only)
-
-                if shopify_product:
-                    # Si el producto existe, lo actualizo
-                    logger.info(f"Updating product {product['id']} in Shopify")
-                    data = {
-                        "product": {
-                            "id": shopify_product['id'],
-                            "handle": product["id"],
-                            "title": product["name"]["es"],
-                            "body_html": product_description,
-                            "vendor": tienda,
-                            "product_type": TIENDANUBE_STORES[tienda]['category'],
-                            "tags": tiendanube_tags,
-                            "variants": tiendanube_variants,
-                            "published": product["published"],
-                            "status": "active",
-                            "options": tiendanube_attributes or shopify_product['options']
-                        }
-                    }
-                    time.sleep(0.3)
-                    response = shopify.update_product(shopify_product['id'], data)
-
-                else:
-                    # Si el producto no existe, lo creo
-                    data = {
-                        "product": {
-                            "title": product["name"]["es"],
-                            "handle": product["id"],
-                            "options": tiendanube_attributes,
-                            "body_html": product_description,
-                            "vendor": tienda,
-                            "product_type": TIENDANUBE_STORES[tienda]['category'],
-                            "tags": tiendanube_tags,
-                            "published": product["published"],
-                            "status": "active",
-                            "variants": tiendanube_variants
-                        }
-                    }
 
-                    time.sleep(0.3)
-                    response = shopify.create_product(data)
-
-                # Si el producto se crea correctamente, actualizo las imagenes
-                if response:
-                    shopify_product = response.get("product", [])
-                    shopify_product_variants = shopify_product.get("variants", [])
-                    variants_graphql_api_id = []
-
-                    # Mapear variantes de Tiendanube (por SKU) a IDs de variantes en Shopify
-                    shopify_variant_map = {}
-                    for variant in shopify_product_variants:
-
-                        variants_graphql_api_id.append(variant["admin_graphql_api_id"])
-
-                        # shopify_variant_map[str(variant.get("sku"))] = variant.get("id")
-                        sku = str(variant.get("sku"))
-                        shopify_variant_map[sku] = variant.get("id")
-
-                        inventory_item_id = variant.get("inventory_item_id")
-                        if not inventory_item_id:
-                            continue  # Evitar errores si no viene
-
-                        # Buscar el stock correspondiente a este SKU
-                        tiendanube_stock_variant = next(
-                            (v for v in product.get("variants", []) if str(v["id"]) == sku),
-                            None
-                        )
-                        if not tiendanube_stock_variant:
-                            continue
-
-                        stock = tiendanube_stock_variant.get("stock") if tiendanube_stock_variant.get("stock") is not None else 999
-                        if variant.get("inventory_quantity") == stock and TIENDANUBE_STORES[tienda]['deposit'] == shopify.DEFAULT_DEPOSIT:
-                            logger.info(f"Stock for variant {variant['id']} is already up to date in Shopify")
-                            continue
-
-                        data = {
-                            "location_id": TIENDANUBE_STORES[tienda]['deposit'],
-                            "inventory_item_id": variant['inventory_item_id'],
-                            "available": stock
-                        }
-                        time.sleep(1)  # Evitar rate limit de Shopify
-                        response = shopify.set_inventory_level(data)
-                        if response:
-                            logger.info(f"Stock updated successfully for variant {variant['id']} from Shopify")
-
-                        if TIENDANUBE_STORES[tienda]['deposit'] != shopify.DEFAULT_DEPOSIT:
-                            response = shopify.set_default_inventory_level(variant['inventory_item_id'])
-                            if response:
-                                logger.info(f"Stock updated successfully for variant {variant['id']} from Shopify")
-
-                    delivery_profile = TIENDANUBE_STORES[tienda].get('delivery_profile')
-                    if delivery_profile:
-                        shopify.add_variants_to_delivery_profile(delivery_profile, variants_graphql_api_id)
-
-                logger.info(f"Updating images for product {product['id']} in Shopify")
-
-                prod_img_shopify = set()
-                response = shopify.get_product_images(shopify_product['id'])
-                if response:
-                    prod_img_shopify = {str(img.get("alt")) for img in response.get("images", [])}
-
-                # logger.info(f"Fetched {len(prod_img_shopify)} images from Shopify's product ID {shopify_product['id']}")
-
-                images_to_upload = [
-                    img for img in tiendanube_images
-                    if str(img.get("alt")) not in prod_img_shopify
-                ]
-                logger.info(f"{len(images_to_upload)} images to load to Shopify")
-
-                futures = []
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    for image in images_to_upload:
-                        image_id = image.get("alt")
-                        # ⚠️ Convertir los variant_ids de Tiendanube a los de Shopify (vía SKU)
-                        variant_ids = [
-                            shopify_variant_map.get(str(rel["variant_id"]))
-                            for rel in relacion_variante_imagen
-                            if rel["image_id"] == image_id and shopify_variant_map.get(str(rel["variant_id"])) is not None
-                        ]
-
-                        futures.append(
-                            # executor.submit(upload_image_to_shopify, image, variant_ids, url, headers)
-                            executor.submit(shopify.upload_image_to_shopify, image, shopify_product['id'], variant_ids)
-                        )
-
-                    for future in as_completed(futures):
-                        result = future.result()
-                        print(f"Image {result['image_alt']} -> Status: {result['status']}")
-                        if result["status"] != 200:
-                            print(f"Error: {result['response']}")
-
-                logger.info(f"Product {product['id']} processed successfully")
-
-    except Exception as e:
-        logger.exception("Error occurred during product synchronization, Error: %s", str(e))
+    run_for_each_store(sync_store_products)
 
     end_time = time.time()
 
     logger.info(f"Products were created/updated in {calculate_execution_time(start_time, end_time)}")
 
 
+def process_checkpointed(run_id, tienda, products, handle_index):
+    """Procesa los productos anotando el resultado de cada uno en el checkpoint.
+
+    Un error en un producto queda registrado para reintentar y no corta la tienda.
+
+    Returns:
+        list: Los productos que fallaron, para poder reintentarlos sin volver a descargarlos
+    """
+    failed = []
+
+    def mark(product, ok, error):
+        checkpoint_store.mark(run_id, tienda, product['id'], ok, error)
+        if not ok:
+            failed.append(product)
+
+    process_products(tienda, products, handle_index, on_result=mark)
+    return failed
+
+
+def update_store_products(tienda, run_id, run_started_at):
+    logger.info("#" * 50)
+    if checkpoint_store.store_finished(run_id, tienda):
+        logger.info(f"Store {TIENDANUBE_STORES[tienda]['name']} already finished in run {run_id}, skipping")
+        return
+
+    logger.info(f"Fetching products from {TIENDANUBE_STORES[tienda]['name']}")
+
+    skipped = checkpoint_store.skipped_products(run_id, tienda)
+    logger.info(f"Products already processed in this run: {len(skipped)}")
+
+    handle_index = HandleIndex.build(shopify, tienda)
+
+    # Los productos de Tiendanube se van procesando a medida que llegan las paginas
+    listing = iter_tiendanube_products(tienda, oldest_first=True)
+    products = (product for product in listing if str(product['id']) not in skipped)
+    failed_products = process_checkpointed(run_id, tienda, products, handle_index)
+
+    # Un reintento de los que fallaron (y todavia tienen intentos) antes de cerrar la tienda
+    retry = checkpoint_store.failed_products(run_id, tienda)
+    failed_products = [product for product in failed_products if str(product['id']) in retry]
+    if failed_products:
+        logger.info(f"Retrying {len(failed_products)} failed products")
+        process_checkpointed(run_id, tienda, failed_products, handle_index)
+
+    finish_store_products(tienda, run_id, run_started_at, listing.complete)
+
+
+def finish_store_products(tienda, run_id, run_started_at, listado_completo):
+    """Cierra la tienda en el checkpoint si no quedaron productos con reintentos pendientes."""
+    failed = checkpoint_store.failed_products(run_id, tienda)
+    if failed:
+        # Quedan con reintentos pendientes: la proxima corrida retoma solo esos
+        logger.warning(f"{len(failed)} products failed in {TIENDANUBE_STORES[tienda]['name']}: {failed}")
+    elif listado_completo:
+        checkpoint_store.finish_store(run_id, tienda)
+        # Lo que cambie mientras corre el sync completo lo levanta el proximo incremental; si un
+        # incremental ya termino durante la corrida, su marca es mas nueva y no se pisa
+        watermark_store.advance(tienda, "products", run_started_at)
+        if not watermark_store.get(tienda, "stock"):
+            watermark_store.save(tienda, "stock", run_started_at)
+
+
+def bulk_store_products(tienda, run_id, run_started_at):
+    """Igual que update_store_products, pero crea y actualiza los productos con una bulk
+    mutation de Shopify (productSet) en lugar de una llamada REST por producto.
+
+    Los productos transformados se escriben a un JSONL que se sube de una vez; con el
+    resultado se actualizan el mapeo y el indice, y despues el stock (en lotes), el perfil
+    de envio, la publicacion y las imagenes que falten.
+    """
+    logger.info("#" * 50)
+    if checkpoint_store.store_finished(run_id, tienda):
+        logger.info(f"Store {TIENDANUBE_STORES[tienda]['name']} already finished in run {run_id}, skipping")
+        return
+
+    logger.info(f"Fetching products from {TIENDANUBE_STORES[tienda]['name']} for a bulk upsert")
+
+    skipped = checkpoint_store.skipped_products(run_id, tienda)
+    handle_index = HandleIndex.build(shopify, tienda)
+    category = TIENDANUBE_STORES[tienda]['category']
+
+    def mark(product, ok, error):
+        checkpoint_store.mark(run_id, tienda, product['id'], ok, error)
+
+    mutation = BulkMutation(shopify, PRODUCT_SET_MUTATION, BULK_POLL_INTERVAL)
+    pending = {}
+    listing = iter_tiendanube_products(tienda, oldest_first=True)
+    for product in listing:
+        if str(product['id']) in skipped:
+            continue
+        try:
+            item = prepare_product(tienda, {"product": product})
+        except Exception as e:
+            logger.exception(f"Error processing product {product.get('id')}: {e}")
+            mark(product, False, str(e))
+            continue
+        shopify_product = find_shopify_product(handle_index, product["id"])
+        if shopify_product and fingerprint_store.get(product["id"]) == item["fingerprint"]:
+            mark(product, True, None)
+            continue
+        mutation.add(str(product['id']), {"input": product_set_input(item, tienda, category, shopify_product)})
+        item["created"] = shopify_product is None
+        # De aca en mas solo hacen falta la huella, las imagenes y el stock de las variantes
+        for key in ("variants", "tags", "options", "description"):
+            item.pop(key)
+        item["product"] = {
+            "id": product["id"],
+            "variants": [{"id": variant["id"], "stock": variant["stock"]} for variant in product.get("variants", [])]
+        }
+        pending[str(product['id'])] = item
+
+    logger.info(f"Products to upsert in bulk for {TIENDANUBE_STORES[tienda]['name']}: {len(pending)}")
+
+    inventory = InventoryWriter(shopify, mirror=inventory_store)
+    variants_graphql_api_id = []
+    written = []
+    for key, result in mutation.run():
+        item = pending[key]
+        shopify_product, error = product_from_result(result)
+        if not shopify_product:
+            logger.error(f"Product {key} could not be saved in Shopify: {error}")
+            mark(item["product"], False, error)
+            continue
+
+        handle_index.add(shopify_product)
+        mapping_store.save_product(tienda, shopify_product, TIENDANUBE_STORES[tienda]['deposit'])
+
+        shopify_variant_map, graphql_ids = queue_product_stock(tienda, item["product"], shopify_product, inventory)
+        variants_graphql_api_id.extend(graphql_ids)
+        item.update({
+            "done": False,
+            "ok": True,
+            "shopify_product": shopify_product,
+            "shopify_variant_map": shopify_variant_map,
+        })
+        written.append(item)
+
+    # El stock de todos los productos va en lotes; un error deja el producto para reintentar
+    inventory.flush()
+    failed_items = {item_id for item_id, _ in inventory.errors}
+    for item in written:
+        if any(str(variant.get("inventory_item_id")) in failed_items for variant in item["shopify_product"]["variants"]):
+            item["ok"] = False
+
+    delivery_profile = TIENDANUBE_STORES[tienda].get('delivery_profile')
+    if delivery_profile:
+        for start in range(0, len(variants_graphql_api_id), 250):
+            shopify.add_variants_to_delivery_profile(delivery_profile, variants_graphql_api_id[start:start + 250])
+
+    # productSet no publica en los canales de venta: lo hago con otra bulk mutation
+    if SHOPIFY_PUBLICATION_ID and written:
+        publish = BulkMutation(shopify, PUBLISH_MUTATION, BULK_POLL_INTERVAL)
+        for item in written:
+            product_gid = f"gid://shopify/Product/{item['shopify_product']['id']}"
+            publish.add(str(item["product"]["id"]), {"id": product_gid, "input": [{"publicationId": SHOPIFY_PUBLICATION_ID}]})
+        for key, result in publish.run():
+            errors = (result or {}).get("errors") or ((result or {}).get("data") or {}).get("publishablePublish", {}).get("userErrors")
+            if result is None or errors:
+                logger.error(f"Product {key} could not be published: {errors}")
+    elif written:
+        logger.warning("SHOPIFY_PUBLICATION_ID is not set, products created in bulk are not published")
+
+    # Las imagenes que falten se suben por el pool, igual que en el sync por REST
+    lock = threading.Lock()
+
+    def finish(item):
+        with lock:
+            mark(item["product"], item["ok"], None if item["ok"] else "Product could not be fully synchronized")
+
+    images = image_pool.batch()
+    for item in written:
+        try:
+            sync_product_images(tienda, item, images, finish)
+        except Exception as e:
+            logger.exception(f"Error queuing images of product {item['product']['id']}: {e}")
+            finish({**item, "ok": False})
+    images.wait()
+
+    finish_store_products(tienda, run_id, run_started_at, listing.complete)
+
+
 def update_all_products():
     start_time = time.time()
     logger.info("==========> Synchronizing products... <==========")
-    try:
-        for tienda in TIENDANUBE_STORES:
-            logger.info("#" * 50)
-            logger.info(f"Fetching products from {TIENDANUBE_STORES[tienda]['name']}")
-
-            # Obtengo los productos de Tiendanube
-            products = []
-            headers = TIENDANUBE_STORES[tienda]['headers']
-            products_quantity = TIENDANUBE_STORES[tienda].get('product_quantity')
-
-            fetched = 0
-            page = 1
-            per_page = 200
-            products = []
-
-            while True:
-                params = {
-                    "per_page": per_page,
-                    "page": page,
-                    "published": "true",
-                    "sort_by": "created-at-descending",
-                }
 
-                url = f"{TIENDANUBE_STORES[tienda]['url']}/products"
-                current_products = tiendanube.get_products(url, headers, params)
-                if not current_products:
-                    break
-
-                products.extend(current_products)
-                fetched += len(current_products)
-
-                # Si se especificó un límite y lo alcanzamos, cortamos
-                if products_quantity and fetched >= products_quantity:
-                    products = products[:products_quantity]
-                    break
-
-                # Si trajo menos de per_page, ya no hay más páginas
-                if len(current_products) < per_page:
-                    break
-
-                page += 1
-
-            products.reverse()
-            logger.info(f"Total products to update: {len(products)}")
-            data = []
-
-            for product in products:
-
-                logger.info(f"Processing product {product['id']} from Tiendanube")
-
-                # Creo un array de las variantes de cada producto
-                tiendanube_variants = []
-                relacion_variante_imagen = []
-                for variant in product.get("variants", []):
-                    stock = variant["stock"] if variant["stock"] is not None else 999
-                    values = [v.get("es") for v in variant.get("values", [])]
-                    option1 = values[0] if len(values) > 0 else None
-                    option2 = values[1] if len(values) > 1 else None
-                    option3 = values[2] if len(values) > 2 else None
-
-                    tiendanube_variants.append({
-                        "sku": variant["id"],
-                        "grams": None,
-                        "price": calculate_price(variant["price"], variant["promotional_price"]),
-                        "weight": variant["weight"],
-                        "barcode": variant["barcode"],
-                        "option1": option1,
-                        "option2": option2,
-                        "option3": option3,
-                        "taxcode": None,
-                        "position": variant["position"],
-                        "weight_unit": None,
-                        "compare_at_price": calculate_price(variant["compare_at_price"]),
-                        "inventory_policy": "deny",
-                        "inventory_quantity": stock,
-                        "presentment_prices": [],
-                        "fulfillment_service": "manual",
-                        "inventory_management": "shopify"
-                    })
-
-                    # Relaciono la variante con la imagen
-                    # TODO aca se puede agregar el stock para actualizarlo si hace falta
-                    relacion_variante_imagen.append({
-                        "variant_id": variant["id"],  # es el sku de la variante en shopify
-                        "image_id": variant["image_id"]  # es el alt de la imagen en shopify
-                    })
-
-                logger.info(f"Fetched {len(tiendanube_variants)} variants for product {product['id']}")
-
-                tiendanube_images = []
-                for img in product.get("images", []):
-                    imagen = preparar_imagen_por_src(img)
-                    if imagen:
-                        tiendanube_images.append(imagen)
-
-                existing_tags = set(product.get("tags", "").split(","))
-
-                # Limpiá espacios (por si vienen tags con espacio al principio o final)
-                existing_tags = {tag.strip() for tag in existing_tags if tag.strip()}
-
-                # Agregá las categorías si no están ya
-                for handle_category in product.get("categories", []):
-                    tag_handle = handle_category["handle"]["es"].strip()
-                    tag_name = handle_category["name"]["es"].strip()
-                    if tag_handle not in existing_tags:
-                        existing_tags.add(tag_handle)
-                    if tag_name not in existing_tags:
-                        existing_tags.add(tag_name)
-
-                existing_tags.add(tienda)
-                existing_tags.add(TIENDANUBE_STORES[tienda]['category'])
-
-                # Convertilo de nuevo a lista si necesitás
-                tiendanube_tags = []
-                tiendanube_tags = create_tags(existing_tags)
-
-                logger.info(f"Tags for product {product['id']}: {tiendanube_tags}")
-
-                # busco el producto en shopify por su handle, que es el id del producto en Tiendanube
-                logger.info(f"Searching for product {product['id']} in Shopify")
-                time.sleep(1)
-                shopify_product = None
-                params = {
-                    "handle": product["id"]
-                }
-                shopify_product = shopify.get_products(params)
-                shopify_product = shopify_product.get("products", [])[0] if shopify_product.get("products", []) else []
-
-                # formateo los atributos = options
-                tiendanube_attributes = [{"name": attr.get("es")} for attr in product.get("attributes", [])]
-                if not tiendanube_attributes:
-                    tiendanube_attributes.append({
-                        "name": "Title"
-                    })
-
-                product_description = product["description"]["es"]
-                soup = BeautifulSoup(product_description, "html.parser")
-                text_only = soup.get_text(separator="\n")
-                product_description = html.unescape(text_only)
-
-                if shopify_product:
-                    # Si el producto existe, lo actualizo
-                    logger.info(f"Updating product {product['id']} in Shopify")
-                    data = {
-                        "product": {
-                            "id": shopify_product['id'],
-                            "handle": product["id"],
-                            "title": product["name"]["es"],
-                            "body_html": product_description,
-                            "vendor": tienda,
-                            "product_type": TIENDANUBE_STORES[tienda]['category'],
-                            "tags": tiendanube_tags,
-                            "variants": tiendanube_variants,
-                            "published": product["published"],
-                            "options": tiendanube_attributes or shopify_product['options']
-                        }
-                    }
-                    time.sleep(0.3)
-                    response = shopify.update_product(shopify_product['id'], data)
-
-                else:
-                    # Si el producto no existe, lo creo
-                    data = {
-                        "product": {
-                            "title": product["name"]["es"],
-                            "handle": product["id"],
-                            "options": tiendanube_attributes,
-                            "body_html": product_description,
-                            "vendor": tienda,
-                            "product_type": TIENDANUBE_STORES[tienda]['category'],
-                            "tags": tiendanube_tags,
-                            "published": product["published"],
-                            "status": "active",
-                            "variants": tiendanube_variants
-                        }
-                    }
+    # Si una corrida anterior quedo a medias la retomo
+    run_id = checkpoint_store.start_or_resume("update_all_products")
+    run_started_at = checkpoint_store.run_started_at(run_id)
+    logger.info(f"Full product sync run {run_id} started at {run_started_at.isoformat()}")
 
-                    time.sleep(0.3)
-                    response = shopify.create_product(data)
-
-                # Si el producto se crea correctamente, actualizo las imagenes
-                if response:
-                    shopify_product = response.get("product", [])
-                    shopify_product_variants = shopify_product.get("variants", [])
-                    variants_graphql_api_id = []
-
-                    # Mapear variantes de Tiendanube (por SKU) a IDs de variantes en Shopify
-                    shopify_variant_map = {}
-                    for variant in shopify_product_variants:
-                        # shopify_variant_map[str(variant.get("sku"))] = variant.get("id")
-                        sku = str(variant.get("sku"))
-                        shopify_variant_map[sku] = variant.get("id")
-
-                        variants_graphql_api_id.append(variant["admin_graphql_api_id"])
-
-                        inventory_item_id = variant.get("inventory_item_id")
-                        if not inventory_item_id:
-                            continue  # Evitar errores si no viene
-
-                        # Buscar el stock correspondiente a este SKU
-                        tiendanube_stock_variant = next(
-                            (v for v in product.get("variants", []) if str(v["id"]) == sku),
-                            None
-                        )
-                        if not tiendanube_stock_variant:
-                            continue
-
-                        stock = tiendanube_stock_variant.get("stock") if tiendanube_stock_variant.get("stock") is not None else 999
-                        if variant.get("inventory_quantity") == stock and TIENDANUBE_STORES[tienda]['deposit'] == shopify.DEFAULT_DEPOSIT:
-                            logger.info(f"Stock for variant {variant['id']} is already up to date in Shopify")
-                            continue
-
-                        data = {
-                            "location_id": TIENDANUBE_STORES[tienda]['deposit'],
-                            "inventory_item_id": variant['inventory_item_id'],
-                            "available": stock
-                        }
-                        time.sleep(1)  # Evitar rate limit de Shopify
-                        response = shopify.set_inventory_level(data)
-                        if response:
-                            logger.info(f"Stock updated successfully for variant {variant['id']} from Shopify")
-
-                        if TIENDANUBE_STORES[tienda]['deposit'] != shopify.DEFAULT_DEPOSIT:
-                            response = shopify.set_default_inventory_level(variant['inventory_item_id'])
-                            if response:
-                                logger.info(f"Stock updated successfully for variant {variant['id']} from Shopify")
-
-                    delivery_profile = TIENDANUBE_STORES[tienda].get('delivery_profile')
-                    if delivery_profile:
-                        shopify.add_variants_to_delivery_profile(delivery_profile, variants_graphql_api_id)
-
-                logger.info(f"Updating images for product {product['id']} in Shopify")
-
-                prod_img_shopify = set()
-                response = shopify.get_product_images(shopify_product['id'])
-                if response:
-                    prod_img_shopify = {str(img.get("alt")) for img in response.get("images", [])}
-
-                # logger.info(f"Fetched {len(prod_img_shopify)} images from Shopify's product ID {shopify_product['id']}")
-
-                images_to_upload = [
-                    img for img in tiendanube_images
-                    if str(img.get("alt")) not in prod_img_shopify
-                ]
-                logger.info(f"{len(images_to_upload)} images to load to Shopify")
-
-                futures = []
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    for image in images_to_upload:
-                        image_id = image.get("alt")
-                        # ⚠️ Convertir los variant_ids de Tiendanube a los de Shopify (vía SKU)
-                        variant_ids = [
-                            shopify_variant_map.get(str(rel["variant_id"]))
-                            for rel in relacion_variante_imagen
-                            if rel["image_id"] == image_id and shopify_variant_map.get(str(rel["variant_id"])) is not None
-                        ]
-
-                        futures.append(
-                            # executor.submit(upload_image_to_shopify, image, variant_ids, url, headers)
-                            executor.submit(shopify.upload_image_to_shopify, image, shopify_product['id'], variant_ids)
-                        )
-
-                    for future in as_completed(futures):
-                        result = future.result()
-                        print(f"Image {result['image_alt']} -> Status: {result['status']}")
-                        if result["status"] != 200:
-                            print(f"Error: {result['response']}")
-
-                logger.info(f"Product {product['id']} processed successfully")
+    run_for_each_store(bulk_store_products if BULK_SYNC else update_store_products, run_id, run_started_at)
 
-    except Exception as e:
-        logger.exception("Error occurred during product synchronization, Error: %s", str(e))
+    if all(checkpoint_store.store_finished(run_id, tienda) for tienda in TIENDANUBE_STORES):
+        checkpoint_store.finish_run(run_id)
+        logger.info(f"Full product sync run {run_id} finished")
 
     end_time = time.time()
 
@@ -743,7 +980,6 @@ def create_collections(categories_to_create):
                     "published": True
                 }
             }
-            time.sleep(0.35)
             shopify.create_smart_collection(collections)
 
         if f"{cat_general}-{second_level}" in shopify_collections:
@@ -762,7 +998,6 @@ def create_collections(categories_to_create):
                     "published": True
                 }
             }
-            time.sleep(0.35)
             shopify.create_smart_collection(collections)
 
         # Nivel 3: + específica
@@ -784,7 +1019,6 @@ def create_collections(categories_to_create):
                         "published": True
                     }
                 }
-                time.sleep(0.35)
                 shopify.create_smart_collection(collections)
 
 
@@ -793,26 +1027,157 @@ def collection_and_products():
     sync_products()
 
 
-def sync_stock():
+def sync_store_stock(tienda_key):
+    tienda_config = TIENDANUBE_STORES[tienda_key]
+    logger.info(f"Fetching products from {tienda_config['name']}")
+
+    # Retomo desde el ultimo updated_at procesado (o los ultimos 15 minutos si es la primera vez)
+    watermark = watermark_store.get(tienda_key, "stock") or datetime.now(timezone.utc) - STOCK_WINDOW
+    updated_at_min = watermark.isoformat()
+
+    tiendanube_variants = tiendanube.fetch_recent_variants(tienda_config, updated_at_min)
+    logger.info(f"Fetched {len(tiendanube_variants)} filtered variants from Tiendanube")
+
+    # sku -> variante de Shopify; primero lo que ya esta en el mapeo local
+    shopify_variants = {}
+    unmapped_handles = set()
+    for tn_variant in tiendanube_variants:
+        mapping = mapping_store.get_variant(tn_variant['id'])
+        if mapping and mapping['inventory_item_id']:
+            shopify_variants[str(tn_variant['id'])] = {
+                "id": mapping['shopify_variant_id'],
+                "sku": mapping['tn_variant_id'],
+                "inventory_item_id": mapping['inventory_item_id']
+            }
+        else:
+            unmapped_handles.add(str(tn_variant['product_id']))
+
+    # El resto lo resuelvo agrupado por producto, varios handles por llamada
+    if unmapped_handles:
+        logger.info(f"Getting {len(unmapped_handles)} products by handle from Shopify")
+        for shopify_product in run_async(async_shopify.fetch_shopify_variants_by_handles(unmapped_handles)).values():
+            mapping_store.save_product(tienda_key, shopify_product, tienda_config['deposit'])
+            for sh_variant in shopify_product.get("variants", []):
+                shopify_variants[str(sh_variant.get("sku"))] = sh_variant
+
+    # Los cambios de stock se mandan en lotes, varios por llamada; lo que no cambio
+    # desde la ultima escritura lo saltea el espejo de stock
+    inventory = InventoryWriter(shopify, mirror=inventory_store)
+    for tn_variant in tiendanube_variants:
+        sh_variant = shopify_variants.get(str(tn_variant['id']))
+        if sh_variant:
+            shopify.process_variant_stock_update(tienda_config, tn_variant, sh_variant, inventory)
+    inventory.flush()
+    logger.info(f"Stock unchanged for {inventory.skipped} variants of {tienda_config['name']}, not written")
+
+    # Las variantes que no se pudieron escribir frenan la marca de agua para reintentarlas
+    failed_items = {item_id for item_id, _ in inventory.errors}
+    processed = []
+    for tn_variant in tiendanube_variants:
+        sh_variant = shopify_variants.get(str(tn_variant['id'])) or {}
+        ok = str(sh_variant.get('inventory_item_id')) not in failed_items
+        processed.append((parse_datetime(tn_variant.get("updated_at")), ok))
+    watermark_store.save(tienda_key, "stock", calculate_watermark(watermark, processed))
+
+
+async def fetch_tiendanube_products(products: list, params: dict = None) -> list:
+    """Trae en paralelo una lista de (tienda, tn_product_id); {} para los que fallaron."""
+    return await asyncio.gather(*(
+        async_tiendanube.get_product(f"{TIENDANUBE_STORES[tienda]['url']}/products/{tn_product_id}",
+                                     TIENDANUBE_STORES[tienda]['headers'], params)
+        for tienda, tn_product_id in products
+    ))
+
+
+def read_mirrored_inventory_levels():
+    """Stock en Shopify de lo que esta en el espejo, por REST (de a 50 items por deposito).
+
+    Es el respaldo de export_inventory_levels: mas llamadas, pero no depende de la bulk
+    query. Los items que no se pudieron leer no salen, asi no se toman como diferencias.
+
+    Yields:
+        tuple: (inventory_item_id, deposito, disponible)
+    """
+    locations = {str(config['deposit']) for config in TIENDANUBE_STORES.values()} | {str(shopify.DEFAULT_DEPOSIT)}
+    for location_id in sorted(locations):
+        mirrored = inventory_store.by_location(location_id)
+        if not mirrored:
+            continue
+        levels = shopify.get_inventory_levels(mirrored.keys(), location_id)
+        for inventory_item_id in mirrored:
+            if inventory_item_id in levels:
+                yield inventory_item_id, location_id, levels[inventory_item_id]
+
+
+def verify_inventory():
+    """Compara el espejo de stock con lo que tiene Shopify y corrige lo que no coincide.
+
+    El stock puede cambiar en Shopify por fuera de la sincronizacion (a mano, por otra app);
+    como las escrituras se saltean cuando el espejo dice que no cambio, esas diferencias
+    no se corregirian nunca. Lo que no coincide se vuelve a setear: en el deposito de la
+    tienda con el stock actual de Tiendanube y en el deposito por defecto en 0.
+    """
     start_time = time.time()
-    logger.info("==========> Synchronizing stock... <==========")
+    logger.info("==========> Verifying inventory mirror... <==========")
+
+    inventory = InventoryWriter(shopify, mirror=inventory_store)
+    drifted_products = {}
+    # El stock real sale de un export de todos los niveles, que se lee de a uno por vez
+    levels = export_inventory_levels()
+    if levels is None:
+        logger.warning("Could not export the inventory levels from Shopify, reading the mirrored items through REST")
+        levels = read_mirrored_inventory_levels()
+    for inventory_item_id, location_id, available in levels:
+        quantity = inventory_store.get(inventory_item_id, location_id)
+        if quantity is None or quantity == available:
+            continue
+        logger.warning(
+            f"Inventory item {inventory_item_id} at location {location_id} is {available} "
+            f"in Shopify but {quantity} was set"
+        )
+        # Ya no se sabe que hay en Shopify: si no se puede corregir ahora lo escribe el proximo sync
+        inventory_store.delete(inventory_item_id, location_id)
+        # El item se cruza con su tienda y su producto por el mapeo (que refresca el export del catalogo)
+        mapping = mapping_store.get_variant_by_inventory_item(inventory_item_id)
+        if not mapping or mapping['store'] not in TIENDANUBE_STORES:
+            continue
+        if location_id != str(TIENDANUBE_STORES[mapping['store']]['deposit']):
+            inventory.set(inventory_item_id, location_id, 0, force=True)
+        else:
+            drifted_products.setdefault((mapping['store'], mapping['tn_product_id']), {})[mapping['tn_variant_id']] = inventory_item_id
+
+    # El stock de la tienda se vuelve a leer de Tiendanube, que es la fuente de verdad
+    # (todos los productos a la vez; el rate limit de cada tienda las va paceando)
+    products = run_async(fetch_tiendanube_products(list(drifted_products), {"fields": "variants"}))
+    for ((tienda, _), variants), product in zip(drifted_products.items(), products):
+        for variant in product.get("variants", []):
+            inventory_item_id = variants.get(str(variant["id"]))
+            if inventory_item_id:
+                stock = variant["stock"] if variant["stock"] is not None else 999
+                inventory.set(inventory_item_id, TIENDANUBE_STORES[tienda]['deposit'], stock, force=True)
+    inventory.flush()
+
+    end_time = time.time()
+    logger.info(f"Inventory verification completed in {calculate_execution_time(start_time, end_time)}")
 
-    updated_at_min = (datetime.now() - timedelta(minutes=15)).isoformat()
 
-    for tienda_key, tienda_config in TIENDANUBE_STORES.items():
-        logger.info(f"Fetching products from {tienda_config['name']}")
+def purge_webhook_ledger():
+    older_than = datetime.now(timezone.utc) - timedelta(days=WEBHOOK_LEDGER_RETENTION_DAYS)
+    purged = webhook_ledger.store.purge(older_than)
+    logger.info(f"Purged {purged} webhook ledger entries older than {older_than.isoformat()}")
 
-        tiendanube_variants = tiendanube.fetch_recent_variants(tienda_config, updated_at_min)
-        logger.info(f"Fetched {len(tiendanube_variants)} filtered variants from Tiendanube")
 
-        for tn_variant in tiendanube_variants:
-            handle = tn_variant['product_id']
-            logger.info(f"Getting product with handle {handle} from Shopify")
+def purge_order_queue():
+    older_than = datetime.now(timezone.utc) - timedelta(days=ORDER_QUEUE_RETENTION_DAYS)
+    orders, decrements = order_queue_store.purge(older_than)
+    logger.info(f"Purged {orders} resolved orders and {decrements} applied stock decrements older than {older_than.isoformat()}")
 
-            shopify_variants = shopify.fetch_shopify_variants_by_handle(handle)
 
-            for sh_variant in shopify_variants:
-                shopify.process_variant_stock_update(tienda_config, tn_variant, sh_variant)
+def sync_stock():
+    start_time = time.time()
+    logger.info("==========> Synchronizing stock... <==========")
+
+    run_for_each_store(sync_store_stock)
 
     end_time = time.time()
     logger.info(f"Stock sync completed in {calculate_execution_time(start_time, end_time)}")
@@ -820,19 +1185,34 @@ def sync_stock():
 
 @app.on_event("startup")
 def start_scheduler():
+    logger.info("Starting order queue worker")
+    order_queue_worker.start()
     logger.info("Starting schedulers")
 
     def startup_sequence():
         create_collections(CATEGORIES_TO_CREATE)
         try:
-            update_all_products()
+            # Si todas las tiendas tienen marca de agua alcanza con ponerse al dia desde ahi,
+            # salvo que haya un sync completo a medias, que se retoma
+            if checkpoint_store.unfinished_run("update_all_products"):
+                logger.info("Resuming the unfinished full product sync")
+                update_all_products()
+            elif all(watermark_store.get(tienda, "products") for tienda in TIENDANUBE_STORES):
+                logger.info("Watermarks found for every store, catching up instead of a full resync")
+                sync_products()
+            else:
+                update_all_products()
             logger.info("Starting scheduler for sync_stock")
             scheduler.add_job(sync_stock, 'interval', minutes=15, id='sync_stock_job', max_instances=1, coalesce=True)
             logger.info("Starting scheduler for sync_products")
             scheduler.add_job(sync_products, 'interval', hours=6, id="sync_products_job", max_instances=1, coalesce=True)
+            logger.info("Starting scheduler for verify_inventory")
+            scheduler.add_job(verify_inventory, 'interval', hours=INVENTORY_VERIFY_HOURS, id="verify_inventory_job", max_instances=1, coalesce=True)
         except Exception as e:
             logger.error(f"Error el en startup_sequence: {e}")
 
+    scheduler.add_job(purge_webhook_ledger, 'interval', hours=24, id="purge_webhook_ledger_job", max_instances=1, coalesce=True)
+    scheduler.add_job(purge_order_queue, 'interval', hours=24, id="purge_order_queue_job", max_instances=1, coalesce=True)
     scheduler.add_job(startup_sequence, trigger='date', run_date=datetime.now() + timedelta(seconds=10), id="initial_update_job")
     scheduler.start()
 
@@ -841,3 +1221,6 @@ def start_scheduler():
 def shutdown_scheduler():
     logger.info("Shutting down scheduler")
     scheduler.shutdown()
+    order_queue_worker.stop(timeout=10)
+    run_async(async_tiendanube.aclose())
+    run_async(async_shopify.aclose())
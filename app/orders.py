@@ -0,0 +1,47 @@
+from app.logger import logger
+
+
+def resolve_line_item(line_item: dict, mapping_store, shopify, stores: dict):
+    """Resuelve producto y variante de Tiendanube de un line item de un pedido de Shopify.
+
+    El SKU de la variante ya es el ID de la variante en Tiendanube y el vendor es la tienda,
+    asi que solo falta el producto: se busca en el mapeo local, primero por el ID de la
+    variante de Shopify y despues por el SKU. Solo si no esta se pide el producto a Shopify
+    (una llamada, con handle y variantes) y se guarda en el mapeo para los pedidos siguientes.
+
+    Returns:
+        dict: {"vendor", "quantity", "product_id", "variant_id"}, o None si no se pudo resolver
+    """
+    pedido = {
+        "vendor": line_item.get("vendor"),
+        "quantity": line_item.get("quantity"),
+        "product_id": None,
+        "variant_id": str(line_item["sku"]) if line_item.get("sku") else None,
+    }
+
+    mapping = None
+    if line_item.get("variant_id"):
+        mapping = mapping_store.get_variant_by_shopify_id(line_item["variant_id"])
+    if not mapping and pedido["variant_id"]:
+        mapping = mapping_store.get_variant(pedido["variant_id"])
+
+    if mapping:
+        pedido["product_id"] = mapping["tn_product_id"]
+        pedido["variant_id"] = mapping["tn_variant_id"]
+        pedido["vendor"] = pedido["vendor"] or mapping["store"]
+    elif line_item.get("product_id"):
+        logger.info(f"Variant {line_item.get('variant_id')} not in the local mapping, obtaining product {line_item['product_id']} from Shopify")
+        response = shopify.get_product(line_item["product_id"], params={"fields": "id,handle,variants"})
+        shopify_product = response.get("product") if response else None
+        if shopify_product:
+            pedido["product_id"] = shopify_product["handle"]
+            variant = next((v for v in shopify_product.get("variants", []) if v.get("id") == line_item.get("variant_id")), None)
+            if variant and variant.get("sku"):
+                pedido["variant_id"] = str(variant["sku"])
+            if str(pedido["vendor"]) in stores:
+                mapping_store.save_product(str(pedido["vendor"]), shopify_product, stores[str(pedido["vendor"])].get("deposit"))
+
+    if not pedido["vendor"] or not pedido["product_id"] or not pedido["variant_id"]:
+        logger.error(f"Could not resolve line item {line_item.get('id')}: {pedido}")
+        return None
+    return pedido
@@ -0,0 +1,114 @@
+import queue
+import threading
+
+from app.logger import logger
+
+# Marca de fin de la cola: cada worker que la recibe termina
+_DONE = object()
+
+
+class Stage():
+    """Una etapa del pipeline: `func(item)` corre en `workers` hilos y devuelve el item
+    (modificado o no) para la etapa siguiente."""
+
+    def __init__(self, name: str, func, workers: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = max(int(workers), 1)
+
+
+class Pipeline():
+    """Etapas conectadas por colas acotadas (productor/consumidor).
+
+    Cada etapa tiene sus propios workers y toma los items de la cola de la etapa anterior,
+    asi que mientras una etapa espera la red la otra sigue trabajando. Las colas tienen
+    tamaño maximo: si una etapa se atrasa, las anteriores se frenan al llenarla en lugar de
+    acumular todo el catalogo en memoria.
+
+    Args:
+        stages: Lista de Stage, en orden
+        queue_size: Tamaño maximo de la cola de entrada de cada etapa
+        on_result: Se llama con cada item que sale de la ultima etapa
+        on_error: Se llama con (item, exception) si una etapa lanza una excepcion; el item
+            no sigue a las etapas siguientes
+    """
+
+    def __init__(self, stages: list, queue_size: int = 20, on_result=None, on_error=None):
+        self.stages = stages
+        self.queue_size = max(int(queue_size), 1)
+        self.on_result = on_result
+        self.on_error = on_error
+        self._callback_lock = threading.Lock()
+
+    def _callback(self, callback, *args):
+        if callback is None:
+            return
+        # Los callbacks se llaman de a uno, asi no necesitan ser thread-safe
+        with self._callback_lock:
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.exception(f"Error in pipeline callback: {e}")
+
+    def run(self, source):
+        """Pasa todos los items de `source` por las etapas y espera a que terminen.
+
+        `source` puede ser cualquier iterable (una lista o un generador que va
+        descargando paginas); se consume en un hilo propio.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        pending = [stage.workers for stage in self.stages]
+        pending_lock = threading.Lock()
+        parent = threading.current_thread().name
+        threads = []
+
+        def close(index):
+            # Avisa a todos los workers de la etapa `index` que no hay mas items
+            if index < len(self.stages):
+                for _ in range(self.stages[index].workers):
+                    queues[index].put(_DONE)
+
+        def produce():
+            try:
+                for item in source:
+                    queues[0].put(item)
+            except Exception as e:
+                logger.exception(f"Error reading the pipeline source: {e}")
+                self._callback(self.on_error, None, e)
+            finally:
+                close(0)
+
+        def work(index):
+            stage = self.stages[index]
+            while True:
+                item = queues[index].get()
+                if item is _DONE:
+                    break
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    logger.exception(f"Error in pipeline stage {stage.name}: {e}")
+                    self._callback(self.on_error, item, e)
+                    continue
+                if index + 1 < len(self.stages):
+                    queues[index + 1].put(result)
+                else:
+                    self._callback(self.on_result, result)
+
+            # El ultimo worker de la etapa cierra la siguiente
+            with pending_lock:
+                pending[index] -= 1
+                last = pending[index] == 0
+            if last:
+                close(index + 1)
+
+        threads.append(threading.Thread(target=produce, name=f"{parent}-source", daemon=True))
+        for index, stage in enumerate(self.stages):
+            for number in range(stage.workers):
+                name = f"{parent}-{stage.name}-{number}"
+                threads.append(threading.Thread(target=work, args=(index,), name=name, daemon=True))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
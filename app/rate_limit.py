@@ -0,0 +1,128 @@
+import time
+import asyncio
+import threading
+
+from app.logger import logger
+
+
+class LeakyBucket():
+    """Leaky bucket thread-safe para pacear llamadas a una API.
+
+    `used` es la ocupacion estimada del bucket (incluye las reservas que siguen en vuelo)
+    y se vacia a `leak_rate` llamadas por segundo. Las subclases lo sincronizan con los
+    headers que devuelve cada API.
+    """
+
+    name = "API"
+
+    def __init__(self, bucket_size: float = 40, leak_rate: float = 2.0, margin: float = 2):
+        self.lock = threading.Lock()
+        self.bucket_size = bucket_size
+        self.leak_rate = leak_rate
+        self.margin = margin
+        self.used = 0.0
+        self.pending = 0
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _leak(self, now: float):
+        elapsed = now - self.updated_at
+        self.used = max(0.0, self.used - elapsed * self.leak_rate)
+        self.updated_at = now
+
+    def reserve(self, cost: float = 1) -> float:
+        """Reserva lugar en el bucket y devuelve cuantos segundos hay que esperar."""
+        with self.lock:
+            now = time.monotonic()
+            self._leak(now)
+            delay = max(0.0, self.blocked_until - now)
+            overflow = self.used + cost - (self.bucket_size - self.margin)
+            if overflow > 0:
+                delay = max(delay, overflow / self.leak_rate)
+            self.used += cost
+            self.pending += 1
+            return delay
+
+    def acquire(self, cost: float = 1):
+        delay = self.reserve(cost)
+        if delay > 0:
+            logger.info(f"{self.name} rate limit: waiting {delay:.2f}s")
+            time.sleep(delay)
+
+    async def acquire_async(self, cost: float = 1):
+        """Como acquire, pero espera sin bloquear el event loop."""
+        delay = self.reserve(cost)
+        if delay > 0:
+            logger.info(f"{self.name} rate limit: waiting {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def call(self, send, retry_wait, max_retries: int, description: str):
+        """Hace una llamada respetando el bucket y la reintenta si hace falta.
+
+        Es el unico loop de reintentos de los clientes sincronicos; los async usan
+        `call_async`, que hace lo mismo.
+
+        Args:
+            send: Funcion sin argumentos que hace la llamada y devuelve la respuesta
+            retry_wait: Funcion (respuesta, intento) -> segundos a esperar antes de
+                reintentar, o None si la respuesta se devuelve tal cual
+            max_retries: Reintentos como maximo; despues se devuelve la ultima respuesta
+            description: Para el log (ej: "GET https://...")
+        """
+        for attempt in range(max_retries + 1):
+            self.acquire()
+            response = None
+            try:
+                response = send()
+            finally:
+                self.release(response)
+            wait = retry_wait(response, attempt)
+            if wait is None or attempt == max_retries:
+                return response
+            logger.warning(f"{self.name} returned {response.status_code} for {description}, retrying in {wait:.2f}s")
+            self.block(wait)
+        return response
+
+    async def call_async(self, send, retry_wait, max_retries: int, description: str):
+        """Como call, pero `send` devuelve una corutina y se espera sin bloquear el event loop."""
+        for attempt in range(max_retries + 1):
+            await self.acquire_async()
+            response = None
+            try:
+                response = await send()
+            finally:
+                self.release(response)
+            wait = retry_wait(response, attempt)
+            if wait is None or attempt == max_retries:
+                return response
+            logger.warning(f"{self.name} returned {response.status_code} for {description}, retrying in {wait:.2f}s")
+            self.block(wait)
+        return response
+
+    def sync(self, used: float, bucket_size: float = None, leak_rate: float = None):
+        """Ajusta el bucket a lo que informa la API. Se llama con el lock tomado."""
+        self.updated_at = time.monotonic()
+        if bucket_size:
+            self.bucket_size = bucket_size
+        if leak_rate:
+            self.leak_rate = leak_rate
+        # Lo que informa la API ya incluye esta llamada, le sumo las que siguen en vuelo
+        self.used = used + self.pending
+
+    def release(self, response=None):
+        """Libera la reserva de una llamada y sincroniza el bucket con la respuesta."""
+        with self.lock:
+            self.pending = max(0, self.pending - 1)
+            if response is not None:
+                self.update_from_headers(response.headers)
+
+    def update_from_headers(self, headers):
+        """Las subclases leen los headers de rate limit de su API."""
+
+    def block(self, seconds: float):
+        """Frena todas las llamadas durante `seconds` (429 / Retry-After)."""
+        with self.lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.used = self.bucket_size
+            self.updated_at = now
@@ -0,0 +1,67 @@
+import os
+import httpx
+import requests
+
+from requests.adapters import HTTPAdapter
+
+
+def create_session(pool_size: int = None, pool_hosts: int = None) -> requests.Session:
+    """Crea una sesion HTTP con pool de conexiones keep-alive.
+
+    `pool_size` es la cantidad maxima de conexiones abiertas por host y `pool_hosts` la
+    cantidad de hosts distintos que se mantienen en el pool. Con pool_block=True los hilos
+    que superan el limite esperan una conexion libre en vez de abrir una nueva, asi la
+    misma sesion se puede compartir entre el pool de subida de imagenes y los hilos
+    que atienden los webhooks (los headers se fijan al crearla y no se modifican despues).
+
+    Args:
+        pool_size: Conexiones por host (por defecto HTTP_POOL_SIZE o 10)
+        pool_hosts: Hosts en el pool (por defecto HTTP_POOL_HOSTS o 4)
+
+    Returns:
+        requests.Session: Sesion lista para usar
+    """
+    pool_size = pool_size or int(os.getenv("HTTP_POOL_SIZE", 10))
+    pool_hosts = pool_hosts or int(os.getenv("HTTP_POOL_HOSTS", 4))
+
+    # Los reintentos los manejan los clientes (429 / rate limit), no urllib3
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+def http2_available() -> bool:
+    """HTTP/2 necesita el paquete h2 (pip install httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_async_client(pool_size: int = None, timeout: float = None) -> httpx.AsyncClient:
+    """Crea un cliente httpx async con pool de conexiones, en HTTP/2 si esta disponible.
+
+    Con HTTP/2 las llamadas concurrentes al mismo host comparten una conexion; sin h2 se
+    usa HTTP/1.1 con hasta `pool_size` conexiones keep-alive. El cliente queda atado al
+    event loop donde se usa por primera vez (ver app.aio.BackgroundLoop).
+
+    Args:
+        pool_size: Conexiones maximas (por defecto ASYNC_POOL_SIZE o 100)
+        timeout: Segundos de timeout por llamada (por defecto HTTP_TIMEOUT o 60)
+    """
+    pool_size = pool_size or int(os.getenv("ASYNC_POOL_SIZE", 100))
+    timeout = timeout or float(os.getenv("HTTP_TIMEOUT", 60))
+    return httpx.AsyncClient(
+        http2=http2_available(),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=timeout,
+        headers={"Accept-Encoding": "gzip, deflate"},
+    )
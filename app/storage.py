@@ -0,0 +1,627 @@
+import os
+import json
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Database():
+    """Base SQLite embebida donde se persiste el estado de la sincronizacion.
+
+    Usa una unica conexion protegida por un lock, asi se puede compartir entre los jobs
+    del scheduler y los hilos que atienden los webhooks.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("SYNC_DB_PATH", "data/sync.db")
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                yield self.connection
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def execute(self, sql: str, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def executescript(self, sql: str):
+        with self.lock:
+            self.connection.executescript(sql)
+
+
+class MappingStore():
+    """Relacion persistente entre los IDs de Tiendanube y los de Shopify.
+
+    En Shopify el handle del producto es el ID del producto en Tiendanube y el SKU de la
+    variante es el ID de la variante en Tiendanube; aca se guardan ademas los IDs de Shopify
+    (producto, variante, inventory_item, admin_graphql_api_id) para no tener que
+    volver a buscarlos por HTTP.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS product_mappings (
+            tn_product_id TEXT PRIMARY KEY,
+            store TEXT,
+            shopify_product_id INTEGER NOT NULL,
+            updated_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS variant_mappings (
+            tn_variant_id TEXT PRIMARY KEY,
+            tn_product_id TEXT NOT NULL,
+            store TEXT,
+            shopify_variant_id INTEGER NOT NULL,
+            shopify_product_id INTEGER NOT NULL,
+            inventory_item_id INTEGER,
+            admin_graphql_api_id TEXT,
+            location_id TEXT,
+            updated_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_variant_mappings_product ON variant_mappings (tn_product_id);
+        CREATE INDEX IF NOT EXISTS idx_variant_mappings_shopify ON variant_mappings (shopify_variant_id);
+        CREATE INDEX IF NOT EXISTS idx_variant_mappings_inventory ON variant_mappings (inventory_item_id);
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.db.executescript(self.SCHEMA)
+
+    def save_product(self, store: str, shopify_product: dict, location_id: str = None):
+        """Guarda el producto y sus variantes a partir de una respuesta de Shopify."""
+        if not shopify_product or not shopify_product.get("handle"):
+            return
+        tn_product_id = str(shopify_product["handle"])
+        updated_at = now_iso()
+        with self.db.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO product_mappings VALUES (?, ?, ?, ?)",
+                (tn_product_id, store, shopify_product["id"], updated_at)
+            )
+            for variant in shopify_product.get("variants", []):
+                if not variant.get("sku"):
+                    continue
+                connection.execute(
+                    "INSERT OR REPLACE INTO variant_mappings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (str(variant["sku"]), tn_product_id, store, variant["id"], shopify_product["id"],
+                     variant.get("inventory_item_id"), variant.get("admin_graphql_api_id"), location_id, updated_at)
+                )
+
+    def get_product(self, tn_product_id):
+        rows = self.db.execute("SELECT * FROM product_mappings WHERE tn_product_id = ?", (str(tn_product_id),))
+        return dict(rows[0]) if rows else None
+
+    def get_variant(self, tn_variant_id):
+        rows = self.db.execute("SELECT * FROM variant_mappings WHERE tn_variant_id = ?", (str(tn_variant_id),))
+        return dict(rows[0]) if rows else None
+
+    def get_variant_by_shopify_id(self, shopify_variant_id):
+        rows = self.db.execute("SELECT * FROM variant_mappings WHERE shopify_variant_id = ?", (int(shopify_variant_id),))
+        return dict(rows[0]) if rows else None
+
+    def get_variant_by_inventory_item(self, inventory_item_id):
+        rows = self.db.execute("SELECT * FROM variant_mappings WHERE inventory_item_id = ?", (int(inventory_item_id),))
+        return dict(rows[0]) if rows else None
+
+    def get_variants_by_product(self, tn_product_id) -> list:
+        rows = self.db.execute("SELECT * FROM variant_mappings WHERE tn_product_id = ?", (str(tn_product_id),))
+        return [dict(row) for row in rows]
+
+
+class FingerprintStore():
+    """Huella del ultimo payload de cada producto que se subio con exito a Shopify."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS product_fingerprints (
+            tn_product_id TEXT PRIMARY KEY,
+            store TEXT,
+            fingerprint TEXT NOT NULL,
+            pushed_at TEXT
+        );
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.db.executescript(self.SCHEMA)
+
+    def get(self, tn_product_id):
+        rows = self.db.execute("SELECT fingerprint FROM product_fingerprints WHERE tn_product_id = ?", (str(tn_product_id),))
+        return rows[0]["fingerprint"] if rows else None
+
+    def save(self, tn_product_id, store: str, fingerprint: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO product_fingerprints VALUES (?, ?, ?, ?)",
+            (str(tn_product_id), store, fingerprint, now_iso())
+        )
+
+    def delete(self, tn_product_id):
+        self.db.execute("DELETE FROM product_fingerprints WHERE tn_product_id = ?", (str(tn_product_id),))
+
+
+class WatermarkStore():
+    """Marca de agua por tienda y job: el mayor updated_at (con zona horaria) ya procesado.
+
+    Los jobs incrementales retoman desde aca, asi una corrida que se atrasa, se saltea
+    o un reinicio del proceso no pierden cambios.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sync_watermarks (
+            store TEXT NOT NULL,
+            job TEXT NOT NULL,
+            watermark TEXT NOT NULL,
+            updated_at TEXT,
+            PRIMARY KEY (store, job)
+        );
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.db.executescript(self.SCHEMA)
+
+    def get(self, store: str, job: str):
+        rows = self.db.execute("SELECT watermark FROM sync_watermarks WHERE store = ? AND job = ?", (store, job))
+        return datetime.fromisoformat(rows[0]["watermark"]) if rows else None
+
+    def save(self, store: str, job: str, watermark: datetime):
+        """Guarda la marca de agua; las fechas sin zona horaria se toman como UTC."""
+        if watermark.tzinfo is None:
+            watermark = watermark.replace(tzinfo=timezone.utc)
+        self.db.execute(
+            "INSERT OR REPLACE INTO sync_watermarks VALUES (?, ?, ?, ?)",
+            (store, job, watermark.isoformat(), now_iso())
+        )
+
+    def advance(self, store: str, job: str, watermark: datetime):
+        """Guarda la marca de agua solo si es posterior a la actual (nunca la hace retroceder)."""
+        if watermark.tzinfo is None:
+            watermark = watermark.replace(tzinfo=timezone.utc)
+        with self.db.lock:
+            current = self.get(store, job)
+            if current is None or watermark > current:
+                self.save(store, job, watermark)
+
+
+class InventoryStore():
+    """Espejo del stock: la ultima cantidad que se seteo con exito en Shopify para cada
+    (inventory_item_id, deposito), con la fecha en que se seteo.
+
+    Permite saltear las escrituras de stock que no cambiaron sin leer el valor de Shopify.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS inventory_mirror (
+            inventory_item_id TEXT NOT NULL,
+            location_id TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            pushed_at TEXT,
+            PRIMARY KEY (inventory_item_id, location_id)
+        );
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.db.executescript(self.SCHEMA)
+
+    def get(self, inventory_item_id, location_id):
+        rows = self.db.execute(
+            "SELECT quantity FROM inventory_mirror WHERE inventory_item_id = ? AND location_id = ?",
+            (str(inventory_item_id), str(location_id))
+        )
+        return rows[0]["quantity"] if rows else None
+
+    def save_many(self, quantities: list):
+        """Guarda una lista de (inventory_item_id, location_id, quantity) en una transaccion."""
+        pushed_at = now_iso()
+        with self.db.transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO inventory_mirror VALUES (?, ?, ?, ?)",
+                [(str(item_id), str(location_id), quantity, pushed_at) for item_id, location_id, quantity in quantities]
+            )
+
+    def delete(self, inventory_item_id, location_id):
+        self.db.execute(
+            "DELETE FROM inventory_mirror WHERE inventory_item_id = ? AND location_id = ?",
+            (str(inventory_item_id), str(location_id))
+        )
+
+    def by_location(self, location_id) -> dict:
+        """inventory_item_id -> cantidad de todo lo espejado en un deposito."""
+        rows = self.db.execute(
+            "SELECT inventory_item_id, quantity FROM inventory_mirror WHERE location_id = ?", (str(location_id),)
+        )
+        return {row["inventory_item_id"]: row["quantity"] for row in rows}
+
+
+class CheckpointStore():
+    """Progreso del sync completo por tienda y por producto, para poder retomarlo.
+
+    Una corrida queda abierta hasta que todas las tiendas terminan; si el proceso se reinicia
+    en el medio, la proxima corrida retoma la misma y saltea lo que ya se hizo.
+    """
+
+    MAX_ATTEMPTS = 3
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sync_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS sync_run_stores (
+            run_id INTEGER NOT NULL,
+            store TEXT NOT NULL,
+            finished_at TEXT,
+            PRIMARY KEY (run_id, store)
+        );
+        CREATE TABLE IF NOT EXISTS sync_checkpoints (
+            run_id INTEGER NOT NULL,
+            store TEXT NOT NULL,
+            tn_product_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at TEXT,
+            PRIMARY KEY (run_id, store, tn_product_id)
+        );
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.db.executescript(self.SCHEMA)
+
+    def unfinished_run(self, job: str):
+        rows = self.db.execute(
+            "SELECT run_id FROM sync_runs WHERE job = ? AND finished_at IS NULL ORDER BY run_id DESC LIMIT 1", (job,)
+        )
+        return rows[0]["run_id"] if rows else None
+
+    def start_or_resume(self, job: str) -> int:
+        """Devuelve la corrida sin terminar del job, o crea una nueva."""
+        with self.db.transaction() as connection:
+            row = connection.execute(
+                "SELECT run_id FROM sync_runs WHERE job = ? AND finished_at IS NULL ORDER BY run_id DESC LIMIT 1", (job,)
+            ).fetchone()
+            if row:
+                return row["run_id"]
+            return connection.execute(
+                "INSERT INTO sync_runs (job, started_at) VALUES (?, ?)", (job, now_iso())
+            ).lastrowid
+
+    def run_started_at(self, run_id: int):
+        rows = self.db.execute("SELECT started_at FROM sync_runs WHERE run_id = ?", (run_id,))
+        return datetime.fromisoformat(rows[0]["started_at"]) if rows else None
+
+    def finish_run(self, run_id: int):
+        self.db.execute("UPDATE sync_runs SET finished_at = ? WHERE run_id = ?", (now_iso(), run_id))
+
+    def store_finished(self, run_id: int, store: str) -> bool:
+        rows = self.db.execute(
+            "SELECT 1 FROM sync_run_stores WHERE run_id = ? AND store = ? AND finished_at IS NOT NULL", (run_id, store)
+        )
+        return bool(rows)
+
+    def finish_store(self, run_id: int, store: str):
+        self.db.execute("INSERT OR REPLACE INTO sync_run_stores VALUES (?, ?, ?)", (run_id, store, now_iso()))
+
+    def mark(self, run_id: int, store: str, tn_product_id, ok: bool, error: str = None):
+        self.db.execute(
+            """
+            INSERT INTO sync_checkpoints VALUES (?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT (run_id, store, tn_product_id) DO UPDATE SET
+                status = excluded.status, attempts = attempts + 1, error = excluded.error, updated_at = excluded.updated_at
+            """,
+            (run_id, store, str(tn_product_id), "done" if ok else "failed", error, now_iso())
+        )
+
+    def skipped_products(self, run_id: int, store: str) -> set:
+        """Productos que no hay que volver a procesar: los terminados y los que agotaron los reintentos."""
+        rows = self.db.execute(
+            "SELECT tn_product_id FROM sync_checkpoints WHERE run_id = ? AND store = ? AND (status = 'done' OR attempts >= ?)",
+            (run_id, store, self.MAX_ATTEMPTS)
+        )
+        return {row["tn_product_id"] for row in rows}
+
+    def failed_products(self, run_id: int, store: str) -> dict:
+        """Productos fallidos que todavia tienen reintentos, con su ultimo error."""
+        rows = self.db.execute(
+            "SELECT tn_product_id, error FROM sync_checkpoints WHERE run_id = ? AND store = ? AND status = 'failed' AND attempts < ?",
+            (run_id, store, self.MAX_ATTEMPTS)
+        )
+        return {row["tn_product_id"]: row["error"] for row in rows}
+
+
+class OrderQueueStore():
+    """Cola persistente de los pedidos que llegan por webhook.
+
+    El endpoint solo guarda el pedido y responde; un worker lo resuelve despues en
+    descuentos de stock por variante, que tambien quedan guardados hasta que se mandan a
+    Tiendanube. Si el proceso se reinicia, lo pendiente se retoma desde aca.
+
+    Un pedido que no se pudo resolver entero queda pendiente con los line items que faltan
+    y se reintenta con backoff (RETRY_DELAY segundos, duplicandose); despues de MAX_ATTEMPTS
+    queda en 'failed' para revisarlo a mano.
+    """
+
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 60
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS order_queue (
+            queue_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id TEXT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            received_at TEXT,
+            updated_at TEXT,
+            next_attempt_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_order_queue_status ON order_queue (status);
+        CREATE TABLE IF NOT EXISTS stock_decrements (
+            decrement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            queue_id INTEGER NOT NULL,
+            store TEXT NOT NULL,
+            tn_product_id TEXT NOT NULL,
+            tn_variant_id TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_stock_decrements_status ON stock_decrements (status);
+        CREATE INDEX IF NOT EXISTS idx_stock_decrements_queue ON stock_decrements (queue_id);
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.db.executescript(self.SCHEMA)
+        # Bases creadas antes de que los pedidos se reintenten con backoff
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(order_queue)")}
+        if "next_attempt_at" not in columns:
+            self.db.execute("ALTER TABLE order_queue ADD COLUMN next_attempt_at TEXT")
+
+    def _next_attempt_at(self, attempts: int) -> str:
+        return (datetime.now(timezone.utc) + timedelta(seconds=self.RETRY_DELAY * 2 ** attempts)).isoformat()
+
+    def enqueue(self, order_id, payload: dict) -> int:
+        with self.db.lock:
+            return self.db.connection.execute(
+                "INSERT INTO order_queue (order_id, payload, received_at) VALUES (?, ?, ?)",
+                (str(order_id) if order_id is not None else None, json.dumps(payload), now_iso())
+            ).lastrowid
+
+    def pending_orders(self) -> list:
+        """Pedidos pendientes cuyo proximo intento ya llego."""
+        rows = self.db.execute(
+            """
+            SELECT queue_id, payload FROM order_queue
+            WHERE status = 'pending' AND (next_attempt_at IS NULL OR next_attempt_at <= ?)
+            ORDER BY queue_id
+            """,
+            (now_iso(),)
+        )
+        return [(row["queue_id"], json.loads(row["payload"])) for row in rows]
+
+    def resolve_order(self, queue_id: int, decrements: list, remaining: dict = None, error: str = None):
+        """Reemplaza el pedido por sus descuentos [(store, tn_product_id, tn_variant_id, quantity)].
+
+        Si quedaron line items sin resolver, `remaining` es el pedido con solo esos: queda
+        pendiente y se reintenta mas tarde, sin volver a generar los descuentos que ya salieron.
+        """
+        updated_at = now_iso()
+        with self.db.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO stock_decrements (queue_id, store, tn_product_id, tn_variant_id, quantity, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(queue_id, str(store), str(product_id), str(variant_id), quantity, updated_at)
+                 for store, product_id, variant_id, quantity in decrements]
+            )
+            if remaining is None:
+                connection.execute(
+                    "UPDATE order_queue SET status = 'resolved', error = ?, updated_at = ? WHERE queue_id = ?",
+                    (error, updated_at, queue_id)
+                )
+            else:
+                self._retry_later(connection, queue_id, error, updated_at, json.dumps(remaining))
+
+    def order_failed(self, queue_id: int, error: str):
+        with self.db.transaction() as connection:
+            self._retry_later(connection, queue_id, error, now_iso())
+
+    def _retry_later(self, connection, queue_id: int, error: str, updated_at: str, payload: str = None):
+        attempts = connection.execute("SELECT attempts FROM order_queue WHERE queue_id = ?", (queue_id,)).fetchone()["attempts"]
+        connection.execute(
+            """
+            UPDATE order_queue SET attempts = attempts + 1, error = ?, updated_at = ?, next_attempt_at = ?,
+                payload = COALESCE(?, payload),
+                status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+            WHERE queue_id = ?
+            """,
+            (error, updated_at, self._next_attempt_at(attempts), payload, self.MAX_ATTEMPTS, queue_id)
+        )
+
+    def pending_decrements(self) -> list:
+        rows = self.db.execute(
+            "SELECT decrement_id, store, tn_product_id, tn_variant_id, quantity FROM stock_decrements WHERE status = 'pending' ORDER BY decrement_id"
+        )
+        return [dict(row) for row in rows]
+
+    def decrements_done(self, decrement_ids: list):
+        with self.db.transaction() as connection:
+            connection.executemany(
+                "UPDATE stock_decrements SET status = 'done', updated_at = ? WHERE decrement_id = ?",
+                [(now_iso(), decrement_id) for decrement_id in decrement_ids]
+            )
+
+    def decrements_failed(self, decrement_ids: list, error: str):
+        with self.db.transaction() as connection:
+            connection.executemany(
+                """
+                UPDATE stock_decrements SET attempts = attempts + 1, error = ?, updated_at = ?,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+                WHERE decrement_id = ?
+                """,
+                [(error, now_iso(), self.MAX_ATTEMPTS, decrement_id) for decrement_id in decrement_ids]
+            )
+
+    def purge(self, older_than: datetime) -> tuple:
+        """Borra los descuentos ya mandados y los pedidos resueltos anteriores a `older_than`.
+
+        Lo que fallo (pedidos o descuentos en 'failed') se conserva para revisarlo.
+
+        Returns:
+            tuple: (pedidos borrados, descuentos borrados)
+        """
+        cutoff = older_than.astimezone(timezone.utc).isoformat()
+        with self.db.transaction() as connection:
+            decrements = connection.execute(
+                "DELETE FROM stock_decrements WHERE status = 'done' AND updated_at < ?", (cutoff,)
+            ).rowcount
+            orders = connection.execute(
+                """
+                DELETE FROM order_queue WHERE status = 'resolved' AND updated_at < ?
+                    AND queue_id NOT IN (SELECT queue_id FROM stock_decrements)
+                """,
+                (cutoff,)
+            ).rowcount
+        return orders, decrements
+
+
+class WebhookLedgerStore():
+    """Registro de los webhooks ya recibidos (por X-Shopify-Webhook-Id y por pedido), para no
+    procesar dos veces los reintentos de Shopify."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS webhook_ledger (
+            key TEXT PRIMARY KEY,
+            received_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_webhook_ledger_received ON webhook_ledger (received_at);
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.db.executescript(self.SCHEMA)
+
+    def claim(self, keys: list) -> bool:
+        """Registra las claves; devuelve False (sin registrar nada) si alguna ya estaba."""
+        with self.db.transaction() as connection:
+            placeholders = ", ".join("?" for _ in keys)
+            if connection.execute(f"SELECT 1 FROM webhook_ledger WHERE key IN ({placeholders})", keys).fetchone():
+                return False
+            received_at = now_iso()
+            connection.executemany("INSERT INTO webhook_ledger VALUES (?, ?)", [(key, received_at) for key in keys])
+            return True
+
+    def release(self, keys: list):
+        with self.db.transaction() as connection:
+            connection.executemany("DELETE FROM webhook_ledger WHERE key = ?", [(key,) for key in keys])
+
+    def purge(self, older_than: datetime) -> int:
+        with self.db.lock:
+            return self.db.connection.execute(
+                "DELETE FROM webhook_ledger WHERE received_at < ?", (older_than.astimezone(timezone.utc).isoformat(),)
+            ).rowcount
+
+
+class ImageManifestStore():
+    """Manifiesto de las imagenes de cada producto tal como quedaron en Shopify.
+
+    Por cada imagen de Tiendanube (su ID es el alt en Shopify) guarda el src y la posicion
+    que se subieron, el ID de la imagen en Shopify y las variantes asociadas, asi el diff de
+    imagenes se hace local. El manifiesto de un producto vale para un producto de Shopify y
+    se vuelve a verificar contra la API cuando `verified_at` es muy viejo.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS image_manifest_products (
+            tn_product_id TEXT PRIMARY KEY,
+            shopify_product_id INTEGER NOT NULL,
+            verified_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS image_manifest (
+            tn_image_id TEXT PRIMARY KEY,
+            tn_product_id TEXT NOT NULL,
+            shopify_image_id INTEGER NOT NULL,
+            src TEXT,
+            position INTEGER,
+            variant_ids TEXT,
+            updated_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_image_manifest_product ON image_manifest (tn_product_id);
+    """
+
+    def __init__(self, database: Database):
+        self.db = database
+        self.db.executescript(self.SCHEMA)
+
+    def get(self, tn_product_id, shopify_product_id: int, max_age: timedelta = None):
+        """Imagenes del producto (tn_image_id -> entrada), o None si no hay manifiesto valido:
+        nunca se armo, es de otro producto de Shopify o hace mas de `max_age` que no se verifica."""
+        rows = self.db.execute("SELECT * FROM image_manifest_products WHERE tn_product_id = ?", (str(tn_product_id),))
+        if not rows or rows[0]["shopify_product_id"] != int(shopify_product_id):
+            return None
+        if max_age and (not rows[0]["verified_at"] or datetime.fromisoformat(rows[0]["verified_at"]) < datetime.now(timezone.utc) - max_age):
+            return None
+        rows = self.db.execute("SELECT * FROM image_manifest WHERE tn_product_id = ?", (str(tn_product_id),))
+        return {
+            row["tn_image_id"]: {
+                "tn_image_id": row["tn_image_id"],
+                "shopify_image_id": row["shopify_image_id"],
+                "src": row["src"],
+                "position": row["position"],
+                "variant_ids": json.loads(row["variant_ids"] or "[]"),
+            }
+            for row in rows
+        }
+
+    def replace(self, tn_product_id, shopify_product_id: int, images: list):
+        """Reemplaza el manifiesto del producto (despues de leerlo de Shopify) y lo da por verificado."""
+        tn_product_id = str(tn_product_id)
+        updated_at = now_iso()
+        with self.db.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO image_manifest_products VALUES (?, ?, ?)", (tn_product_id, shopify_product_id, updated_at)
+            )
+            connection.execute("DELETE FROM image_manifest WHERE tn_product_id = ?", (tn_product_id,))
+            for image in images:
+                self._save_image(connection, tn_product_id, image, updated_at)
+
+    def save_image(self, tn_product_id, image: dict):
+        with self.db.transaction() as connection:
+            self._save_image(connection, str(tn_product_id), image, now_iso())
+
+    def _save_image(self, connection, tn_product_id, image, updated_at):
+        connection.execute(
+            "INSERT OR REPLACE INTO image_manifest VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (str(image["tn_image_id"]), tn_product_id, image["shopify_image_id"], image.get("src"), image.get("position"),
+             json.dumps(sorted(image.get("variant_ids") or [])), updated_at)
+        )
+
+    def delete_image(self, tn_image_id):
+        self.db.execute("DELETE FROM image_manifest WHERE tn_image_id = ?", (str(tn_image_id),))
+
+    def delete_product(self, tn_product_id):
+        with self.db.transaction() as connection:
+            connection.execute("DELETE FROM image_manifest_products WHERE tn_product_id = ?", (str(tn_product_id),))
+            connection.execute("DELETE FROM image_manifest WHERE tn_product_id = ?", (str(tn_product_id),))
@@ -1,6 +1,10 @@
 import re
+import json
+import hashlib
 import unicodedata
 
+from datetime import datetime, timezone
+
 from app.logger import logger
 
 RANGOS_PRECIO = [
@@ -219,6 +223,66 @@ def calculate_execution_time(start_time, end_time):
     return f"{hours}h {minutes}m {seconds:.2f}s"
 
 
+def calculate_fingerprint(payload):
+    """
+    Calcula una huella estable de un payload (el orden de las claves no importa).
+
+    Args:
+        payload: Diccionario/lista serializable a JSON
+
+    Returns:
+        str: Hash SHA-256 en hexadecimal
+    """
+    serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def parse_datetime(value):
+    """
+    Convierte una fecha de la API de Tiendanube (ej: 2025-01-01T12:00:00+0000) a datetime
+    con zona horaria. Devuelve None si no se puede interpretar.
+    """
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S.%f%z"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def calculate_watermark(current, processed):
+    """
+    Calcula la nueva marca de agua de un job incremental.
+
+    Args:
+        current: Marca de agua actual (datetime o None)
+        processed: Lista de tuplas (updated_at, ok) de lo que se proceso en la corrida
+
+    Returns:
+        datetime: El mayor updated_at procesado. Si algo fallo, el updated_at mas viejo de lo
+        que fallo, para que se vuelva a traer en la proxima corrida. Nunca retrocede.
+    """
+    failed = [updated_at for updated_at, ok in processed if not ok and updated_at]
+    done = [updated_at for updated_at, ok in processed if ok and updated_at]
+
+    if failed:
+        candidate = min(failed)
+    elif done:
+        candidate = max(done)
+    else:
+        return current
+
+    if current and candidate < current:
+        return current
+    return candidate
+
+
 def build_full_handle(category_gral, category, category_by_id):
     handles = []
     current = category
@@ -0,0 +1,187 @@
+import time
+import asyncio
+import threading
+
+from app.aio import run_async
+from app.logger import logger
+
+
+class OrderQueueWorker():
+    """Worker en segundo plano que descuenta en Tiendanube el stock de los pedidos encolados.
+
+    Cuando entra un pedido se espera `window` segundos para juntar los que lleguen en la
+    misma rafaga. Despues cada pedido se resuelve en descuentos por variante y los
+    descuentos pendientes de la misma (tienda, producto, variante) se suman en una sola
+    llamada a Tiendanube. Lo que falla queda en la cola y se reintenta en la proxima vuelta;
+    los line items que no se pudieron resolver se reintentan con el backoff de la cola.
+
+    Args:
+        queue: OrderQueueStore
+        resolve: Funcion line_item -> {"vendor", "quantity", "product_id", "variant_id"} o None
+        update_stock: Funcion (store, tn_product_id, tn_variant_id, cantidad) -> bool; si es
+            async, los descuentos de una tanda se mandan todos a la vez
+        window: Segundos que se juntan pedidos antes de mandar los descuentos
+        retry_interval: Segundos entre vueltas cuando quedan cosas pendientes
+    """
+
+    def __init__(self, queue, resolve, update_stock, window: float = 2.0, retry_interval: float = 30.0):
+        self.queue = queue
+        self.resolve = resolve
+        self.update_stock = update_stock
+        self.window = window
+        self.retry_interval = retry_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="order-queue", daemon=True)
+        self._thread.start()
+        # Lo que haya quedado de antes de un reinicio
+        self._wake.set()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def notify(self):
+        """Avisa que se encolo un pedido."""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.retry_interval)
+            if self._stop.is_set():
+                break
+            # Ventana para que la rafaga entre en la misma tanda
+            self._stop.wait(self.window)
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                logger.exception(f"Error draining the order queue: {e}")
+
+    def drain(self):
+        """Resuelve los pedidos pendientes y manda los descuentos agrupados por variante."""
+        for queue_id, order in self.queue.pending_orders():
+            try:
+                self._resolve_order(queue_id, order)
+            except Exception as e:
+                logger.exception(f"Error resolving queued order {queue_id}: {e}")
+                self.queue.order_failed(queue_id, str(e))
+
+        groups = {}
+        for decrement in self.queue.pending_decrements():
+            key = (decrement["store"], decrement["tn_product_id"], decrement["tn_variant_id"])
+            ids, quantity = groups.get(key, ([], 0))
+            ids.append(decrement["decrement_id"])
+            groups[key] = (ids, quantity + decrement["quantity"])
+
+        if groups:
+            logger.info(f"Sending {len(groups)} coalesced stock decrements to Tiendanube")
+        if asyncio.iscoroutinefunction(self.update_stock):
+            results = run_async(self._update_all(groups))
+        else:
+            results = [self._update(key, quantity) for key, (_, quantity) in groups.items()]
+        for (ids, _), ok in zip(groups.values(), results):
+            if ok:
+                self.queue.decrements_done(ids)
+            else:
+                self.queue.decrements_failed(ids, "Tiendanube stock update failed")
+        return len(groups)
+
+    def _update(self, key, quantity: int) -> bool:
+        store, product_id, variant_id = key
+        try:
+            return self.update_stock(store, product_id, variant_id, quantity)
+        except Exception as e:
+            logger.exception(f"Error decrementing stock of variant {variant_id} in store {store}: {e}")
+            return False
+
+    async def _update_all(self, groups: dict) -> list:
+        async def update(key, quantity):
+            store, product_id, variant_id = key
+            try:
+                return await self.update_stock(store, product_id, variant_id, quantity)
+            except Exception as e:
+                logger.exception(f"Error decrementing stock of variant {variant_id} in store {store}: {e}")
+                return False
+        return await asyncio.gather(*(update(key, quantity) for key, (_, quantity) in groups.items()))
+
+    def _resolve_order(self, queue_id: int, order: dict):
+        decrements = []
+        unresolved = []
+        for line_item in order.get("line_items", []):
+            pedido = self.resolve(line_item)
+            if not pedido:
+                unresolved.append(line_item)
+                continue
+            if pedido["quantity"]:
+                decrements.append((pedido["vendor"], pedido["product_id"], pedido["variant_id"], int(pedido["quantity"])))
+        if not unresolved:
+            self.queue.resolve_order(queue_id, decrements)
+            return
+        # Los que se resolvieron ya salen; el pedido queda pendiente solo con los que faltan
+        error = f"Unresolved line items: {', '.join(str(line_item.get('id')) for line_item in unresolved)}"
+        logger.warning(f"Queued order {queue_id}: {error}, retrying later")
+        self.queue.resolve_order(queue_id, decrements, {**order, "line_items": unresolved}, error)
+
+
+class IdempotencyLedger():
+    """Deduplica los webhooks de Shopify por X-Shopify-Webhook-Id y por ID de pedido.
+
+    Adelante hay un dict en memoria con vencimiento (`ttl` segundos) que contesta los
+    reintentos sin tocar la base; atras, el WebhookLedgerStore, que sobrevive a reinicios.
+    Un pedido con otro webhook id (por ejemplo otro topic) tambien cuenta como repetido.
+
+    Args:
+        store: WebhookLedgerStore
+        ttl: Segundos que una clave se recuerda en memoria
+    """
+
+    def __init__(self, store, ttl: float = 48 * 3600):
+        self.store = store
+        self.ttl = ttl
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def keys(webhook_id, order_id) -> list:
+        keys = []
+        if webhook_id:
+            keys.append(f"webhook:{webhook_id}")
+        if order_id is not None:
+            keys.append(f"order:{order_id}")
+        return keys
+
+    def claim(self, webhook_id, order_id) -> bool:
+        """Devuelve True si el webhook es nuevo (y lo registra), False si ya se recibio."""
+        keys = self.keys(webhook_id, order_id)
+        if not keys:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if any(self._seen.get(key, 0) > now for key in keys):
+                return False
+        claimed = self.store.claim(keys)
+        with self._lock:
+            self._prune(now)
+            for key in keys:
+                self._seen[key] = now + self.ttl
+        return claimed
+
+    def release(self, webhook_id, order_id):
+        """Olvida el webhook, para que un reintento se procese (si no se pudo encolar)."""
+        keys = self.keys(webhook_id, order_id)
+        with self._lock:
+            for key in keys:
+                self._seen.pop(key, None)
+        if keys:
+            self.store.release(keys)
+
+    def _prune(self, now: float):
+        expired = [key for key, expires in self._seen.items() if expires <= now]
+        for key in expired:
+            del self._seen[key]
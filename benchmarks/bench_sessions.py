@@ -0,0 +1,70 @@
+"""Benchmark: llamadas sueltas con requests.get contra la sesion con pool de conexiones.
+
+Levanta un servidor HTTP/1.1 local que simula el listado de productos de Tiendanube y
+mide la latencia por llamada en ambos casos.
+
+Uso:
+    python -m benchmarks.bench_sessions [cantidad_de_llamadas]
+"""
+import sys
+import json
+import time
+import threading
+import requests
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.Tiendanube import Tiendanube
+from app.session import create_session
+
+PAYLOAD = json.dumps([{"id": i, "name": {"es": f"Producto {i}"}} for i in range(20)]).encode()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.send_header("x-rate-limit-limit", "1000000")
+        self.send_header("x-rate-limit-remaining", "1000000")
+        self.end_headers()
+        self.wfile.write(PAYLOAD)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def medir(nombre, llamada, cantidad):
+    start = time.perf_counter()
+    for _ in range(cantidad):
+        llamada()
+    total = time.perf_counter() - start
+    print(f"{nombre:<35} {total:8.3f}s total  {total / cantidad * 1000:8.3f}ms por llamada")
+    return total
+
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/products"
+    headers = {"Authentication": "bearer benchmark"}
+
+    session = create_session()
+    tiendanube = Tiendanube(session=create_session())
+
+    print(f"{cantidad} llamadas contra {url}")
+    sin_pool = medir("requests.get (sin pool)", lambda: requests.get(url, headers=headers), cantidad)
+    con_pool = medir("Session con pool keep-alive", lambda: session.get(url, headers=headers), cantidad)
+    medir("Tiendanube.get_products", lambda: tiendanube.get_products(url, headers, {}), cantidad)
+    print(f"Mejora por llamada con pool: {(1 - con_pool / sin_pool) * 100:.1f}%")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
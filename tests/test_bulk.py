@@ -0,0 +1,252 @@
+import re
+import json
+import threading
+import tracemalloc
+
+from pathlib import Path
+from email import message_from_bytes
+from email.policy import default
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.bulk import (_bulk_lock, BulkMutation, CATALOG_QUERY, INVENTORY_LEVELS_QUERY, PRODUCT_SET_MUTATION, iter_catalog,
+                      iter_inventory_levels, product_set_input, product_from_result, run_bulk_query)
+from app.Shopify import Shopify, ShopifyRateLimiter
+
+
+class FakeShopifyHandler(BaseHTTPRequestHandler):
+    """Reemplazo local de la API GraphQL de Shopify, del staged upload y del resultado."""
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        base = f"http://127.0.0.1:{self.server.server_port}"
+
+        if self.path == "/upload":
+            message = message_from_bytes(b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body, policy=default)
+            fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True) for part in message.iter_parts()}
+            state["uploads"][fields["key"].decode()] = fields["file"].decode().splitlines()
+            self.send_response(204)
+            self.end_headers()
+            return
+
+        query = json.loads(body)
+        variables = query.get("variables", {})
+        if "stagedUploadsCreate" in query["query"]:
+            key = f"uploads/{len(state['uploads'])}.jsonl"
+            self._send({"data": {"stagedUploadsCreate": {"stagedTargets": [{
+                "url": f"{base}/upload",
+                "resourceUrl": None,
+                "parameters": [{"name": "key", "value": key}]
+            }], "userErrors": []}}})
+        elif "bulkOperationRunMutation" in query["query"]:
+            operation_id = f"gid://shopify/BulkOperation/{len(state['operations']) + 1}"
+            state["operations"][operation_id] = {"lines": state["uploads"][variables["stagedUploadPath"]], "polls": 0}
+            self._send({"data": {"bulkOperationRunMutation": {"bulkOperation": {"id": operation_id, "status": "CREATED"}, "userErrors": []}}})
+        else:
+            operation = state["operations"][variables["id"]]
+            operation["polls"] += 1
+            done = operation["polls"] > 1
+            self._send({"data": {"node": {
+                "id": variables["id"],
+                "status": "COMPLETED" if done else "RUNNING",
+                "errorCode": None,
+                "objectCount": len(operation["lines"]),
+                "url": f"{base}/results/{variables['id'].rsplit('/', 1)[1]}" if done else None,
+                "partialDataUrl": None
+            }}})
+
+    def do_GET(self):
+        operation = self.server.state["operations"][f"gid://shopify/BulkOperation/{self.path.rsplit('/', 1)[1]}"]
+        results = []
+        for line_number, line in enumerate(operation["lines"]):
+            product = json.loads(line)["input"]
+            if product["handle"] == "666":
+                result = {"data": {"productSet": {"product": None, "userErrors": [{"field": ["input"], "message": "Invalid"}]}}}
+            else:
+                product_id = int(product["handle"]) * 10
+                result = {"data": {"productSet": {"product": {
+                    "id": f"gid://shopify/Product/{product_id}",
+                    "legacyResourceId": str(product_id),
+                    "handle": product["handle"],
+                    "status": "ACTIVE",
+                    "variants": {"nodes": [{
+                        "id": f"gid://shopify/ProductVariant/{product_id + 1}",
+                        "legacyResourceId": str(product_id + 1),
+                        "sku": variant["inventoryItem"]["sku"],
+                        "inventoryItem": {"legacyResourceId": str(product_id + 2)}
+                    } for variant in product["variants"]]}
+                }, "userErrors": []}}}
+            # Shopify no garantiza el orden de las lineas del resultado
+            results.insert(0, json.dumps({**result, "__lineNumber": line_number}))
+        self._send("\n".join(results).encode(), "application/jsonl")
+
+
+def start_fake_shopify():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeShopifyHandler)
+    server.state = {"uploads": {}, "operations": {}}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    shopify = Shopify(rate_limiter=ShopifyRateLimiter())
+    shopify.SHOPIFY_API_URL = f"http://127.0.0.1:{server.server_port}/admin/api/test"
+    return server, shopify
+
+
+def prepared(product_id):
+    return {
+        "product": {"id": product_id, "name": {"es": f"Producto {product_id}"}},
+        "description": "Hola",
+        "tags": ["remeras", ""],
+        "options": [{"name": "Talle"}],
+        "variants": [
+            {"sku": product_id + 1, "price": 1000.0, "compare_at_price": None, "barcode": None, "position": 1,
+             "inventory_policy": "deny", "option1": "M", "weight": "0.2"},
+            {"sku": product_id + 2, "price": 1000.0, "compare_at_price": None, "barcode": None, "position": 2,
+             "inventory_policy": "deny", "option1": "L", "weight": None},
+        ],
+    }
+
+
+def test_product_set_input_usa_los_ids_existentes():
+    shopify_product = {"id": 10, "variants": [{"sku": "2", "admin_graphql_api_id": "gid://shopify/ProductVariant/5"}]}
+    product_input = product_set_input(prepared(1), "111111", "indumentaria", shopify_product)
+
+    assert product_input["id"] == "gid://shopify/Product/10"
+    assert product_input["handle"] == "1"
+    assert product_input["tags"] == ["remeras"]
+    assert product_input["productOptions"] == [{"name": "Talle", "position": 1, "values": [{"name": "M"}, {"name": "L"}]}]
+    assert product_input["variants"][0]["id"] == "gid://shopify/ProductVariant/5"
+    assert "id" not in product_input["variants"][1]
+    assert product_input["variants"][0]["price"] == "1000.0"
+    assert product_input["variants"][0]["inventoryItem"]["measurement"]["weight"]["value"] == 0.2
+
+
+def test_bulk_mutation_contra_un_shopify_local():
+    """Sube el JSONL, espera la operacion y devuelve cada resultado con su producto."""
+    server, shopify = start_fake_shopify()
+    try:
+        mutation = BulkMutation(shopify, PRODUCT_SET_MUTATION, poll_interval=0.01)
+        # Archivos chicos para que se parta en varias operaciones
+        mutation.MAX_FILE_BYTES = 1500
+        for product_id in (100, 200, 666, 300):
+            mutation.add(str(product_id), {"input": product_set_input(prepared(product_id), "111111", "indumentaria")})
+        assert len(mutation.files) > 1
+
+        results = {key: product_from_result(result) for key, result in mutation.run()}
+    finally:
+        server.shutdown()
+
+    assert set(results) == {"100", "200", "666", "300"}
+    product, error = results["200"]
+    assert error is None
+    assert product["id"] == 2000
+    assert product["handle"] == "200"
+    assert [variant["sku"] for variant in product["variants"]] == ["201", "202"]
+    assert product["variants"][0]["inventory_item_id"] == 2002
+    assert results["666"][0] is None
+    assert "Invalid" in results["666"][1]
+    assert mutation.files == []
+
+
+class SlowBulkShopify():
+    """La operacion sigue RUNNING cuando se vence la espera y solo termina si se cancela."""
+
+    def __init__(self):
+        self.canceled = []
+        self.locked_while_waiting = []
+
+    def run_bulk_query(self, query):
+        return "gid://shopify/BulkOperation/1"
+
+    def wait_bulk_operation(self, operation_id, poll_interval=5.0, timeout=4 * 3600):
+        self.locked_while_waiting.append(_bulk_lock.locked())
+        status = "CANCELED" if operation_id in self.canceled else "RUNNING"
+        return {"id": operation_id, "status": status, "url": None, "partialDataUrl": None}
+
+    def cancel_bulk_operation(self, operation_id):
+        self.canceled.append(operation_id)
+        return True
+
+
+def test_cancela_la_operacion_si_se_vence_la_espera():
+    """El lock no se suelta con la operacion corriendo: se cancela y se espera que termine."""
+    shopify = SlowBulkShopify()
+
+    assert run_bulk_query(shopify, "{ products { edges { node { id } } } }") is None
+
+    assert shopify.canceled == ["gid://shopify/BulkOperation/1"]
+    assert shopify.locked_while_waiting == [True, True]
+    assert not _bulk_lock.locked()
+
+
+def connection_depth(query: str) -> int:
+    """Cuantas conexiones (edges) anidadas tiene la query."""
+    depth = deepest = 0
+    stack = []
+    for name, brace in re.findall(r"(\w+)?[^{}\w]*([{}])", query):
+        if brace == "{":
+            stack.append(name == "edges")
+            depth += stack[-1]
+            deepest = max(deepest, depth)
+        else:
+            depth -= stack.pop()
+    return deepest
+
+
+def test_las_bulk_queries_respetan_el_limite_de_conexiones():
+    """Shopify rechaza las bulk queries con mas de dos niveles de conexiones."""
+    assert connection_depth(CATALOG_QUERY % "111111") == 2
+    assert connection_depth(INVENTORY_LEVELS_QUERY) == 2
+    assert connection_depth("{ a { edges { node { b { edges { node { c { edges { node { id } } } } } } } } } }") == 3
+
+
+def test_export_del_catalogo_desde_el_fixture():
+    with open(Path(__file__).parent / "fixtures" / "catalog_export.jsonl") as file:
+        products = list(iter_catalog(json.loads(line) for line in file))
+
+    assert [(product["id"], product["handle"]) for product in products] == [(10, "123"), (20, "456")]
+    variant = products[0]["variants"][0]
+    assert variant["sku"] == "55"
+    assert variant["inventory_item_id"] == 12
+    assert variant["admin_graphql_api_id"] == "gid://shopify/ProductVariant/11"
+    assert [variant["sku"] for variant in products[0]["variants"]] == ["55", "56"]
+    # La ultima variante apunta a un producto que no vino antes: se descarta
+    assert [variant["sku"] for variant in products[1]["variants"]] == ["77"]
+
+
+def test_export_de_stock_desde_el_fixture():
+    with open(Path(__file__).parent / "fixtures" / "inventory_levels_export.jsonl") as file:
+        levels = list(iter_inventory_levels(json.loads(line) for line in file))
+
+    assert levels == [("12", "999", 3), ("12", "104501772590", 0), ("14", "999", 7)]
+
+
+def test_export_grande_con_memoria_constante():
+    """100k variantes se recorren sin juntar el export en memoria."""
+    def lines():
+        for product_id in range(20000):
+            product_gid = f"gid://shopify/Product/{product_id}"
+            yield {"id": product_gid, "handle": str(product_id)}
+            for number in range(5):
+                item_gid = f"gid://shopify/InventoryItem/{product_id * 10 + number}"
+                yield {"id": f"gid://shopify/ProductVariant/{product_id * 10 + number}", "sku": str(number),
+                       "inventoryItem": {"id": item_gid}, "__parentId": product_gid}
+
+    tracemalloc.start()
+    variants = 0
+    for product in iter_catalog(lines()):
+        variants += len(product["variants"])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert variants == 100000
+    assert peak < 1024 * 1024
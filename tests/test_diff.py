@@ -0,0 +1,100 @@
+from app.diff import diff_images, diff_product, diff_variants, options_changed
+
+ACTUAL = {
+    "id": 10,
+    "title": "Remera",
+    "body_html": "Remera de algodon",
+    "vendor": "111111",
+    "product_type": "indumentaria",
+    "tags": "hombre, indumentaria, remera",
+    "status": "active",
+    "published_at": "2025-01-01T00:00:00-03:00",
+    "options": [{"name": "Talle"}],
+    "variants": [
+        {"id": 1, "sku": "55", "price": "1350.00", "compare_at_price": None, "option1": "M",
+         "option2": None, "option3": None, "barcode": None, "weight": 0.1, "position": 1},
+        {"id": 2, "sku": "56", "price": "1350.00", "compare_at_price": None, "option1": "L",
+         "option2": None, "option3": None, "barcode": None, "weight": 0.1, "position": 2},
+    ],
+}
+
+
+def variante(sku, option1, price, position):
+    return {"sku": int(sku), "price": price, "compare_at_price": 0, "option1": option1, "option2": None,
+            "option3": None, "barcode": None, "weight": "0.1", "position": position, "inventory_quantity": 5}
+
+
+def test_sin_cambios():
+    deseado = {
+        "title": "Remera",
+        "body_html": "Remera de algodon\n",
+        "tags": ["indumentaria", "hombre", "remera", None],
+        "published": True,
+    }
+    assert diff_product(deseado, ACTUAL) == {}
+    variantes = [variante("55", "M", 1350.0, 1), variante("56", "L", 1350, 2)]
+    assert diff_variants(variantes, ACTUAL["variants"]) == []
+
+
+def test_cambio_de_precio_en_un_talle():
+    """Un cambio de precio en un solo talle es una sola actualizacion chica."""
+    variantes = [variante("55", "M", 1350.0, 1), variante("56", "L", 1400.0, 2)]
+    assert diff_variants(variantes, ACTUAL["variants"]) == [{"id": 2, "price": 1400.0}]
+
+
+def test_el_peso_se_compara_con_su_unidad():
+    """El mismo numero en gramos es otro peso; el mismo peso en otra unidad no es un cambio."""
+    en_gramos = [{**actual, "weight_unit": "g"} for actual in ACTUAL["variants"]]
+    variantes = [{**variante("55", "M", 1350.0, 1), "weight_unit": "kg"}, {**variante("56", "L", 1350.0, 2), "weight_unit": "kg"}]
+    assert diff_variants(variantes, en_gramos) == [
+        {"id": 1, "weight": "0.1", "weight_unit": "kg"},
+        {"id": 2, "weight": "0.1", "weight_unit": "kg"},
+    ]
+
+    en_gramos = [{**actual, "weight": 100, "weight_unit": "g"} for actual in ACTUAL["variants"]]
+    assert diff_variants(variantes, en_gramos) == []
+
+
+def test_cambio_de_campos_del_producto():
+    deseado = {"title": "Remera lisa", "tags": ["hombre", "remera"], "published": False}
+    assert diff_product(deseado, ACTUAL) == deseado
+
+
+def test_variantes_nuevas_o_borradas():
+    """Si cambia el conjunto de variantes no alcanza con el diff campo por campo."""
+    variantes = [variante("55", "M", 1350.0, 1)]
+    assert diff_variants(variantes, ACTUAL["variants"]) is None
+
+
+def test_opciones():
+    assert not options_changed([{"name": "Talle"}], ACTUAL["options"])
+    assert options_changed([{"name": "Color"}], ACTUAL["options"])
+
+
+def imagen(tn_image_id, src, position, variant_ids=(), shopify_image_id=None):
+    image = {"tn_image_id": tn_image_id, "src": src, "position": position, "variant_ids": list(variant_ids)}
+    if shopify_image_id:
+        image["shopify_image_id"] = shopify_image_id
+    return image
+
+
+def test_diff_de_imagenes():
+    manifiesto = {
+        "1": imagen("1", "http://img/1", 1, [7], shopify_image_id=100),
+        "2": imagen("2", "http://img/2", 2, shopify_image_id=200),
+        "3": imagen("3", "http://img/3", 3, shopify_image_id=300),
+        "4": imagen("4", None, 4, shopify_image_id=400),
+    }
+    deseadas = [
+        imagen("1", "http://img/1", 1, [8]),
+        imagen("2", "http://img/2-nueva", 2),
+        imagen("4", "http://img/4", 4),
+        imagen("5", "http://img/5", 5),
+    ]
+
+    subir, actualizar, borrar = diff_images(deseadas, manifiesto)
+
+    assert [image["tn_image_id"] for image in subir] == ["2", "5"]
+    assert [(actual["shopify_image_id"], image["variant_ids"]) for actual, image in actualizar] == [(100, [8])]
+    # La 2 cambio de archivo y la 3 ya no esta; la 4 tiene src desconocido pero no cambio
+    assert sorted(image["shopify_image_id"] for image in borrar) == [200, 300]
@@ -0,0 +1,52 @@
+from app.handle_index import HandleIndex
+
+
+class FakeShopify():
+    def __init__(self, products):
+        self.products = products
+        self.calls = []
+
+    def get_products_by_vendor(self, vendor, params=None):
+        self.calls.append((vendor, params))
+        return self.products
+
+
+PRODUCTO = {
+    "id": 10,
+    "handle": "123",
+    "options": [{"name": "Talle"}],
+    "variants": [
+        {"id": 1, "sku": "55", "inventory_item_id": 100, "inventory_quantity": 3, "extra": "x"},
+    ],
+    "images": [{"id": 9, "alt": "777"}],
+}
+
+
+def test_build_descarga_el_vendor_una_sola_vez():
+    shopify = FakeShopify([PRODUCTO])
+    index = HandleIndex.build(shopify, "111111")
+
+    assert len(shopify.calls) == 1
+    vendor, params = shopify.calls[0]
+    assert vendor == "111111"
+    assert "variants" in params["fields"]
+    assert 123 in index
+    assert index.handles() == {"123"}
+
+
+def test_guarda_las_variantes():
+    index = HandleIndex([PRODUCTO])
+    entry = index.get(123)
+
+    assert entry["id"] == 10
+    assert entry["options"] == [{"name": "Talle"}]
+    assert entry["variants"][0]["sku"] == "55"
+    assert entry["variants"][0]["inventory_item_id"] == 100
+    assert "extra" not in entry["variants"][0]
+    assert "images" not in entry
+
+
+def test_producto_inexistente():
+    index = HandleIndex([PRODUCTO])
+    assert index.get("999") is None
+    assert "999" not in index
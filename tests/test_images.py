@@ -0,0 +1,62 @@
+import threading
+
+from app.images import ImageUploadPool
+
+
+class FakeShopify():
+    """Falla con 502 la primera vez que se sube cada imagen, y con 422 la imagen "mala"."""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def upload_image_to_shopify(self, image, product_id, variant_ids):
+        with self.lock:
+            self.calls.append(image["alt"])
+            first = self.calls.count(image["alt"]) == 1
+        if image["alt"] == "mala":
+            return {"status": 422, "response": {"errors": "Invalid"}, "image_alt": image["alt"]}
+        if first:
+            return {"status": 502, "response": {}, "image_alt": image["alt"]}
+        return {"status": 200, "response": {"image": {"id": 1, "alt": image["alt"]}}, "image_alt": image["alt"]}
+
+
+def test_reintenta_y_avisa_cuando_termina_cada_producto():
+    shopify = FakeShopify()
+    pool = ImageUploadPool(shopify, workers=3, queue_size=2, retry_delay=0)
+    completed = {}
+    uploaded = []
+
+    batch = pool.batch()
+    batch.submit(10, [({"alt": "1"}, []), ({"alt": "2"}, [5])], on_image=lambda r: uploaded.append(r["image_alt"]),
+                 on_complete=lambda ok: completed.update({10: ok}))
+    batch.submit(20, [({"alt": "mala"}, [])], on_complete=lambda ok: completed.update({20: ok}))
+    batch.submit(30, [], on_complete=lambda ok: completed.update({30: ok}))
+    batch.wait()
+
+    assert completed == {10: True, 20: False, 30: True}
+    assert sorted(uploaded) == ["1", "2"]
+    # El 422 no se reintenta
+    assert shopify.calls.count("mala") == 1
+    assert pool.stats == {"uploaded": 2, "failed": 1, "retried": 2}
+
+
+def test_no_reintenta_los_429():
+    class LimitedShopify():
+        calls = 0
+
+        def upload_image_to_shopify(self, image, product_id, variant_ids):
+            LimitedShopify.calls += 1
+            return {"status": 429, "response": {}, "image_alt": image["alt"]}
+
+    pool = ImageUploadPool(LimitedShopify(), workers=1, retry_delay=0)
+    completed = {}
+
+    batch = pool.batch()
+    batch.submit(10, [({"alt": "1"}, [])], on_complete=lambda ok: completed.update({10: ok}))
+    batch.wait()
+
+    # Shopify._request ya agoto sus reintentos: el pool no los multiplica
+    assert completed == {10: False}
+    assert LimitedShopify.calls == 1
+    assert pool.stats == {"uploaded": 0, "failed": 1, "retried": 0}
@@ -0,0 +1,69 @@
+from app.inventory import InventoryWriter
+from app.storage import Database, InventoryStore
+
+
+class FakeShopify():
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def set_inventory_quantities(self, quantities):
+        self.calls.append(quantities)
+        return ["Not stocked" if q["inventory_item_id"] in self.failing else None for q in quantities]
+
+
+def test_manda_los_cambios_en_lotes():
+    shopify = FakeShopify()
+    inventory = InventoryWriter(shopify, chunk_size=3)
+    for item_id in range(7):
+        inventory.set(item_id, 99, item_id)
+
+    # Dos lotes se mandan solos al llenarse, el resto con flush
+    assert len(shopify.calls) == 2
+    assert inventory.flush() == {}
+    assert [len(call) for call in shopify.calls] == [3, 3, 1]
+
+
+def test_el_mismo_item_queda_con_el_ultimo_valor():
+    shopify = FakeShopify()
+    inventory = InventoryWriter(shopify)
+    inventory.set(1, 99, 5)
+    inventory.set(1, 99, 3)
+    inventory.set(1, 100, 0)
+    inventory.flush()
+
+    assert shopify.calls == [[
+        {"inventory_item_id": "1", "location_id": "99", "quantity": 3},
+        {"inventory_item_id": "1", "location_id": "100", "quantity": 0},
+    ]]
+
+
+def test_informa_los_errores_por_item():
+    shopify = FakeShopify(failing={"2"})
+    inventory = InventoryWriter(shopify)
+    inventory.set(1, 99, 5)
+    inventory.set(2, 99, 5)
+
+    assert inventory.flush() == {("2", "99"): "Not stocked"}
+    assert inventory.errors == {("2", "99"): "Not stocked"}
+    assert inventory.flush() == {}
+
+
+def test_el_espejo_saltea_el_stock_que_no_cambio(tmp_path):
+    shopify = FakeShopify(failing={"3"})
+    mirror = InventoryStore(Database(str(tmp_path / "sync.db")))
+    inventory = InventoryWriter(shopify, mirror=mirror)
+    for item_id in (1, 2, 3):
+        inventory.set(item_id, 99, 5)
+    inventory.flush()
+
+    # Solo quedan en el espejo los que se escribieron bien
+    assert [mirror.get(item_id, 99) for item_id in (1, 2, 3)] == [5, 5, None]
+
+    shopify.calls.clear()
+    inventory.set(1, 99, 5)
+    inventory.set(2, 99, 4)
+    inventory.set(3, 99, 5)
+    inventory.flush()
+    assert [q["inventory_item_id"] for q in shopify.calls[0]] == ["2", "3"]
+    assert inventory.skipped == 1
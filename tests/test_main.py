@@ -0,0 +1,136 @@
+import os
+import json
+import tempfile
+
+from datetime import datetime, timezone
+
+# app.main lee las tiendas del entorno y abre la base al importarse
+os.environ.setdefault("TIENDAS", json.dumps({"111111": {
+    "name": "T1", "url": "http://tn", "headers": {"Authentication": "bearer t"}, "category": "indumentaria", "deposit": "999"
+}}))
+os.environ["SYNC_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "sync.db")
+
+import app.main as main  # noqa: E402
+
+from app.storage import CheckpointStore, Database, InventoryStore, MappingStore, WatermarkStore  # noqa: E402
+from app.Tiendanube import ProductListing  # noqa: E402
+
+
+class FakeTiendanube():
+    """Listado de productos actualizados donde la pagina `fail_page` falla siempre."""
+
+    page_workers = 1
+
+    def __init__(self, fail_page=None):
+        self.fail_page = fail_page
+
+    def get_products_page(self, url, headers, params):
+        if params.get("fields") == "id":
+            return ([{"id": 1}, {"id": 2}] if params["page"] == 1 else []), None
+        if params["page"] == self.fail_page:
+            return None, None
+        if params["page"] > 2:
+            return [], None
+        product_id = params["page"]
+        return [{"id": product_id, "updated_at": f"2026-01-0{product_id}T00:00:00+00:00"}], None
+
+    def iter_products(self, url, headers, params=None, limit=None, oldest_first=False):
+        return ProductListing(self, url, headers, params, per_page=1, limit=limit, oldest_first=oldest_first, workers=1)
+
+
+def sync_with(monkeypatch, tmp_path, tiendanube):
+    watermarks = WatermarkStore(Database(str(tmp_path / "sync.db")))
+    watermarks.save("111111", "products", datetime(2025, 12, 1, tzinfo=timezone.utc))
+    monkeypatch.setattr(main, "tiendanube", tiendanube)
+    monkeypatch.setattr(main, "watermark_store", watermarks)
+    monkeypatch.setattr(main, "export_shopify_catalog", lambda tienda: iter([]))
+
+    def process_products(tienda, products, handle_index, activate=False, on_result=None):
+        for product in products:
+            on_result(product, True, None)
+
+    monkeypatch.setattr(main, "process_products", process_products)
+    main.sync_store_products("111111")
+    return watermarks.get("111111", "products")
+
+
+def test_la_marca_de_agua_avanza_con_el_listado_completo(monkeypatch, tmp_path):
+    assert sync_with(monkeypatch, tmp_path, FakeTiendanube()) == datetime(2026, 1, 2, tzinfo=timezone.utc)
+
+
+def test_la_marca_de_agua_no_avanza_si_falla_una_pagina(monkeypatch, tmp_path):
+    assert sync_with(monkeypatch, tmp_path, FakeTiendanube(fail_page=2)) == datetime(2025, 12, 1, tzinfo=timezone.utc)
+
+
+def test_el_webhook_devuelve_500_si_no_se_puede_encolar(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    def enqueue(order_id, order):
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(main.order_queue_store, "enqueue", enqueue)
+    client = TestClient(main.app)
+    body = {"id": 5001, "line_items": [{"id": 1, "sku": "10", "quantity": 1}]}
+
+    response = client.post("/sync-tiendanube", json=body, headers={"X-Shopify-Webhook-Id": "w-5001"})
+    assert response.status_code == 500
+
+    # El reintento de Shopify no se descarta como repetido
+    assert main.webhook_ledger.claim("w-5001", 5001)
+
+
+def test_el_sync_completo_no_pisa_una_marca_mas_nueva(monkeypatch, tmp_path):
+    database = Database(str(tmp_path / "sync.db"))
+    checkpoints = CheckpointStore(database)
+    watermarks = WatermarkStore(database)
+    monkeypatch.setattr(main, "checkpoint_store", checkpoints)
+    monkeypatch.setattr(main, "watermark_store", watermarks)
+    run_id = checkpoints.start_or_resume("products")
+
+    # Un incremental termino mientras corria el sync completo
+    watermarks.save("111111", "products", datetime(2026, 1, 2, tzinfo=timezone.utc))
+    main.finish_store_products("111111", run_id, datetime(2026, 1, 1, tzinfo=timezone.utc), True)
+
+    assert checkpoints.store_finished(run_id, "111111")
+    assert watermarks.get("111111", "products") == datetime(2026, 1, 2, tzinfo=timezone.utc)
+    assert watermarks.get("111111", "stock") == datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeInventoryShopify():
+    """Stock por REST; el item 16 no se puede leer."""
+
+    DEFAULT_DEPOSIT = "104501772590"
+
+    def __init__(self, levels):
+        self.levels = levels
+        self.writes = []
+
+    def get_inventory_levels(self, inventory_item_ids, location_id):
+        return {item_id: self.levels[location_id][item_id] for item_id in inventory_item_ids if item_id != "16"}
+
+    def set_inventory_quantities(self, quantities):
+        self.writes.extend(quantities)
+        return [None for _ in quantities]
+
+
+def test_la_auditoria_lee_por_rest_si_falla_el_export(monkeypatch, tmp_path):
+    database = Database(str(tmp_path / "sync.db"))
+    mirror = InventoryStore(database)
+    mirror.save_many([("12", "104501772590", 0), ("14", "999", 7), ("16", "999", 5)])
+    mappings = MappingStore(database)
+    mappings.save_product("111111", {"id": 10, "handle": "123", "variants": [
+        {"id": 11, "sku": "55", "inventory_item_id": 12}, {"id": 13, "sku": "56", "inventory_item_id": 14},
+    ]}, "999")
+    shopify = FakeInventoryShopify({"104501772590": {"12": 4}, "999": {"14": 7}})
+    monkeypatch.setattr(main, "shopify", shopify)
+    monkeypatch.setattr(main, "inventory_store", mirror)
+    monkeypatch.setattr(main, "mapping_store", mappings)
+    monkeypatch.setattr(main, "export_inventory_levels", lambda: None)
+
+    main.verify_inventory()
+
+    # Alguien puso 4 en el deposito por defecto: se vuelve a 0
+    assert shopify.writes == [{"inventory_item_id": "12", "location_id": "104501772590", "quantity": 0}]
+    assert mirror.get(12, "104501772590") == 0
+    # Lo que no se pudo leer no cuenta como diferencia
+    assert mirror.get(16, "999") == 5
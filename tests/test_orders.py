@@ -0,0 +1,40 @@
+from app.orders import resolve_line_item
+from app.storage import Database, MappingStore
+
+STORES = {"111111": {"deposit": "999"}}
+
+
+class FakeShopify():
+    def __init__(self):
+        self.calls = []
+
+    def get_product(self, product_id, params={}):
+        self.calls.append(product_id)
+        return {"product": {"id": 10, "handle": "123", "variants": [
+            {"id": 1, "sku": "55", "inventory_item_id": 100},
+            {"id": 2, "sku": "56", "inventory_item_id": 101},
+        ]}}
+
+
+def test_resuelve_desde_el_mapeo_sin_llamar_a_shopify(tmp_path):
+    store = MappingStore(Database(str(tmp_path / "sync.db")))
+    store.save_product("111111", {"id": 10, "handle": "123", "variants": [{"id": 1, "sku": "55"}]})
+    shopify = FakeShopify()
+
+    # La variante de Shopify no esta en el mapeo, pero el SKU si
+    pedido = resolve_line_item({"product_id": 10, "variant_id": 7, "sku": "55", "vendor": "111111", "quantity": 2},
+                               store, shopify, STORES)
+
+    assert pedido == {"vendor": "111111", "quantity": 2, "product_id": "123", "variant_id": "55"}
+    assert shopify.calls == []
+
+
+def test_si_falta_en_el_mapeo_pide_el_producto_una_vez(tmp_path):
+    store = MappingStore(Database(str(tmp_path / "sync.db")))
+    shopify = FakeShopify()
+    line_item = {"product_id": 10, "variant_id": 2, "sku": "56", "vendor": "111111", "quantity": 1}
+
+    assert resolve_line_item(line_item, store, shopify, STORES)["product_id"] == "123"
+    assert resolve_line_item(line_item, store, shopify, STORES)["product_id"] == "123"
+    assert shopify.calls == [10]
+    assert store.get_variant("55")["location_id"] == "999"
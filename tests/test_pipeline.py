@@ -0,0 +1,57 @@
+import threading
+
+from app.pipeline import Pipeline, Stage
+
+
+def test_pasa_los_items_por_todas_las_etapas_en_orden():
+    results = []
+    pipeline = Pipeline([
+        Stage("sumar", lambda x: x + 1),
+        Stage("duplicar", lambda x: x * 2),
+    ], on_result=results.append)
+
+    pipeline.run(range(5))
+
+    assert results == [2, 4, 6, 8, 10]
+
+
+def test_un_error_no_corta_el_resto():
+    results = []
+    errors = []
+
+    def dividir(x):
+        return 10 // x
+
+    pipeline = Pipeline([Stage("dividir", dividir, workers=3)], on_result=results.append,
+                        on_error=lambda item, e: errors.append(item))
+    pipeline.run([1, 0, 2, 5])
+
+    assert sorted(results) == [2, 5, 10]
+    assert errors == [0]
+
+
+def test_la_cola_acotada_frena_al_productor():
+    """Si la ultima etapa esta trabada, el productor no lee mas alla de lo que entra en las colas."""
+    liberar = threading.Event()
+    leidos = []
+
+    def source():
+        for i in range(100):
+            leidos.append(i)
+            yield i
+
+    def lenta(x):
+        liberar.wait()
+        return x
+
+    pipeline = Pipeline([Stage("rapida", lambda x: x), Stage("lenta", lenta)], queue_size=2)
+    thread = threading.Thread(target=pipeline.run, args=(source(),))
+    thread.start()
+    thread.join(0.3)
+
+    # 2 por cola + 1 en cada worker + 1 esperando para entrar en la primera cola
+    assert len(leidos) <= 7
+    liberar.set()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert len(leidos) == 100
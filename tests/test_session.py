@@ -0,0 +1,13 @@
+from app.session import create_session
+
+
+def test_sesion_con_pool():
+    """La sesion reutiliza conexiones y pide respuestas comprimidas."""
+    session = create_session(pool_size=8, pool_hosts=3)
+    adapter = session.get_adapter("https://api.tiendanube.com")
+
+    assert adapter._pool_maxsize == 8
+    assert adapter._pool_connections == 3
+    assert adapter._pool_block is True
+    assert "gzip" in session.headers["Accept-Encoding"]
+    assert session.headers["Connection"] == "keep-alive"
@@ -0,0 +1,242 @@
+import httpx
+
+from pytest import approx
+
+from app.aio import run_async
+from app.Shopify import AsyncShopify, Shopify, ShopifyRateLimiter
+
+
+class FakeResponse():
+    def __init__(self, headers, status_code=200, payload=None):
+        self.headers = headers
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession():
+    """Responde /products.json con los productos cuyos handles se pidieron; en el stock, el
+    item 2 no esta conectado al deposito y conectarlo falla si `activate_fails`."""
+
+    def __init__(self, activate_fails=False):
+        self.activate_fails = activate_fails
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append(kwargs["params"])
+        handles = kwargs["params"]["handle"].split(",")
+        products = [
+            {"id": int(handle) * 10, "handle": handle, "variants": [{"id": int(handle) * 100, "sku": f"{handle}-1"}]}
+            for handle in handles if handle != "404"
+        ]
+        return FakeResponse({}, payload={"products": products})
+
+    def post(self, url, **kwargs):
+        self.calls.append(kwargs["json"])
+        if "inventoryActivate" in kwargs["json"]["query"]:
+            if self.activate_fails:
+                return FakeResponse({}, payload={"data": {"inventoryActivate": {"inventoryLevel": None, "userErrors": [
+                    {"field": ["locationId"], "message": "Location not found"}
+                ]}}})
+            return FakeResponse({}, payload={"data": {"inventoryActivate": {"inventoryLevel": {"id": "gid://shopify/InventoryLevel/1"}, "userErrors": []}}})
+        return FakeResponse({}, payload={"data": {"inventorySetQuantities": {"userErrors": [
+            {"field": ["input", "quantities", "1", "locationId"], "message": "The specified inventory item is not stocked at the location.",
+             "code": "ITEM_NOT_STOCKED_AT_LOCATION"}
+        ]}}})
+
+
+class ThrottledSession():
+    """Devuelve 429 las primeras `throttled` veces y despues 200."""
+
+    def __init__(self, throttled, retry_after="1.5"):
+        self.throttled = throttled
+        self.retry_after = retry_after
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        if self.calls <= self.throttled:
+            return FakeResponse({"Retry-After": self.retry_after}, status_code=429)
+        return FakeResponse({}, payload={"product": {"id": 1}})
+
+
+class SpyRateLimiter(ShopifyRateLimiter):
+    """Registra los bloqueos sin esperar, para que los tests no duerman."""
+
+    def __init__(self):
+        super().__init__()
+        self.blocks = []
+
+    def block(self, seconds):
+        self.blocks.append(seconds)
+
+
+def test_no_espera_con_el_bucket_vacio():
+    """Mientras haya lugar en el bucket no se bloquea."""
+    limiter = ShopifyRateLimiter(bucket_size=40, margin=2)
+    for _ in range(38):
+        assert limiter.reserve() == 0
+
+
+def test_espera_cuando_el_bucket_esta_casi_lleno():
+    """Con el header de Shopify casi lleno se espera lo que tarda en vaciarse."""
+    limiter = ShopifyRateLimiter(bucket_size=40, margin=2)
+    limiter.reserve()
+    limiter.release(FakeResponse({"X-Shopify-Shop-Api-Call-Limit": "39/40"}))
+
+    # 39 + 1 - 38 = 2 llamadas de mas, a 2 llamadas por segundo
+    assert limiter.reserve() == approx(1.0, abs=0.05)
+
+
+def test_bucket_de_shopify_plus():
+    """El tamaño del bucket se toma del header."""
+    limiter = ShopifyRateLimiter()
+    limiter.reserve()
+    limiter.release(FakeResponse({"X-Shopify-Shop-Api-Call-Limit": "10/80"}))
+    assert limiter.bucket_size == 80
+    assert limiter.leak_rate == 4
+    assert limiter.reserve() == 0
+
+
+def test_retry_after_bloquea():
+    limiter = ShopifyRateLimiter()
+    limiter.block(3)
+    assert limiter.reserve() == approx(3, abs=0.05)
+
+
+def test_graphql_throttle_status():
+    """Se respetan los puntos informados por extensions.cost.throttleStatus."""
+    limiter = ShopifyRateLimiter()
+    limiter.update_from_graphql({
+        "extensions": {
+            "cost": {
+                "throttleStatus": {
+                    "maximumAvailable": 2000.0,
+                    "currentlyAvailable": 50.0,
+                    "restoreRate": 100.0
+                }
+            }
+        }
+    })
+    assert limiter.reserve_graphql(10) == 0
+    # Quedan 40 puntos, faltan 60 a 100 por segundo
+    assert limiter.reserve_graphql(100) == approx(0.6, abs=0.05)
+
+
+def test_resuelve_varios_handles_por_llamada():
+    session = FakeSession()
+    shopify = Shopify(rate_limiter=ShopifyRateLimiter(), session=session)
+
+    products = shopify.fetch_shopify_variants_by_handles([1, 2, 2, 3, "404"], chunk_size=2)
+
+    assert len(session.calls) == 2
+    assert session.calls[0]["handle"] == "1,2"
+    assert set(products) == {"1", "2", "3"}
+    assert products["3"]["variants"][0]["sku"] == "3-1"
+
+
+def test_setea_el_stock_en_una_sola_mutation():
+    session = FakeSession()
+    shopify = Shopify(rate_limiter=ShopifyRateLimiter(), session=session)
+
+    errors = shopify.set_inventory_quantities([
+        {"inventory_item_id": 1, "location_id": "99", "quantity": 5},
+        {"inventory_item_id": 2, "location_id": "99", "quantity": 0},
+    ])
+
+    quantities = session.calls[0]["variables"]["input"]["quantities"]
+    assert len(quantities) == 2
+    assert quantities[0] == {
+        "inventoryItemId": "gid://shopify/InventoryItem/1",
+        "locationId": "gid://shopify/Location/99",
+        "quantity": 5
+    }
+    assert errors == [None, None]
+
+
+def test_conecta_el_item_nuevo_al_deposito_de_la_tienda():
+    """inventorySetQuantities no conecta el item al deposito: se activa ahi con su stock."""
+    session = FakeSession()
+    shopify = Shopify(rate_limiter=ShopifyRateLimiter(), session=session)
+
+    errors = shopify.set_inventory_quantities([
+        {"inventory_item_id": 1, "location_id": "99", "quantity": 5},
+        {"inventory_item_id": 2, "location_id": "99", "quantity": 3},
+    ])
+
+    assert errors == [None, None]
+    assert len(session.calls) == 2
+    assert session.calls[1]["variables"] == {
+        "inventoryItemId": "gid://shopify/InventoryItem/2",
+        "locationId": "gid://shopify/Location/99",
+        "available": 3
+    }
+
+    session = FakeSession(activate_fails=True)
+    shopify = Shopify(rate_limiter=ShopifyRateLimiter(), session=session)
+    errors = shopify.set_inventory_quantities([{"inventory_item_id": 1, "location_id": "99", "quantity": 5},
+                                               {"inventory_item_id": 2, "location_id": "99", "quantity": 3}])
+    assert errors[0] is None
+    assert "Location not found" in errors[1]
+
+
+def test_cliente_async_pide_las_tandas_en_paralelo():
+    calls = []
+
+    def handler(request):
+        handles = request.url.params["handle"].split(",")
+        calls.append(handles)
+        return httpx.Response(200, json={"products": [{"id": int(handle), "handle": handle, "variants": []} for handle in handles]})
+
+    shopify = AsyncShopify(rate_limiter=ShopifyRateLimiter(),
+                           client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    shopify.SHOPIFY_API_URL = "http://shopify/admin/api/test"
+    products = run_async(shopify.fetch_shopify_variants_by_handles(range(1, 6), chunk_size=2))
+
+    assert sorted(calls) == [["1", "2"], ["3", "4"], ["5"]]
+    assert set(products) == {"1", "2", "3", "4", "5"}
+
+
+def test_reintenta_los_429_respetando_el_retry_after():
+    limiter = SpyRateLimiter()
+    session = ThrottledSession(throttled=2)
+    shopify = Shopify(rate_limiter=limiter, session=session)
+
+    response = shopify._request("GET", "http://shopify/products/1.json")
+
+    assert response.status_code == 200
+    assert session.calls == 3
+    assert limiter.blocks == [1.5, 1.5]
+
+
+def test_devuelve_el_ultimo_429_al_agotar_los_reintentos():
+    limiter = SpyRateLimiter()
+    session = ThrottledSession(throttled=100)
+    shopify = Shopify(rate_limiter=limiter, session=session)
+
+    response = shopify._request("GET", "http://shopify/products/1.json")
+
+    assert response.status_code == 429
+    assert session.calls == Shopify.MAX_RETRIES + 1
+    assert len(limiter.blocks) == Shopify.MAX_RETRIES
+
+
+def test_el_cliente_async_reintenta_los_429_igual_que_el_sincronico():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) <= 2:
+            return httpx.Response(429, headers={"Retry-After": "1.5"})
+        return httpx.Response(200, json={"product": {"id": 1}})
+
+    limiter = SpyRateLimiter()
+    shopify = AsyncShopify(rate_limiter=limiter, client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    response = run_async(shopify._request("GET", "http://shopify/products/1.json"))
+
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert limiter.blocks == [1.5, 1.5]
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone
+
+from app.storage import Database, MappingStore, FingerprintStore, WatermarkStore, CheckpointStore, InventoryStore, ImageManifestStore
+
+PRODUCTO_SHOPIFY = {
+    "id": 10,
+    "handle": "123",
+    "variants": [
+        {"id": 1, "sku": "55", "inventory_item_id": 100, "admin_graphql_api_id": "gid://shopify/ProductVariant/1"},
+        {"id": 2, "sku": "56", "inventory_item_id": 101, "admin_graphql_api_id": "gid://shopify/ProductVariant/2"},
+    ],
+}
+
+
+def test_guarda_el_mapeo_desde_la_respuesta(tmp_path):
+    store = MappingStore(Database(str(tmp_path / "sync.db")))
+    store.save_product("111111", PRODUCTO_SHOPIFY, "999")
+
+    assert store.get_product(123)["shopify_product_id"] == 10
+
+    variante = store.get_variant(55)
+    assert variante["tn_product_id"] == "123"
+    assert variante["shopify_variant_id"] == 1
+    assert variante["inventory_item_id"] == 100
+    assert variante["location_id"] == "999"
+
+    assert store.get_variant_by_shopify_id(2)["tn_variant_id"] == "56"
+    assert len(store.get_variants_by_product("123")) == 2
+
+
+def test_el_mapeo_sobrevive_un_reinicio(tmp_path):
+    path = str(tmp_path / "sync.db")
+    MappingStore(Database(path)).save_product("111111", PRODUCTO_SHOPIFY)
+
+    store = MappingStore(Database(path))
+    assert store.get_variant("55")["shopify_variant_id"] == 1
+    assert store.get_variant("999") is None
+
+
+def test_huella_del_ultimo_push(tmp_path):
+    store = FingerprintStore(Database(str(tmp_path / "sync.db")))
+    assert store.get(123) is None
+
+    store.save(123, "111111", "abc")
+    assert store.get("123") == "abc"
+
+    store.delete(123)
+    assert store.get(123) is None
+
+
+def test_marca_de_agua_con_zona_horaria(tmp_path):
+    store = WatermarkStore(Database(str(tmp_path / "sync.db")))
+    assert store.get("111111", "products") is None
+
+    store.save("111111", "products", datetime(2025, 1, 1, 12, 0))
+    watermark = store.get("111111", "products")
+    assert watermark == datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+    assert store.get("111111", "stock") is None
+
+
+def test_la_marca_de_agua_no_retrocede(tmp_path):
+    store = WatermarkStore(Database(str(tmp_path / "sync.db")))
+    store.advance("111111", "products", datetime(2025, 1, 1, 12, 0))
+    store.advance("111111", "products", datetime(2025, 1, 2, tzinfo=timezone.utc))
+    # Un sync completo que arranco antes no pisa la marca de un incremental posterior
+    store.advance("111111", "products", datetime(2025, 1, 1, 18, 0, tzinfo=timezone.utc))
+    assert store.get("111111", "products") == datetime(2025, 1, 2, tzinfo=timezone.utc)
+
+
+def test_espejo_de_stock(tmp_path):
+    store = InventoryStore(Database(str(tmp_path / "sync.db")))
+    assert store.get(100, "99") is None
+
+    store.save_many([(100, "99", 5), (100, "1", 0), (101, "99", 2)])
+    assert store.get("100", 99) == 5
+    assert store.get(100, 1) == 0
+    assert store.get(101, "99") == 2
+
+    store.delete(100, "99")
+    assert store.get(100, "99") is None
+
+
+def test_checkpoint_retoma_la_corrida(tmp_path):
+    """Despues de un reinicio se retoma la misma corrida y se saltea lo que ya termino."""
+    path = str(tmp_path / "sync.db")
+    store = CheckpointStore(Database(path))
+    run_id = store.start_or_resume("update_all_products")
+    store.mark(run_id, "111111", 1, True)
+    store.mark(run_id, "111111", 2, False, "timeout")
+
+    store = CheckpointStore(Database(path))
+    assert store.unfinished_run("update_all_products") == run_id
+    assert store.start_or_resume("update_all_products") == run_id
+    assert store.skipped_products(run_id, "111111") == {"1"}
+    assert store.failed_products(run_id, "111111") == {"2": "timeout"}
+
+    store.finish_store(run_id, "111111")
+    assert store.store_finished(run_id, "111111")
+    assert not store.store_finished(run_id, "222222")
+
+    store.finish_run(run_id)
+    assert store.unfinished_run("update_all_products") is None
+    assert store.start_or_resume("update_all_products") != run_id
+
+
+def test_checkpoint_agota_los_reintentos(tmp_path):
+    store = CheckpointStore(Database(str(tmp_path / "sync.db")))
+    run_id = store.start_or_resume("update_all_products")
+    for _ in range(CheckpointStore.MAX_ATTEMPTS):
+        store.mark(run_id, "111111", 2, False, "error")
+
+    assert store.failed_products(run_id, "111111") == {}
+    assert store.skipped_products(run_id, "111111") == {"2"}
+
+
+def test_manifiesto_de_imagenes(tmp_path):
+    store = ImageManifestStore(Database(str(tmp_path / "sync.db")))
+    assert store.get(123, 10) is None
+
+    store.replace(123, 10, [])
+    assert store.get(123, 10) == {}
+    # Es de otro producto de Shopify (se volvio a crear): no sirve
+    assert store.get(123, 11) is None
+
+    store.save_image(123, {"tn_image_id": 777, "shopify_image_id": 900, "src": "http://img", "position": 1, "variant_ids": [2, 1]})
+    assert store.get(123, 10)["777"] == {
+        "tn_image_id": "777", "shopify_image_id": 900, "src": "http://img", "position": 1, "variant_ids": [1, 2]
+    }
+    assert store.get(123, 10, max_age=timedelta(seconds=-1)) is None
+
+    store.delete_image(777)
+    assert store.get(123, 10) == {}
+    store.delete_product(123)
+    assert store.get(123, 10) is None
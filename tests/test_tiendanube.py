@@ -0,0 +1,140 @@
+import httpx
+import threading
+
+from pytest import approx
+
+from app.aio import run_async
+from app.Tiendanube import AsyncTiendanube, ProductListing, TiendanubeRateLimiter, get_rate_limiter
+
+
+class FakeResponse():
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class FakeTiendanube():
+    """Catalogo de productos con ids 1..total (el id es el orden de creacion)."""
+
+    def __init__(self, total, fail_page=None, send_total=True, barrier=None):
+        self.total = total
+        self.fail_page = fail_page
+        self.send_total = send_total
+        # Las paginas despues de la primera esperan a que esten todas pedidas a la vez
+        self.barrier = barrier
+        self.calls = []
+
+    def get_products_page(self, url, headers, params):
+        self.calls.append(params)
+        if self.barrier and params["page"] > 1:
+            self.barrier.wait(timeout=5)
+        total = self.total if self.send_total else None
+        if params["page"] == self.fail_page:
+            return None, None
+        ids = list(range(1, self.total + 1))
+        if params["sort_by"] == "created-at-descending":
+            ids.reverse()
+        start = (params["page"] - 1) * params["per_page"]
+        return [{"id": i} for i in ids[start:start + params["per_page"]]], total
+
+
+def test_un_limitador_por_token():
+    """Cada tienda tiene su propio bucket."""
+    tienda_a = get_rate_limiter({"Authentication": "bearer a"})
+    tienda_b = get_rate_limiter({"Authentication": "bearer b"})
+    assert tienda_a is not tienda_b
+    assert get_rate_limiter({"Authentication": "bearer a"}) is tienda_a
+
+
+def test_sincroniza_con_los_headers():
+    """Con pocas llamadas restantes se espera segun la tasa informada por x-rate-limit-reset."""
+    limiter = TiendanubeRateLimiter(bucket_size=40, margin=1)
+    assert limiter.reserve() == 0
+    limiter.release(FakeResponse({
+        "x-rate-limit-limit": "40",
+        "x-rate-limit-remaining": "1",
+        "x-rate-limit-reset": "19500",
+    }))
+    # 39 usadas que se vacian en 19.5s -> 2 por segundo; 39 + 1 - 39 = 1 llamada de mas
+    assert limiter.leak_rate == approx(2.0)
+    assert limiter.reserve() == approx(0.5, abs=0.05)
+
+
+def test_sin_headers_no_cambia_el_bucket():
+    limiter = TiendanubeRateLimiter()
+    limiter.reserve()
+    limiter.release(FakeResponse({}))
+    assert limiter.pending == 0
+    assert limiter.reserve() == 0
+
+
+def test_listado_pide_las_paginas_a_medida_que_se_recorre():
+    client = FakeTiendanube(5, send_total=False)
+    listing = ProductListing(client, "url", {}, per_page=2)
+    products = iter(listing)
+
+    assert next(products) == {"id": 5}
+    assert len(client.calls) == 1
+    assert [p["id"] for p in products] == [4, 3, 2, 1]
+    assert len(client.calls) == 3
+    assert listing.complete
+
+
+def test_listado_del_mas_viejo_al_mas_nuevo_lo_pide_ordenado_a_la_api():
+    client = FakeTiendanube(5)
+    listing = ProductListing(client, "url", {}, per_page=2, oldest_first=True)
+
+    assert [p["id"] for p in listing] == [1, 2, 3, 4, 5]
+    assert {params["sort_by"] for params in client.calls} == {"created-at-ascending"}
+
+
+def test_listado_con_limite_trae_los_mas_nuevos():
+    client = FakeTiendanube(5)
+    listing = ProductListing(client, "url", {}, per_page=2, limit=3, oldest_first=True)
+
+    assert [p["id"] for p in listing] == [3, 4, 5]
+    assert len(client.calls) == 2
+
+
+def test_listado_pide_las_paginas_en_paralelo_sin_perder_el_orden():
+    """Con x-total-count las paginas se piden en paralelo y salen en orden."""
+    # Las 9 paginas que siguen a la primera solo pasan la barrera si se piden juntas;
+    # pedidas de a una, la barrera se rompe por timeout
+    barrier = threading.Barrier(9)
+    client = FakeTiendanube(20, barrier=barrier)
+    listing = ProductListing(client, "url", {}, per_page=2, workers=10)
+
+    ids = [p["id"] for p in listing]
+
+    assert not barrier.broken
+    assert listing.complete
+    assert ids == list(range(20, 0, -1))
+    assert sorted(params["page"] for params in client.calls) == list(range(1, 11))
+
+
+def test_listado_incompleto_si_falla_una_pagina():
+    client = FakeTiendanube(5, fail_page=2)
+    listing = ProductListing(client, "url", {}, per_page=2)
+
+    assert [p["id"] for p in listing] == [5, 4]
+    assert not listing.complete
+
+
+def test_cliente_async_reintenta_el_429_y_comparte_el_limitador():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"x-rate-limit-reset": "10"})
+        return httpx.Response(200, json=[{"id": 55, "stock": 3}],
+                              headers={"x-rate-limit-limit": "40", "x-rate-limit-remaining": "30", "x-rate-limit-reset": "5000"})
+
+    headers = {"Authentication": "bearer async"}
+    client = AsyncTiendanube(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    response = run_async(client.update_stock("http://tn/products/1/variants/stock", headers, {"value": -1}))
+
+    assert response == [{"id": 55, "stock": 3}]
+    assert len(calls) == 2
+    # El bucket de la tienda es el mismo que usa el cliente sincronico
+    assert get_rate_limiter(headers).bucket_size == 40
+    assert get_rate_limiter(headers).used == approx(10, abs=1)
@@ -2,7 +2,7 @@ import os
 import sys
 
 from pytest import approx
-from app.utils import calculate_price
+from app.utils import calculate_price, calculate_fingerprint, calculate_watermark, parse_datetime
 
 # Agregar el directorio raíz al path
 sys.path.insert(0, os.path.abspath('..'))
@@ -85,3 +85,27 @@ def test_rangos_personalizados():
     for precio, promo, esperado in casos:
         resultado = calculate_price(precio, promo, rangos)
         assert resultado == esperado, f"Error en {precio}: {resultado} != {esperado}"
+
+
+def test_huella_estable():
+    """La huella no depende del orden de las claves y cambia si cambia algun valor."""
+    payload = {"title": "Remera", "variants": [{"sku": 1, "price": 1350.0}], "tags": ["hombre"]}
+    mismo_payload = {"tags": ["hombre"], "variants": [{"price": 1350.0, "sku": 1}], "title": "Remera"}
+    otro_precio = {"title": "Remera", "variants": [{"sku": 1, "price": 1400.0}], "tags": ["hombre"]}
+
+    assert calculate_fingerprint(payload) == calculate_fingerprint(mismo_payload)
+    assert calculate_fingerprint(payload) != calculate_fingerprint(otro_precio)
+
+
+def test_marca_de_agua():
+    """La marca de agua avanza hasta lo procesado, frena en lo que fallo y nunca retrocede."""
+    actual = parse_datetime("2025-01-01T10:00:00+0000")
+    a = parse_datetime("2025-01-01T11:00:00+0000")
+    b = parse_datetime("2025-01-01T09:00:00-03:00")  # 12:00 UTC
+    c = parse_datetime("2025-01-01T13:00:00+0000")
+
+    assert calculate_watermark(actual, []) == actual
+    assert calculate_watermark(actual, [(a, True), (b, True)]) == b
+    assert calculate_watermark(actual, [(a, True), (b, False), (c, True)]) == b
+    assert calculate_watermark(c, [(a, True)]) == c
+    assert calculate_watermark(None, [(a, True)]) == a
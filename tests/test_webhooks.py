@@ -0,0 +1,144 @@
+import asyncio
+
+from datetime import datetime, timedelta, timezone
+
+from app.storage import Database, OrderQueueStore, WebhookLedgerStore
+from app.webhooks import IdempotencyLedger, OrderQueueWorker
+
+
+def resolve(line_item):
+    return {"vendor": "111111", "product_id": "123", "variant_id": str(line_item["sku"]), "quantity": line_item["quantity"]}
+
+
+def order(order_id, *skus):
+    return {"id": order_id, "line_items": [{"id": sku, "sku": sku, "quantity": 1} for sku in skus]}
+
+
+def test_junta_los_descuentos_de_la_misma_variante(tmp_path):
+    queue = OrderQueueStore(Database(str(tmp_path / "sync.db")))
+    calls = []
+    worker = OrderQueueWorker(queue, resolve, lambda *args: calls.append(args) or True)
+
+    queue.enqueue(1, order(1, 55, 56))
+    queue.enqueue(2, order(2, 55))
+    queue.enqueue(3, order(3, 55))
+
+    assert worker.drain() == 2
+    assert sorted(calls) == [("111111", "123", "55", 3), ("111111", "123", "56", 1)]
+    assert queue.pending_orders() == []
+    assert queue.pending_decrements() == []
+
+
+def test_lo_que_falla_queda_en_la_cola(tmp_path):
+    path = str(tmp_path / "sync.db")
+    queue = OrderQueueStore(Database(path))
+    queue.enqueue(1, order(1, 55))
+    OrderQueueWorker(queue, resolve, lambda *args: False).drain()
+
+    # Despues de un reinicio se retoma el descuento, sin volver a resolver el pedido
+    calls = []
+    queue = OrderQueueStore(Database(path))
+    assert queue.pending_orders() == []
+    OrderQueueWorker(queue, resolve, lambda *args: calls.append(args) or True).drain()
+    assert calls == [("111111", "123", "55", 1)]
+
+
+def test_los_reintentos_se_descartan(tmp_path):
+    path = str(tmp_path / "sync.db")
+    ledger = IdempotencyLedger(WebhookLedgerStore(Database(path)))
+
+    assert ledger.claim("abc", 1)
+    assert not ledger.claim("abc", 1)
+    # El mismo pedido con otro webhook id tambien es repetido
+    assert not ledger.claim("def", 1)
+    assert ledger.claim("ghi", 2)
+
+    # Sin la memoria (reinicio) lo contesta la base
+    ledger = IdempotencyLedger(WebhookLedgerStore(Database(path)))
+    assert not ledger.claim("abc", 1)
+
+    ledger.release("ghi", 2)
+    assert ledger.claim("ghi", 2)
+
+
+def test_purga_las_claves_viejas(tmp_path):
+    store = WebhookLedgerStore(Database(str(tmp_path / "sync.db")))
+    store.claim(["webhook:abc"])
+
+    assert store.purge(datetime.now(timezone.utc) - timedelta(days=1)) == 0
+    assert store.purge(datetime.now(timezone.utc) + timedelta(seconds=1)) == 1
+    assert store.claim(["webhook:abc"])
+
+
+def test_con_update_async_manda_la_tanda_en_paralelo(tmp_path):
+    queue = OrderQueueStore(Database(str(tmp_path / "sync.db")))
+    in_flight = []
+    calls = []
+
+    async def update_stock(*args):
+        in_flight.append(args)
+        await asyncio.sleep(0.05)
+        calls.append((len(in_flight), args))
+        return args[2] != "56"
+
+    queue.enqueue(1, order(1, 55, 56, 57))
+    worker = OrderQueueWorker(queue, resolve, update_stock)
+
+    assert worker.drain() == 3
+    # Las tres llamadas arrancaron antes de que termine la primera
+    assert {count for count, _ in calls} == {3}
+    assert [d["tn_variant_id"] for d in queue.pending_decrements()] == ["56"]
+
+
+def test_los_line_items_sin_resolver_se_reintentan(tmp_path):
+    queue = OrderQueueStore(Database(str(tmp_path / "sync.db")))
+    queue.RETRY_DELAY = 0
+    conocidos = {55}
+    calls = []
+
+    def resolve_conocidos(line_item):
+        return resolve(line_item) if line_item["sku"] in conocidos else None
+
+    worker = OrderQueueWorker(queue, resolve_conocidos, lambda *args: calls.append(args) or True)
+    queue.enqueue(1, order(1, 55, 56))
+    worker.drain()
+
+    # El 55 sale ya; el pedido queda pendiente solo con el 56
+    assert calls == [("111111", "123", "55", 1)]
+    [(_, pendiente)] = queue.pending_orders()
+    assert [line_item["sku"] for line_item in pendiente["line_items"]] == [56]
+
+    conocidos.add(56)
+    worker.drain()
+    assert calls[1:] == [("111111", "123", "56", 1)]
+    assert queue.pending_orders() == []
+
+
+def test_los_reintentos_esperan_y_despues_quedan_fallidos(tmp_path):
+    queue = OrderQueueStore(Database(str(tmp_path / "sync.db")))
+    worker = OrderQueueWorker(queue, lambda line_item: None, lambda *args: True)
+    queue.enqueue(1, order(1, 55))
+    worker.drain()
+
+    # Hasta que pase el backoff no se vuelve a intentar
+    assert queue.pending_orders() == []
+
+    queue.RETRY_DELAY = 0
+    for _ in range(queue.MAX_ATTEMPTS):
+        queue.db.execute("UPDATE order_queue SET next_attempt_at = NULL")
+        worker.drain()
+    rows = queue.db.execute("SELECT status, attempts FROM order_queue")
+    assert (rows[0]["status"], rows[0]["attempts"]) == ("failed", queue.MAX_ATTEMPTS)
+    assert queue.pending_orders() == []
+
+
+def test_purga_los_pedidos_resueltos(tmp_path):
+    queue = OrderQueueStore(Database(str(tmp_path / "sync.db")))
+    queue.enqueue(1, order(1, 55))
+    queue.enqueue(2, order(2, 56))
+    OrderQueueWorker(queue, resolve, lambda *args: args[2] == "55").drain()
+
+    assert queue.purge(datetime.now(timezone.utc) - timedelta(days=1)) == (0, 0)
+    # El pedido 2 tiene un descuento pendiente: se conserva
+    assert queue.purge(datetime.now(timezone.utc) + timedelta(seconds=1)) == (1, 1)
+    assert [d["tn_variant_id"] for d in queue.pending_decrements()] == ["56"]